@@ -5,9 +5,11 @@ import os
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-import pandas as pd  # type: ignore
 from pngme.api import AsyncClient
 
+from pngme_feature_library.end_of_day import daily_total_balances, mean
+from pngme_feature_library.query import Query, fetch
+
 # We pull additional days of balance records before the time window because balances are
 # forward filled in time, so this gives us a higher likelihood of beginning the period
 # of interest with valid balance records for each institution rather than containing
@@ -15,6 +17,14 @@ from pngme.api import AsyncClient
 # forward fill a given balance observation to avoid overweighting stale data.
 BALANCE_VALID_FOR_DAYS = 10
 
+LOAN_BALANCES = Query(
+    "balances",
+    account_types=("loan",),
+    fields=("timestamp", "account_id", "balance"),
+)
+# Only the days with a transaction are needed, of any account type
+TRANSACTIONS = Query("transactions", fields=("timestamp",))
+
 
 async def get_average_end_of_day_loan_balance(
     api_client: AsyncClient,
@@ -33,108 +43,86 @@ async def get_average_end_of_day_loan_balance(
     Returns:
         If no balance data was found, return None.
     """
-    # Making the timestamps timezone aware to comply with the between() method called below
+    # Making the timestamps timezone aware, as they are in UTC
     utc_starttime = utc_starttime.replace(tzinfo=timezone.utc)
     utc_endtime = utc_endtime.replace(tzinfo=timezone.utc)
 
     institutions = await api_client.institutions.get(user_uuid=user_uuid)
+    institution_ids = [institution["institution_id"] for institution in institutions]
 
     # We pull an additional 10 days of balance records before the time window because
     # balances are forward filled in time, so this gives us a higher likelihood of
     # beginning the period of interest with valid balance records for each institution
     # rather than containing null values for each institution.
-    balances_coroutines = []
-    transactions_coroutines = []
-    for institution in institutions:
-        balances_coroutines.append(
-            api_client.balances.get(
-                user_uuid=user_uuid,
-                institution_id=institution["institution_id"],
-                utc_starttime=utc_starttime - timedelta(days=BALANCE_VALID_FOR_DAYS),
-                utc_endtime=utc_endtime,
-            )
-        )
-        transactions_coroutines.append(
-            api_client.transactions.get(
-                user_uuid=user_uuid,
-                institution_id=institution["institution_id"],
-                utc_starttime=utc_starttime,
-                utc_endtime=utc_endtime,
-            )
-        )
-
-    balances_by_institution = await asyncio.gather(*balances_coroutines)
-    transactions_by_institution = await asyncio.gather(*transactions_coroutines)
+    balances_starttime = utc_starttime - timedelta(days=BALANCE_VALID_FOR_DAYS)
+    balances_by_institution, transactions_by_institution = await asyncio.gather(
+        fetch(
+            api_client,
+            LOAN_BALANCES,
+            user_uuid,
+            institution_ids,
+            balances_starttime,
+            utc_endtime,
+        ),
+        fetch(
+            api_client,
+            TRANSACTIONS,
+            user_uuid,
+            institution_ids,
+            utc_starttime,
+            utc_endtime,
+        ),
+    )
 
     balances_flattened = []
     for ix, balances in enumerate(balances_by_institution):
-        institution_id = institutions[ix]["institution_id"]
+        institution_id = institution_ids[ix]
         # We append the institution_id to each record so that we can group the records
         # by institution_id and account_id
         for balance in balances:
             balance["institution_id"] = institution_id
             balances_flattened.append(balance)
 
-    # if we have no balance records whatsoever over the target time-period, then return null
     if len(balances_flattened) == 0:
-        return None
+        # The first page of balances of every account type tells users without any
+        # balance records over the target time-period, for whom we return null, from
+        # those with balances but no loan-account data, whom we assume to have no loan
+        # accounts, and an appropriate avg_eod_loan_balance is zero
+        first_pages = await asyncio.gather(
+            *[
+                api_client.balances.get(
+                    user_uuid=user_uuid,
+                    institution_id=institution_id,
+                    utc_starttime=balances_starttime,
+                    utc_endtime=utc_endtime,
+                    page=1,
+                )
+                for institution_id in institution_ids
+            ]
+        )
+        if not any(first_pages):
+            return None
+        return 0.0
 
     transactions_flattened = []
     for ix, transactions in enumerate(transactions_by_institution):
         for transaction in transactions:
             transactions_flattened.append(transaction)
 
-    transactions_df = pd.DataFrame(transactions_flattened)
-    transactions_df["timestamp"] = pd.to_datetime(transactions_df["timestamp"])
-    transactions_df = transactions_df.sort_values("timestamp")
-    transactions_df["yyyymmdd"] = transactions_df["timestamp"].dt.floor("D")
-
-    balances_df = pd.DataFrame(balances_flattened)
-    balances_df = balances_df[balances_df["account_type"] == "loan"]
-
-    # if we did not exit above (hence have some balance data), but, don't have loan-account data,
-    # then assume that the user has no loan accounts, and an appropriate avg_eod_loan_balance is zero
-    if len(balances_df) == 0:
-        return 0.0
-
-    balances_df["timestamp"] = pd.to_datetime(balances_df["timestamp"])
-    balances_df = balances_df.sort_values("timestamp")
-    balances_df["yyyymmdd"] = balances_df["timestamp"].dt.floor("D")
-
-    # Find last balance record on any given day
-    eod_balances = (
-        balances_df.groupby(["yyyymmdd", "account_id", "institution_id"])
-        .tail(1)
-        .set_index("yyyymmdd")
+    # Total the end-of-day balances of all accounts on each day with a balance or
+    # transaction, carrying balances forward in time
+    daily_total_balance_on_active_days = daily_total_balances(
+        balances_flattened,
+        transactions_flattened,
+        utc_starttime,
+        utc_endtime,
+        BALANCE_VALID_FOR_DAYS,
     )
 
-    # Carry balance amounts forward in time
-    index = pd.date_range(utc_starttime, utc_endtime, freq="D", name="yyyymmdd")
-    ffilled_balances = (
-        eod_balances.groupby(["institution_id", "account_id"])["balance"]
-        .apply(lambda df: df.reindex(index).ffill(limit=BALANCE_VALID_FOR_DAYS))
-        .reset_index()
-    )
-
-    ffilled_balances_in_time_window = ffilled_balances[
-        ffilled_balances["yyyymmdd"].between(utc_starttime, utc_endtime)
-    ]
-
-    if len(ffilled_balances_in_time_window) == 0:
+    if daily_total_balance_on_active_days is None:
         return None
 
-    daily_total_balance = ffilled_balances_in_time_window.groupby(["yyyymmdd"])[
-        "balance"
-    ].sum(min_count=1)
-
-    # Include only balances on days the user received a balance or transaction
-    active_days = pd.concat(
-        [balances_df["yyyymmdd"], transactions_df["yyyymmdd"]]
-    ).unique()
-    row_mask = daily_total_balance.index.isin(active_days)
-    daily_total_balance_on_active_days = daily_total_balance.loc[row_mask]
-
-    return daily_total_balance_on_active_days.mean()
+    return mean(daily_total_balance_on_active_days)
 
 
 if __name__ == "__main__":
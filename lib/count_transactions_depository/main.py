@@ -5,6 +5,16 @@ from datetime import datetime, timedelta
 
 from pngme.api import AsyncClient
 
+from pngme_feature_library.query import Query, fetch
+
+# Depository transactions moving money in or out; only how many there are is needed
+DEPOSITORY_TRANSACTIONS = Query(
+    "transactions",
+    account_types=("depository",),
+    impacts=("CREDIT", "DEBIT"),
+    fields=(),
+)
+
 
 async def get_count_transactions_depository(
     api_client: AsyncClient,
@@ -32,25 +42,19 @@ async def get_count_transactions_depository(
             institutions_w_depository.append(inst)
 
     # STEP 2: get all depository transactions for all institutions
-    transaction_inst_coroutines = []
-    for inst in institutions_w_depository:
-        transaction_inst_coroutines.append(
-            api_client.transactions.get(
-                account_types=["depository"],
-                user_uuid=user_uuid,
-                institution_id=inst["institution_id"],
-                utc_starttime=utc_starttime,
-                utc_endtime=utc_endtime,
-            )
-        )
+    transactions_per_institution = await fetch(
+        api_client,
+        DEPOSITORY_TRANSACTIONS,
+        user_uuid,
+        [inst["institution_id"] for inst in institutions_w_depository],
+        utc_starttime,
+        utc_endtime,
+    )
 
     # STEP 3: Get the count of all depository transactions
     depository_transactions_count = 0
-    transactions_per_institution = await asyncio.gather(*transaction_inst_coroutines)
     for transactions in transactions_per_institution:
-        for transaction in transactions:
-            if transaction["impact"] == "CREDIT" or transaction["impact"] == "DEBIT":
-                depository_transactions_count += 1
+        depository_transactions_count += len(transactions)
 
     return depository_transactions_count
 
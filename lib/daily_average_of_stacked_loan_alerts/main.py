@@ -1,13 +1,14 @@
 #!/usr/bin/env python3
 import asyncio
-import math
 import os
-import pandas as pd
 
 from datetime import datetime, timedelta
 
 from pngme.api import AsyncClient
 
+from pngme_feature_library.query import Query, fetch
+from pngme_feature_library.stacked_loans import StackedLoans
+
 LOAN_ACTIVITY_LABELS = {
     "LoanDefaulted",
     "LoanMissedPayment",
@@ -18,6 +19,12 @@ LOAN_ACTIVITY_LABELS = {
     "LoanRepaymentReminder",
 }
 
+# Alerts related to loan activity; the API only returns those with a loan label
+LOAN_ALERTS = Query(
+    "alerts", labels=tuple(sorted(LOAN_ACTIVITY_LABELS)), fields=("timestamp",)
+)
+
+
 async def get_daily_average_of_stacked_loan_alerts(
     api_client: AsyncClient,
     user_uuid: str,
@@ -42,57 +49,33 @@ async def get_daily_average_of_stacked_loan_alerts(
     # STEP 1: fetch list of institutions belonging to the user
     institutions = await api_client.institutions.get(user_uuid=user_uuid)
 
-    # STEP 2: get a list of all transactions for each institution
-    alerts_inst_coroutines = []
-    for inst in institutions:
-        alerts_inst_coroutines.append(
-            api_client.alerts.get(
-                user_uuid=user_uuid,
-                institution_id=inst["institution_id"],
-                utc_starttime=utc_starttime,
-                utc_endtime=utc_endtime,
-            )
-        )
-
-    alerts_per_institution = await asyncio.gather(*alerts_inst_coroutines)
-    alerts_flattened = []
-    for institution_index, alerts in enumerate(alerts_per_institution):
-        for alert in alerts:
-            alert["institution_id"] = institutions[institution_index]["institution_id"]
-            alerts_flattened.append(alert)
+    # STEP 2: get a list of all loan alerts for each institution
+    alerts_per_institution = await fetch(
+        api_client,
+        LOAN_ALERTS,
+        user_uuid,
+        [inst["institution_id"] for inst in institutions],
+        utc_starttime,
+        utc_endtime,
+    )
 
-    # Keep only alerts related to loan activity
     loan_alerts = [
-        a
-        for a in alerts_flattened
-        if set(a["labels"]).intersection(LOAN_ACTIVITY_LABELS)
+        (alert["timestamp"], institutions[institution_index]["institution_id"])
+        for institution_index, alerts in enumerate(alerts_per_institution)
+        for alert in alerts
     ]
 
     if not loan_alerts:
         return 0
 
-    alerts_df = pd.DataFrame(loan_alerts)
-
-    unique_institution_ids = alerts_df.institution_id.unique()
-    if len(unique_institution_ids) == 1:
+    # Count the distinct institutions with loan activity on each day, days being
+    # counted from the earliest loan alert
+    stacked_loans = StackedLoans.from_alerts(loan_alerts)
+    if stacked_loans.num_institutions == 1:
         return 1
 
-    # As we want to group by day, we normalize the day index and append it to the df
-    alerts_df["timestamp"] = pd.to_datetime(alerts_df["timestamp"])
-    min_toc = alerts_df.timestamp.min().timestamp()
-    alerts_df["day_index"] = alerts_df["timestamp"].apply(
-        lambda x: math.floor(float(x.timestamp() - min_toc) / (60 * 60 * 24))
-    )
-
-    # Now we aggregate all the labels for the same day and institution
-    loan_activity_per_day = (
-        alerts_df.groupby(["day_index", "institution_id"])
-        .size()
-        .groupby("day_index")
-        .size()
-    )
+    return stacked_loans.mean() or 0.0
 
-    return float(loan_activity_per_day.mean())
 
 if __name__ == "__main__":
     # Mercy Otieno, mercy@pngme.demo.com, 254123456789
@@ -5,9 +5,10 @@ import os
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-import pandas as pd  # type: ignore
 from pngme.api import AsyncClient
 
+from pngme_feature_library.end_of_day import daily_total_balances, median
+
 # We pull additional days of balance records before the time window because balances are
 # forward filled in time, so this gives us a higher likelihood of beginning the period
 # of interest with valid balance records for each institution rather than containing
@@ -33,7 +34,7 @@ async def get_median_end_of_day_depository_balance(
     Returns:
         If no balance data was found, return None.
     """
-    # Making the timestamps timezone aware to comply with the between() method called below
+    # Making the timestamps timezone aware, as they are in UTC
     utc_starttime = utc_starttime.replace(tzinfo=timezone.utc)
     utc_endtime = utc_endtime.replace(tzinfo=timezone.utc)
 
@@ -86,50 +87,20 @@ async def get_median_end_of_day_depository_balance(
         for transaction in transactions:
             transactions_flattened.append(transaction)
 
-    transactions_df = pd.DataFrame(transactions_flattened)
-    transactions_df["timestamp"] = pd.to_datetime(transactions_df["timestamp"])
-    transactions_df = transactions_df.sort_values("timestamp")
-    transactions_df["yyyymmdd"] = transactions_df["timestamp"].dt.floor("D")
-
-    balances_df = pd.DataFrame(balances_flattened)
-    balances_df["timestamp"] = pd.to_datetime(balances_df["timestamp"])
-    balances_df = balances_df.sort_values("timestamp")
-    balances_df["yyyymmdd"] = balances_df["timestamp"].dt.floor("D")
-
-    # Find last balance record on any given day
-    eod_balances = (
-        balances_df.groupby(["yyyymmdd", "account_id", "institution_id"])
-        .tail(1)
-        .set_index("yyyymmdd")
-    )
-
-    # Carry balance amounts forward in time
-    index = pd.date_range(utc_starttime, utc_endtime, freq="D", name="yyyymmdd")
-    ffilled_balances = (
-        eod_balances.groupby(["institution_id", "account_id"])["balance"]
-        .apply(lambda df: df.reindex(index).ffill(limit=BALANCE_VALID_FOR_DAYS))
-        .reset_index()
+    # Total the end-of-day balances of all accounts on each day with a balance or
+    # transaction, carrying balances forward in time
+    daily_total_balance_on_active_days = daily_total_balances(
+        balances_flattened,
+        transactions_flattened,
+        utc_starttime,
+        utc_endtime,
+        BALANCE_VALID_FOR_DAYS,
     )
 
-    ffilled_balances_in_time_window = ffilled_balances[
-        ffilled_balances["yyyymmdd"].between(utc_starttime, utc_endtime)
-    ]
-
-    if len(ffilled_balances_in_time_window) == 0:
+    if daily_total_balance_on_active_days is None:
         return None
 
-    daily_total_balance = ffilled_balances_in_time_window.groupby(["yyyymmdd"])[
-        "balance"
-    ].sum(min_count=1)
-
-    # Include only balances on days the user received a balance or transaction
-    active_days = pd.concat(
-        [balances_df["yyyymmdd"], transactions_df["yyyymmdd"]]
-    ).unique()
-    row_mask = daily_total_balance.index.isin(active_days)
-    daily_total_balance_on_active_days = daily_total_balance.loc[row_mask]
-
-    return daily_total_balance_on_active_days.median()
+    return median(daily_total_balance_on_active_days)
 
 
 if __name__ == "__main__":
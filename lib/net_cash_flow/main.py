@@ -7,6 +7,8 @@ from typing import Optional
 
 from pngme.api import AsyncClient
 
+from pngme_feature_library.records import net_amounts, to_transactions
+
 
 async def get_net_cash_flow(
     api_client: AsyncClient,
@@ -52,22 +54,15 @@ async def get_net_cash_flow(
     transactions_by_institution = await asyncio.gather(*inst_coroutines)
 
     # STEP 3: Compute the net cash flow as the difference between cash-in and cash-out
-    cash_in_amount = 0
-    cash_out_amount = 0
-    count = 0
-    for transactions in transactions_by_institution:
-        for transaction in transactions:
-            if transaction["impact"] == "CREDIT":
-                cash_in_amount += transaction["amount"]
-                count += 1
-            elif transaction["impact"] == "DEBIT":
-                cash_out_amount += transaction["amount"]
-                count += 1
+    transactions = to_transactions(
+        transactions_by_institution,
+        [inst["institution_id"] for inst in institutions_w_depository],
+    )
+    net_cash_flow, count = net_amounts(transactions)
 
     if count == 0:
         return None
 
-    net_cash_flow = cash_in_amount - cash_out_amount
     return net_cash_flow
 
 
@@ -5,8 +5,17 @@ import os
 from datetime import datetime, timedelta
 from typing import Optional
 
-import pandas as pd  # type: ignore
 from pngme.api import AsyncClient
+from pngme_feature_library.query import Query, fetch
+from pngme_feature_library.weekly import WeeklyBuckets
+
+# Depository credits; debits are dropped as they are ingested
+CREDITS = Query(
+    "transactions",
+    account_types=("depository",),
+    impacts=("CREDIT",),
+    fields=("timestamp", "amount"),
+)
 
 
 async def get_standard_deviation_of_week_to_week_sum_of_credits(
@@ -14,6 +23,9 @@ async def get_standard_deviation_of_week_to_week_sum_of_credits(
 ) -> Optional[float]:
     """Compute the standard deviations of week-to-week sum of credits
 
+    Weeks are counted back from utc_endtime in whole 7-day periods, and weeks without
+    credits count as zero, see pngme_feature_library.weekly.
+
     Args:
         client: Pngme API client
         user_uuid: the Pngme user_uuid for the mobile phone user
@@ -32,42 +44,33 @@ async def get_standard_deviation_of_week_to_week_sum_of_credits(
         if "depository" in inst["account_types"]:
             institutions_w_depository.append(inst)
 
-    # Constructs a dataframe that contains transactions from all institutions for the user
-    coroutines = []
-    for institution in institutions_w_depository:
-        coroutines.append(
-            client.transactions.get(
-                user_uuid=user_uuid,
-                institution_id=institution["institution_id"],
-                utc_starttime=utc_starttime,
-                utc_endtime=utc_endtime,
-                account_types=["depository"],
-            )
-        )
-
-    transactions_by_institution = await asyncio.gather(*coroutines)
+    # Fetch depository credits from all institutions for the user
+    transactions_by_institution = await fetch(
+        client,
+        CREDITS,
+        user_uuid,
+        [institution["institution_id"] for institution in institutions_w_depository],
+        utc_starttime,
+        utc_endtime,
+    )
 
     # if no data available for the user, return None
     if len(transactions_by_institution) == 0:
         return None
 
-    record_list_flattened = []
+    credits = []
     for transactions in transactions_by_institution:
         for transaction in transactions:
-            # We cast as dictionary so we can generate a dataframe easily
-            record_list_flattened.append(dict(transaction))
-
-    record_df = pd.DataFrame(record_list_flattened)
-    credit_df = record_df[(record_df["impact"] == "CREDIT")]
+            if transaction["amount"] is not None:
+                timestamp = datetime.fromisoformat(transaction["timestamp"])
+                credits.append((timestamp, transaction["amount"]))
 
     # if no data available for credit, return None
-    if credit_df.empty:
+    if not credits:
         return None
 
-    credit_df["timestamp"] = pd.to_datetime(credit_df["timestamp"])
-    
-    std = credit_df.set_index("timestamp").resample("W").amount.sum().std()
-    return std
+    weekly_credits = WeeklyBuckets.from_records(credits, utc_starttime, utc_endtime)
+    return weekly_credits.std()
 
 
 if __name__ == "__main__":
@@ -7,6 +7,17 @@ from typing import Optional
 
 from pngme.api import AsyncClient
 
+from pngme_feature_library.query import Query, fetch
+from pngme_feature_library.records import sum_amounts, to_transactions
+
+# Depository credits; debits are dropped as they are ingested
+CREDITS = Query(
+    "transactions",
+    account_types=("depository",),
+    impacts=("CREDIT",),
+    fields=("amount",),
+)
+
 
 async def get_sum_of_credits(
     api_client: AsyncClient,
@@ -41,29 +52,22 @@ async def get_sum_of_credits(
         if "depository" in inst["account_types"]:
             institutions_w_depository.append(inst)
 
-    # STEP 2: get a list of all transactions for each institution
-    inst_coroutines = []
-    for inst in institutions_w_depository:
-        inst_coroutines.append(
-            api_client.transactions.get(
-                user_uuid=user_uuid,
-                institution_id=inst["institution_id"],
-                utc_starttime=utc_starttime,
-                utc_endtime=utc_time,
-                account_types=["depository"],
-            )
-        )
-
-    transactions_by_institution = await asyncio.gather(*inst_coroutines)
+    # STEP 2: get a list of all credit transactions for each institution
+    transactions_by_institution = await fetch(
+        api_client,
+        CREDITS,
+        user_uuid,
+        [inst["institution_id"] for inst in institutions_w_depository],
+        utc_starttime,
+        utc_time,
+    )
 
     # STEP 3: now we sum up all the amounts of credit transactions for each institution
-    total = 0
-    count = 0
-    for transactions in transactions_by_institution:
-        for transaction in transactions:
-            if transaction["impact"] == "CREDIT" and transaction["amount"] is not None:
-                total += transaction["amount"]
-                count += 1
+    transactions = to_transactions(
+        transactions_by_institution,
+        [inst["institution_id"] for inst in institutions_w_depository],
+    )
+    total, count = sum_amounts(transactions)
 
     if count == 0:
         return None
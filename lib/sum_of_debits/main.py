@@ -7,6 +7,8 @@ from typing import Optional
 
 from pngme.api import AsyncClient
 
+from pngme_feature_library.records import sum_amounts, to_transactions
+
 
 async def get_sum_of_debits(
     api_client: AsyncClient,
@@ -57,13 +59,11 @@ async def get_sum_of_debits(
     transactions_by_institution = await asyncio.gather(*inst_coroutines)
 
     # STEP 3: now we sum up all the amounts of debit transactions for each institution
-    total = 0
-    count = 0
-    for transactions in transactions_by_institution:
-        for transaction in transactions:
-            if transaction["impact"] == "DEBIT" and transaction["amount"] is not None:
-                total += transaction["amount"]
-                count += 1
+    transactions = to_transactions(
+        transactions_by_institution,
+        [inst["institution_id"] for inst in institutions_w_depository],
+    )
+    total, count = sum_amounts(transactions, impact="DEBIT")
 
     if count == 0:
         return None
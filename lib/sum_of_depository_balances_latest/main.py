@@ -6,6 +6,12 @@ from typing import Optional
 
 from pngme.api import AsyncClient
 
+from pngme_feature_library.records import (
+    latest_balances,
+    sum_balances,
+    to_balances,
+)
+
 
 async def get_sum_of_depository_balances_latest(
     api_client: AsyncClient,
@@ -52,34 +58,20 @@ async def get_sum_of_depository_balances_latest(
 
     balances_by_institution = await asyncio.gather(*inst_coroutines)
 
-    # STEP 3: We flatten the lists of balances into a single list of balances
-    balances_flattened = []
-    for ix, inst_list in enumerate(balances_by_institution):
-        institution_id = institutions[ix]["institution_id"]
-        for balance in inst_list:
-            balance_dict = dict(balance)
-            balance_dict["institution_id"] = institution_id
-
-            balances_flattened.append(balance_dict)
+    # STEP 3: We flatten the lists of balances into a single list of compact balances
+    balances = to_balances(
+        balances_by_institution,
+        [inst["institution_id"] for inst in institutions_w_depository],
+    )
 
-    if len(balances_flattened) == 0:
+    if len(balances) == 0:
         return None
 
-    # STEP 4: Here we sort by timestamp so latest balances are on top
-    balances_flattened = sorted(
-        balances_flattened, key=lambda x: x["timestamp"], reverse=True
-    )
-
-    # STEP 5: Then we loop through all balances per institution and account and store the latest balance
-    latest_balances = {}
-    for loan_record in balances_flattened:
-        key = (loan_record["institution_id"], loan_record["account_id"])
-        if key not in latest_balances:
-            # As we go top-down, we only need to store the first balance we found for each institution+account
-            latest_balances[key] = loan_record["balance"]
+    # STEP 4: Then we find the latest balance of each institution and account
+    latest = latest_balances(balances)
 
-    # STEP 6: Finally, we can sum all the balances
-    sum_of_balances_latest = sum(latest_balances.values())
+    # STEP 5: Finally, we can sum all the balances
+    sum_of_balances_latest = sum_balances(latest.values())
 
     return sum_of_balances_latest
 
@@ -6,6 +6,14 @@ from datetime import datetime, timedelta
 
 from pngme.api import AsyncClient
 
+from pngme_feature_library.query import Query, fetch
+from pngme_feature_library.records import sum_amounts, to_transactions
+
+# Loan repayments are the credits of loan accounts
+REPAYMENTS = Query(
+    "transactions", account_types=("loan",), impacts=("CREDIT",), fields=("amount",)
+)
+
 
 async def get_sum_of_loan_repayments(
     api_client: AsyncClient,
@@ -39,27 +47,22 @@ async def get_sum_of_loan_repayments(
         if "loan" in inst["account_types"]:
             institutions_w_loan.append(inst)
 
-    # STEP 2: get a list of all transactions for each institution
-    inst_coroutines = []
-    for inst in institutions_w_loan:
-        inst_coroutines.append(
-            api_client.transactions.get(
-                user_uuid=user_uuid,
-                institution_id=inst["institution_id"],
-                utc_starttime=utc_starttime,
-                utc_endtime=utc_endtime,
-                account_types=["loan"],
-            )
-        )
-
-    transactions_by_institution = await asyncio.gather(*inst_coroutines)
+    # STEP 2: get a list of all credit transactions for each institution
+    transactions_by_institution = await fetch(
+        api_client,
+        REPAYMENTS,
+        user_uuid,
+        [inst["institution_id"] for inst in institutions_w_loan],
+        utc_starttime,
+        utc_endtime,
+    )
 
     # STEP 3: We add up all the credit transactions for each institution
-    repayments_sum = 0
-    for transactions in transactions_by_institution:
-        for transaction in transactions:
-            if transaction["impact"] == "CREDIT":
-                repayments_sum += transaction["amount"]
+    transactions = to_transactions(
+        transactions_by_institution,
+        [inst["institution_id"] for inst in institutions_w_loan],
+    )
+    repayments_sum, _ = sum_amounts(transactions)
 
     return repayments_sum
 
@@ -0,0 +1 @@
+"""Runtime utilities for computing the features in lib/ inside long-running services."""
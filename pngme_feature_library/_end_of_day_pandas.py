@@ -0,0 +1,67 @@
+"""pandas implementation of pngme_feature_library.end_of_day.daily_total_balances."""
+
+import math
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import pandas as pd  # type: ignore
+
+
+def daily_total_balances(
+    balances: List[Dict[str, Any]],
+    transactions: List[Dict[str, Any]],
+    utc_starttime: datetime,
+    utc_endtime: datetime,
+    balance_valid_for_days: int,
+) -> Optional[List[float]]:
+    # Making the timestamps timezone aware to comply with the between() method called below
+    utc_starttime = utc_starttime.replace(tzinfo=timezone.utc)
+    utc_endtime = utc_endtime.replace(tzinfo=timezone.utc)
+
+    transactions_df = pd.DataFrame(transactions, columns=["timestamp"])
+    transactions_df["timestamp"] = pd.to_datetime(transactions_df["timestamp"])
+    transactions_df = transactions_df.sort_values("timestamp")
+    transactions_df["yyyymmdd"] = transactions_df["timestamp"].dt.floor("D")
+
+    balances_df = pd.DataFrame(balances)
+    balances_df["timestamp"] = pd.to_datetime(balances_df["timestamp"])
+    balances_df = balances_df.sort_values("timestamp")
+    balances_df["yyyymmdd"] = balances_df["timestamp"].dt.floor("D")
+
+    # Find last balance record on any given day
+    eod_balances = (
+        balances_df.groupby(["yyyymmdd", "account_id", "institution_id"])
+        .tail(1)
+        .set_index("yyyymmdd")
+    )
+
+    # Carry balance amounts forward in time
+    index = pd.date_range(utc_starttime, utc_endtime, freq="D", name="yyyymmdd")
+    ffilled_balances = (
+        eod_balances.groupby(["institution_id", "account_id"])["balance"]
+        .apply(lambda df: df.reindex(index).ffill(limit=balance_valid_for_days))
+        .reset_index()
+    )
+
+    ffilled_balances_in_time_window = ffilled_balances[
+        ffilled_balances["yyyymmdd"].between(utc_starttime, utc_endtime)
+    ]
+
+    if len(ffilled_balances_in_time_window) == 0:
+        return None
+
+    daily_total_balance = ffilled_balances_in_time_window.groupby(["yyyymmdd"])[
+        "balance"
+    ].sum(min_count=1)
+
+    # Include only balances on days the user received a balance or transaction
+    active_days = pd.concat(
+        [balances_df["yyyymmdd"], transactions_df["yyyymmdd"]]
+    ).unique()
+    row_mask = daily_total_balance.index.isin(active_days)
+    daily_total_balance_on_active_days = daily_total_balance.loc[row_mask]
+
+    return [
+        math.nan if pd.isna(total) else float(total)
+        for total in daily_total_balance_on_active_days
+    ]
@@ -0,0 +1,102 @@
+"""Minimal asyncio HTTP/1.1 server used for local endpoints.
+
+Only what the metrics and feature endpoints need: GET requests, query strings,
+keep-alive connections and fixed-length responses. Not meant to face the internet.
+"""
+
+import asyncio
+import logging
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, List, NamedTuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    query: Dict[str, List[str]]
+    headers: Dict[str, str]
+
+
+class Response(NamedTuple):
+    status: int
+    body: bytes
+    content_type: str = "application/json"
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+def _encode_response(response: Response, keep_alive: bool) -> bytes:
+    head = (
+        f"HTTP/1.1 {response.status} {HTTPStatus(response.status).phrase}\r\n"
+        f"Content-Type: {response.content_type}\r\n"
+        f"Content-Length: {len(response.body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    )
+    return head.encode("latin-1") + response.body
+
+
+async def start_http_server(
+    handler: Handler, host: str, port: int
+) -> asyncio.AbstractServer:
+    """Serve ``handler`` on host:port until the returned server is closed."""
+
+    async def on_connection(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    writer.write(_encode_response(Response(400, b""), False))
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                # Request bodies are not used by any endpoint, but must be drained
+                content_length = int(headers.get("content-length") or 0)
+                if content_length:
+                    await reader.readexactly(content_length)
+
+                url = urlsplit(target)
+                request = Request(
+                    method=method.upper(),
+                    path=unquote(url.path),
+                    query=parse_qs(url.query),
+                    headers=headers,
+                )
+                try:
+                    response = await handler(request)
+                except Exception:
+                    logger.exception("Unhandled error serving %s", target)
+                    response = Response(500, b'{"error": "internal server error"}')
+
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                writer.write(_encode_response(response, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(on_connection, host, port)
@@ -0,0 +1,32 @@
+"""Selection of the library used to compute features that need array operations.
+
+The default ``python`` backend is built on the standard library only. The ``pandas``
+backend computes the same results with pandas, which is imported only once that
+backend is selected:
+
+    from pngme_feature_library.backend import set_backend
+
+    set_backend("pandas")
+
+The initial backend can also be chosen with the PNGME_FEATURE_LIBRARY_BACKEND
+environment variable.
+"""
+
+import os
+
+BACKENDS = ("python", "pandas")
+
+_backend = os.environ.get("PNGME_FEATURE_LIBRARY_BACKEND", "python")
+if _backend not in BACKENDS:
+    raise ValueError(f"Unknown backend {_backend!r}, expected one of {BACKENDS}")
+
+
+def get_backend() -> str:
+    return _backend
+
+
+def set_backend(name: str) -> None:
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {BACKENDS}")
+    _backend = name
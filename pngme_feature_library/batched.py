@@ -0,0 +1,455 @@
+"""Features for many users at once, as vectorized pandas operations.
+
+The features in lib/ compute one user at a time. For batch workloads, Batch holds the
+records of a whole population, concatenated into one DataFrame per resource and
+tagged with the ``user_uuid`` and ``institution_id`` they were fetched for, and each
+feature in BATCHED_FEATURES computes every user's value with a few groupbys:
+
+    batch = Batch(institutions, transactions, balances, alerts)
+    values = batch.compute(["sum_of_credits", "net_cash_flow"], utc_starttime, utc_endtime)
+    values.loc[user_uuid, "sum_of_credits"]
+
+``institutions`` holds one record per user and institution, with the ``user_uuid``,
+``institution_id`` and ``account_types`` of the institutions endpoint. The features
+follow the same rules as in lib/, and results agree with them up to floating-point
+rounding. Values are returned as float columns indexed by user_uuid, with NaN where
+the feature in lib/ returns None; counts are int columns.
+
+Requires pandas (``pip install -e ".[pandas]"``).
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+from .rollups import BALANCE_VALID_FOR_DAYS, LABEL_COUNT_FEATURES
+from .timestamps import EPOCH, MICROSECOND, to_microseconds
+
+MICROSECONDS_PER_DAY = 24 * 60 * 60 * 1_000_000
+MICROSECONDS_PER_WEEK = 7 * MICROSECONDS_PER_DAY
+
+Records = Union[pd.DataFrame, Sequence[Dict[str, Any]]]
+
+# Columns each resource needs, added as empty if the records don't have them
+_COLUMNS = {
+    "transactions": ("timestamp", "amount", "impact", "account_type"),
+    "balances": ("timestamp", "balance", "account_type", "account_id"),
+    "alerts": ("timestamp", "labels"),
+}
+_KEYS = ["user_uuid", "institution_id"]
+
+
+def _encode(frames: Sequence[pd.DataFrame], column: str, code_column: str) -> pd.Index:
+    """Add integer codes of a column shared by several frames, 0 for missing values.
+
+    Returns:
+        the values encoded, the value with code ``i`` at position ``i - 1``
+    """
+    codes, values = pd.factorize(
+        pd.concat([frame[column] for frame in frames], ignore_index=True)
+    )
+    offset = 0
+    for frame in frames:
+        frame[code_column] = codes[offset : offset + len(frame)] + 1
+        offset += len(frame)
+    return values
+
+
+def _frame(records: Records, columns: Sequence[str]) -> pd.DataFrame:
+    """Records as a DataFrame with a timestamp_us column, microseconds since the epoch.
+
+    The frame gets a fresh index, the position of each record, whatever the index of
+    the records given: frames concatenated per user repeat index values.
+    """
+    frame = pd.DataFrame(records).reset_index(drop=True)
+    for column in [*_KEYS, *columns]:
+        if column not in frame.columns:
+            frame[column] = None
+    timestamps = pd.to_datetime(frame["timestamp"], utc=True)
+    frame["timestamp_us"] = (
+        (timestamps - pd.Timestamp(EPOCH)) // pd.Timedelta(MICROSECOND)
+    ).astype("int64")
+    return frame
+
+
+class Batch:
+    """Records of many users, from which features are computed for all of them at once.
+
+    Args:
+        institutions: institution records tagged with user_uuid
+        transactions: transaction records tagged with user_uuid and institution_id
+        balances: balance records tagged with user_uuid and institution_id
+        alerts: alert records tagged with user_uuid and institution_id
+        user_uuids: the users to compute features for; by default every user with
+            institutions. Users without any records get the value the features in lib/
+            return for them.
+    """
+
+    def __init__(
+        self,
+        institutions: Records,
+        transactions: Records = (),
+        balances: Records = (),
+        alerts: Records = (),
+        user_uuids: Optional[Sequence[str]] = None,
+    ):
+        institutions = pd.DataFrame(institutions)
+        for column in [*_KEYS, "account_types"]:
+            if column not in institutions.columns:
+                institutions[column] = None
+        self.transactions = _frame(transactions, _COLUMNS["transactions"])
+        self.balances = _frame(balances, _COLUMNS["balances"])
+        self.alerts = _frame(alerts, _COLUMNS["alerts"])
+
+        # Records are grouped and matched by integer codes of their user, institution
+        # and account, which is much faster than by strings
+        frames = [institutions, self.transactions, self.balances, self.alerts]
+        users = _encode(frames, "user_uuid", "user")
+        self._num_institutions = len(_encode(frames, "institution_id", "institution"))
+        self.balances["account"] = self.balances.groupby(
+            ["user", "institution", "account_id"], sort=False, dropna=False
+        ).ngroup()
+
+        # One row per user, institution and account type held
+        self.institution_account_types = (
+            institutions[["user", "institution", "account_types"]]
+            .explode("account_types")
+            .rename(columns={"account_types": "account_type"})
+            .dropna()
+        )
+
+        if user_uuids is None:
+            user_uuids = sorted(institutions["user_uuid"].dropna().unique())
+        self.user_uuids = pd.Index(user_uuids, name="user_uuid")
+        # Code of each user, -1 for users without any records
+        codes = users.get_indexer(self.user_uuids)
+        self._user_codes = np.where(codes < 0, -1, codes + 1)
+
+    def _institution_keys(self, frame: pd.DataFrame) -> np.ndarray:
+        return (
+            frame["user"].to_numpy(dtype="int64") * (self._num_institutions + 1)
+            + frame["institution"].to_numpy()
+        )
+
+    def holding(self, frame: pd.DataFrame, account_type: str) -> np.ndarray:
+        """Mask of the records fetched from institutions holding an account type."""
+        institutions = self.institution_account_types
+        holders = institutions[institutions["account_type"] == account_type]
+        return np.isin(self._institution_keys(frame), self._institution_keys(holders))
+
+    def per_user(self, values: pd.Series, fill_value: Any = np.nan) -> pd.Series:
+        """Values indexed by user code as a Series indexed by the batch's user_uuids."""
+        values = values.reindex(self._user_codes, fill_value=fill_value)
+        values.index = self.user_uuids
+        return values
+
+    def compute(
+        self, names: Sequence[str], utc_starttime: datetime, utc_endtime: datetime
+    ) -> pd.DataFrame:
+        """Feature values of every user, one column per feature."""
+        return pd.DataFrame(
+            {
+                name: BATCHED_FEATURES[name](self, utc_starttime, utc_endtime)
+                for name in names
+            },
+            index=self.user_uuids,
+        )
+
+
+def _window(
+    frame: pd.DataFrame, utc_starttime: datetime, utc_endtime: datetime
+) -> np.ndarray:
+    return (
+        frame["timestamp_us"]
+        .between(to_microseconds(utc_starttime), to_microseconds(utc_endtime))
+        .to_numpy()
+    )
+
+
+def _transactions(
+    batch: Batch, account_type: str, utc_starttime: datetime, utc_endtime: datetime
+) -> pd.DataFrame:
+    """Transactions of an account type, from institutions holding that account type."""
+    transactions = batch.transactions
+    return transactions[
+        batch.holding(transactions, account_type)
+        & (transactions["account_type"] == account_type).to_numpy()
+        & _window(transactions, utc_starttime, utc_endtime)
+    ]
+
+
+def _sum_of_impact(impact: str) -> Callable[[Batch, datetime, datetime], pd.Series]:
+    def feature(
+        batch: Batch, utc_starttime: datetime, utc_endtime: datetime
+    ) -> pd.Series:
+        transactions = _transactions(batch, "depository", utc_starttime, utc_endtime)
+        transactions = transactions[
+            (transactions["impact"] == impact) & transactions["amount"].notna()
+        ]
+        sums = transactions.groupby("user")["amount"].sum()
+        return batch.per_user(sums.astype(float))
+
+    return feature
+
+
+def net_cash_flow(
+    batch: Batch, utc_starttime: datetime, utc_endtime: datetime
+) -> pd.Series:
+    transactions = _transactions(batch, "depository", utc_starttime, utc_endtime)
+    transactions = transactions[transactions["impact"].isin(["CREDIT", "DEBIT"])]
+    signed_amounts = transactions["amount"].where(
+        transactions["impact"] == "CREDIT", -transactions["amount"]
+    )
+    sums = signed_amounts.groupby(transactions["user"]).sum()
+    return batch.per_user(sums.astype(float))
+
+
+def count_transactions_depository(
+    batch: Batch, utc_starttime: datetime, utc_endtime: datetime
+) -> pd.Series:
+    transactions = _transactions(batch, "depository", utc_starttime, utc_endtime)
+    transactions = transactions[transactions["impact"].isin(["CREDIT", "DEBIT"])]
+    counts = transactions.groupby("user").size()
+    return batch.per_user(counts, fill_value=0).astype(int)
+
+
+def sum_of_loan_repayments(
+    batch: Batch, utc_starttime: datetime, utc_endtime: datetime
+) -> pd.Series:
+    transactions = _transactions(batch, "loan", utc_starttime, utc_endtime)
+    repayments = transactions[transactions["impact"] == "CREDIT"]
+    sums = repayments.groupby("user")["amount"].sum()
+    return batch.per_user(sums.astype(float), fill_value=0.0)
+
+
+def _sum_of_balances_latest(
+    account_type: str,
+) -> Callable[[Batch, datetime, datetime], pd.Series]:
+    def feature(
+        batch: Batch, utc_starttime: datetime, utc_endtime: datetime
+    ) -> pd.Series:
+        balances = batch.balances
+        balances = balances[
+            batch.holding(balances, account_type)
+            & (balances["account_type"] == account_type).to_numpy()
+            & _window(balances, utc_starttime, utc_endtime)
+        ]
+        # Of balances at the same time, the first in the order they were fetched
+        latest = balances.sort_values(
+            "timestamp_us", ascending=False, kind="stable"
+        ).drop_duplicates(["account"])
+        sums = latest.groupby("user")["balance"].sum()
+        return batch.per_user(sums.astype(float))
+
+    return feature
+
+
+def debt_to_income_ratio_latest(
+    batch: Batch, utc_starttime: datetime, utc_endtime: datetime
+) -> pd.Series:
+    debt = _sum_of_balances_latest("loan")(batch, utc_starttime, utc_endtime)
+    transactions = _transactions(batch, "depository", utc_starttime, utc_endtime)
+    credits = transactions[transactions["impact"] == "CREDIT"]
+    income = batch.per_user(credits.groupby("user")["amount"].sum())
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = debt / income
+    ratio[income.notna() & (income == 0)] = np.inf
+    ratio[debt.isna() & income.notna()] = 0.0
+    ratio[debt.notna() & income.isna()] = np.inf
+    return ratio.astype(float)
+
+
+def _count_label_events(
+    label: str, account_type: Optional[str]
+) -> Callable[[Batch, datetime, datetime], pd.Series]:
+    def feature(
+        batch: Batch, utc_starttime: datetime, utc_endtime: datetime
+    ) -> pd.Series:
+        alerts = batch.alerts
+        mask = _window(alerts, utc_starttime, utc_endtime)
+        if account_type is not None:
+            mask = mask & batch.holding(alerts, account_type)
+        labels = alerts.loc[mask, ["user", "labels"]].explode("labels")
+        # Each alert counts once, whatever the number of its labels
+        labelled = labels[labels["labels"] == label]
+        labelled = labelled[~labelled.index.duplicated()]
+        counts = labelled.groupby("user").size()
+        return batch.per_user(counts, fill_value=0).astype(int)
+
+    return feature
+
+
+def standard_deviation_of_week_to_week_sum_of_credits(
+    batch: Batch, utc_starttime: datetime, utc_endtime: datetime
+) -> pd.Series:
+    """Weeks counted back from utc_endtime, as in pngme_feature_library.weekly."""
+    transactions = _transactions(batch, "depository", utc_starttime, utc_endtime)
+    credits = transactions[
+        (transactions["impact"] == "CREDIT") & transactions["amount"].notna()
+    ]
+    end_us = to_microseconds(utc_endtime)
+    num_weeks = (end_us - to_microseconds(utc_starttime)) // MICROSECONDS_PER_WEEK
+    if num_weeks < 2:
+        return batch.per_user(pd.Series(dtype=float))
+
+    week = (end_us - credits["timestamp_us"]) // MICROSECONDS_PER_WEEK
+    credits = credits.assign(week=week)
+    weekly_sums = (
+        credits[credits["week"] < num_weeks]
+        .groupby(["user", "week"])["amount"]
+        .sum()
+        .unstack(fill_value=0.0)
+        .reindex(
+            index=credits["user"].unique(),
+            columns=range(num_weeks),
+            fill_value=0.0,
+        )
+    )
+    return batch.per_user(weekly_sums.std(axis=1, ddof=1))
+
+
+def _daily_total_balances(
+    batch: Batch, account_type: str, utc_starttime: datetime, utc_endtime: datetime
+) -> Tuple[pd.Series, np.ndarray]:
+    """Total balance of each user on each active day, as end_of_day.daily_total_balances.
+
+    Returns:
+        the totals indexed by user code, for the days with a total; and the codes of
+        the users with any balances of the account type
+    """
+    start_us = to_microseconds(utc_starttime)
+    end_us = to_microseconds(utc_endtime)
+    lookback_start_us = to_microseconds(
+        utc_starttime - timedelta(days=BALANCE_VALID_FOR_DAYS)
+    )
+    num_days = (end_us - start_us) // MICROSECONDS_PER_DAY + 1
+
+    balances = batch.balances
+    transactions = batch.transactions
+    balances_mask = (balances["account_type"] == account_type).to_numpy() & balances[
+        "timestamp_us"
+    ].between(lookback_start_us, end_us).to_numpy()
+    transactions_mask = _window(transactions, utc_starttime, utc_endtime)
+    if account_type == "depository":
+        balances_mask = balances_mask & batch.holding(balances, "depository")
+        transactions_mask = transactions_mask & batch.holding(
+            transactions, "depository"
+        )
+    balances = balances[balances_mask]
+    transactions = transactions[transactions_mask]
+
+    def with_day_index(frame: pd.DataFrame) -> pd.DataFrame:
+        """Records whose UTC day is one of the window's days, with its index."""
+        day = frame["timestamp_us"] // MICROSECONDS_PER_DAY * MICROSECONDS_PER_DAY
+        in_window = day.between(start_us, end_us) & (
+            (day - start_us) % MICROSECONDS_PER_DAY == 0
+        )
+        return frame[in_window].assign(
+            day_index=(day[in_window] - start_us) // MICROSECONDS_PER_DAY
+        )
+
+    def user_days(frame: pd.DataFrame) -> np.ndarray:
+        return (
+            frame["user"].to_numpy(dtype="int64") * num_days
+            + frame["day_index"].to_numpy()
+        )
+
+    users_with_balances = balances["user"].unique()
+
+    # Last balance of each account on each day
+    balances = with_day_index(balances)
+    end_of_day = balances.sort_values("timestamp_us", kind="stable").drop_duplicates(
+        ["account", "day_index"], keep="last"
+    )
+    end_of_day = end_of_day[end_of_day["balance"].notna()].sort_values(
+        ["account", "day_index"]
+    )
+
+    # Carry each balance forward until the account's next balance, for at most
+    # BALANCE_VALID_FOR_DAYS days and up to the end of the window
+    day_index = end_of_day["day_index"].to_numpy()
+    next_day_index = (
+        end_of_day.groupby("account")["day_index"]
+        .shift(-1)
+        .fillna(num_days)
+        .to_numpy(dtype="int64")
+    )
+    stop = np.minimum(
+        np.minimum(next_day_index, day_index + BALANCE_VALID_FOR_DAYS + 1), num_days
+    )
+    lengths = stop - day_index
+    rows = np.repeat(np.arange(len(end_of_day)), lengths)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    totals = (
+        pd.Series(end_of_day["balance"].to_numpy(dtype=float)[rows])
+        .groupby(user_days(end_of_day)[rows] + offsets)
+        .sum()
+    )
+
+    # Only days the user received a balance or transaction
+    active_days = np.concatenate(
+        [user_days(balances), user_days(with_day_index(transactions))]
+    )
+    totals = totals[np.isin(totals.index, active_days)]
+    totals.index = totals.index // num_days
+    return totals, users_with_balances
+
+
+def _end_of_day_balance(
+    account_type: str, statistic: str
+) -> Callable[[Batch, datetime, datetime], pd.Series]:
+    def feature(
+        batch: Batch, utc_starttime: datetime, utc_endtime: datetime
+    ) -> pd.Series:
+        totals, users_with_balances = _daily_total_balances(
+            batch, account_type, utc_starttime, utc_endtime
+        )
+        values = (
+            totals.groupby(level=0)
+            .agg(statistic)
+            .reindex(users_with_balances)
+            .astype(float)
+        )
+        if account_type == "loan":
+            # Users with balances, but none of them loan balances, owe nothing
+            balances = batch.balances
+            lookback_start_us = to_microseconds(
+                utc_starttime - timedelta(days=BALANCE_VALID_FOR_DAYS)
+            )
+            users = balances.loc[
+                balances["timestamp_us"].between(
+                    lookback_start_us, to_microseconds(utc_endtime)
+                ),
+                "user",
+            ].unique()
+            without_loans = pd.Series(
+                0.0, index=np.setdiff1d(users, users_with_balances)
+            )
+            values = pd.concat([values, without_loans])
+        return batch.per_user(values)
+
+    return feature
+
+
+BATCHED_FEATURES: Dict[str, Callable[[Batch, datetime, datetime], pd.Series]] = {
+    "average_end_of_day_depository_balance": _end_of_day_balance("depository", "mean"),
+    "average_end_of_day_loan_balance": _end_of_day_balance("loan", "mean"),
+    "count_transactions_depository": count_transactions_depository,
+    "debt_to_income_ratio_latest": debt_to_income_ratio_latest,
+    "median_end_of_day_depository_balance": _end_of_day_balance("depository", "median"),
+    "net_cash_flow": net_cash_flow,
+    "standard_deviation_of_week_to_week_sum_of_credits": (
+        standard_deviation_of_week_to_week_sum_of_credits
+    ),
+    "sum_of_credits": _sum_of_impact("CREDIT"),
+    "sum_of_debits": _sum_of_impact("DEBIT"),
+    "sum_of_depository_balances_latest": _sum_of_balances_latest("depository"),
+    "sum_of_loan_balances_latest": _sum_of_balances_latest("loan"),
+    "sum_of_loan_repayments": sum_of_loan_repayments,
+    **{
+        name: _count_label_events(label, account_type)
+        for name, (label, account_type) in LABEL_COUNT_FEATURES.items()
+    },
+}
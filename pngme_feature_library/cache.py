@@ -0,0 +1,108 @@
+"""In-memory caches for API responses."""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+from .client import ClientWrapper, Record, request_key
+from .metrics import record_cache_lookup
+
+T = TypeVar("T")
+
+# How long responses stay fresh, per resource. Records are only reused for a short
+# while so that newly arrived SMS data shows up quickly. Institutions are cached by
+# InstitutionCachingClient, which also caches their absence.
+DEFAULT_TTL_SECONDS = {
+    "alerts": 60.0,
+    "balances": 60.0,
+    "transactions": 60.0,
+    "users": 60.0,
+}
+
+
+class TTLCache(Generic[T]):
+    """LRU cache whose entries also expire a fixed time after they were stored.
+
+    Lookups are reported to the metrics module under ``name``.
+    """
+
+    def __init__(self, name: str, ttl_seconds: float, max_size: int = 10_000):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, Tuple[float, T]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[T]:
+        """Return the cached value, or None if it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            record_cache_lookup(self.name, hit=True)
+            return entry[1]
+
+        if entry is not None:
+            del self._entries[key]
+        record_cache_lookup(self.name, hit=False)
+        return None
+
+    def peek(self, key: Hashable) -> Optional[T]:
+        """Like get, but without counting the lookup or refreshing its LRU position."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def set(self, key: Hashable, value: T, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CachingClient(ClientWrapper):
+    """Serve repeated resource calls from memory for a per-resource TTL.
+
+    Resources without a TTL are passed through.
+
+    Cached records are shared between callers, as with pngme-api's own cache, so
+    features must not rely on mutating them.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        ttl_seconds: Optional[Dict[str, float]] = None,
+        max_size: int = 10_000,
+    ):
+        super().__init__(client)
+        ttls = dict(DEFAULT_TTL_SECONDS, **(ttl_seconds or {}))
+        self._caches = {
+            resource: TTLCache[List[Record]](f"{resource}_responses", ttl, max_size)
+            for resource, ttl in ttls.items()
+        }
+
+    async def _get(self, resource: str, params: Dict[str, Any]) -> List[Record]:
+        cache = self._caches.get(resource)
+        if cache is None:
+            return await super()._get(resource, params)
+
+        key = request_key(resource, params)
+        records = cache.get(key)
+        if records is None:
+            records = await super()._get(resource, params)
+            cache.set(key, records)
+        return records
+
+    def clear(self) -> None:
+        for cache in self._caches.values():
+            cache.clear()
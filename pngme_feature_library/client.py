@@ -0,0 +1,214 @@
+"""Composable layers in front of the Pngme AsyncClient.
+
+Every feature in lib/ talks to the Pngme API exclusively through
+``api_client.<resource>.get(...)``. A ClientWrapper exposes that same surface, so a
+wrapped client can be passed to any feature unchanged, and wrappers can be stacked:
+
+    client = InstrumentedClient(AsyncClient(token))
+    await get_sum_of_credits(client, user_uuid, utc_starttime, utc_endtime)
+"""
+
+import types
+from contextlib import asynccontextmanager
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncGenerator,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+import httpx
+from pngme.api import AsyncClient
+
+if TYPE_CHECKING:
+    from .pool import ConnectionPool
+
+Record = Dict[str, Any]
+
+W = TypeVar("W", bound="ClientWrapper")
+
+# Resources exposed by AsyncClient that return lists of records
+RESOURCES = ("alerts", "balances", "institutions", "transactions", "users")
+
+# Parameters each resource accepts positionally in pngme-api; everything else is keyword-only
+RESOURCE_POSITIONAL_PARAMS: Dict[str, Tuple[str, ...]] = {
+    "alerts": ("user_uuid", "institution_id"),
+    "balances": ("user_uuid", "institution_id"),
+    "institutions": ("user_uuid",),
+    "transactions": ("user_uuid", "institution_id"),
+    "users": (),
+}
+
+
+class ResourceProxy:
+    """Stands in for ``AsyncClient.<resource>`` and routes ``get`` to the wrapper."""
+
+    def __init__(self, wrapper: "ClientWrapper", resource: str):
+        self._wrapper = wrapper
+        self._resource = resource
+
+    async def get(self, *args: Any, **kwargs: Any) -> List[Record]:
+        positional_params = RESOURCE_POSITIONAL_PARAMS[self._resource]
+        if len(args) > len(positional_params):
+            raise TypeError(
+                f"{self._resource}.get() takes at most "
+                f"{len(positional_params)} positional arguments"
+            )
+
+        # Normalize positional arguments to keywords so that every layer sees the same params
+        params = dict(zip(positional_params, args))
+        params.update(kwargs)
+        return await self._wrapper._get(self._resource, params)
+
+
+class ClientWrapper:
+    """Base class for layers that intercept the resource calls of an AsyncClient.
+
+    Subclasses override ``_get``, calling ``super()._get`` to reach the wrapped client.
+    Any other attribute (``credit_report``, ``access_token``, ...) is read from the
+    wrapped client.
+    """
+
+    def __init__(self, client: Any):
+        self._client = client
+        self.alerts = ResourceProxy(self, "alerts")
+        self.balances = ResourceProxy(self, "balances")
+        self.institutions = ResourceProxy(self, "institutions")
+        self.transactions = ResourceProxy(self, "transactions")
+        self.users = ResourceProxy(self, "users")
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes not found on the wrapper itself
+        if name == "_client":
+            raise AttributeError(name)
+        return getattr(self._client, name)
+
+    async def _get(self, resource: str, params: Dict[str, Any]) -> List[Record]:
+        records: List[Record] = await getattr(self._client, resource).get(**params)
+        return records
+
+
+def request_key(resource: str, params: Dict[str, Any]) -> Hashable:
+    """Return a hashable key identifying a resource call, independent of argument order."""
+    items = []
+    for name, value in sorted(params.items()):
+        if isinstance(value, (list, tuple, set, frozenset)):
+            value = tuple(sorted(value))
+        items.append((name, value))
+    return (resource, tuple(items))
+
+
+def unwrap(client: Any) -> AsyncClient:
+    """Return the AsyncClient at the bottom of a stack of wrappers."""
+    while isinstance(client, ClientWrapper):
+        client = client._client
+    return client
+
+
+def find_layer(client: Any, layer_type: Type[W]) -> Optional[W]:
+    """Return the outermost wrapper of a given type in a stack of wrappers, if any."""
+    while isinstance(client, ClientWrapper):
+        if isinstance(client, layer_type):
+            return client
+        client = client._client
+    return None
+
+
+# Response statuses worth retrying: rate limiting and server-side failures
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class RetryableStatus(Exception):
+    """A response whose status means the same request may succeed later.
+
+    Args:
+        status: HTTP status of the response
+        retry_after: seconds the API asked to wait before retrying, if it did
+    """
+
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+async def raise_for_retryable_status(response: httpx.Response) -> None:
+    """httpx response hook raising RetryableStatus for 429 and 5xx responses."""
+    if response.status_code not in RETRYABLE_STATUSES:
+        return
+    try:
+        retry_after: Optional[float] = float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        # Missing, or an HTTP date; the backoff delay applies
+        retry_after = None
+    # Read the body so that the connection goes back to the pool rather than closing
+    await response.aread()
+    raise RetryableStatus(response.status_code, retry_after)
+
+
+class PersistentSessionClient(AsyncClient):
+    """AsyncClient suited to long-running processes.
+
+    AsyncClient opens a new HTTP session, and therefore new TCP and TLS connections, for
+    every request. This client keeps a single session open, sending its requests
+    through a ConnectionPool so connections are reused, across clients too. By default
+    that's the process-wide pool of shared_pool().
+
+    pngme-api also memoizes every response for the lifetime of the process, which would
+    serve stale data in a service; this client bypasses that cache so freshness is
+    controlled by the caching layers in this package instead.
+
+    429 and 5xx responses raise RetryableStatus, for a RetryPolicy to retry.
+    """
+
+    def __init__(
+        self,
+        access_token: str,
+        concurrency_limit: int = 50,
+        base_url: str = "https://api.pngme.com/beta",
+        pool: Optional["ConnectionPool"] = None,
+    ):
+        super().__init__(
+            access_token=access_token,
+            concurrency_limit=concurrency_limit,
+            base_url=base_url,
+        )
+        self.pool = pool
+        self._session: Optional[httpx.AsyncClient] = None
+
+        for name in RESOURCES:
+            resource = getattr(self, name)
+            # _get is decorated with pydantic's validate_arguments and pngme's cache;
+            # bind the undecorated method to this resource instance instead
+            cached_get = type(resource)._get.__wrapped__
+            resource._get = types.MethodType(cached_get.__wrapped__, resource)
+
+    @asynccontextmanager
+    async def session(self) -> AsyncGenerator[httpx.AsyncClient, None]:
+        async with self.semaphore:
+            if self._session is None:
+                if self.pool is None:
+                    # pool imports metrics, which imports this module
+                    from .pool import shared_pool
+
+                    self.pool = shared_pool()
+                self._session = httpx.AsyncClient(
+                    base_url=self.base_url,
+                    headers={"Authorization": f"Bearer {self.access_token}"},
+                    timeout=30,
+                    event_hooks={"response": [raise_for_retryable_status]},
+                    transport=self.pool.transport,
+                )
+            yield self._session
+
+    async def aclose(self) -> None:
+        """Close the session; the pool's connections stay open for other clients."""
+        if self._session is not None:
+            await self._session.aclose()
+            self._session = None
@@ -0,0 +1,130 @@
+"""Composite features, computed from the primitive features they depend on.
+
+Features such as debt_to_income_ratio_latest combine other features: the latest loan
+balances of sum_of_loan_balances_latest and the credits of sum_of_credits. Rather
+than re-implementing them, a CompositeFeature declares the primitives it depends on
+and how it combines their values. A ScoringSession computes each feature of one user
+and time window at most once, so a full feature vector computes every primitive once
+however many composites depend on it:
+
+    session = ScoringSession(api_client, user_uuid, utc_starttime, utc_endtime)
+    await session.get_many(["sum_of_credits", "debt_to_income_ratio_latest"])
+
+Composites may depend on other composites.
+"""
+
+import asyncio
+from datetime import datetime
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from .registry import load_feature
+
+
+class CompositeFeature(NamedTuple):
+    primitives: Tuple[str, ...]
+    # Called with the values of the primitives, in order
+    combine: Callable[..., Any]
+
+
+def debt_to_income_ratio(
+    sum_of_loan_balances_latest: Optional[float], sum_of_credits: Optional[float]
+) -> Optional[float]:
+    """Ratio of the latest loan balances to the credits of depository accounts.
+
+    Returns:
+        None if there are neither loan balances nor credits, 0.0 without loan
+        balances and inf without credits or if credits add up to zero
+    """
+    if sum_of_loan_balances_latest is None and sum_of_credits is None:
+        return None
+    if sum_of_loan_balances_latest is None:
+        return 0.0
+    if not sum_of_credits:
+        return float("inf")
+    return sum_of_loan_balances_latest / sum_of_credits
+
+
+COMPOSITE_FEATURES: Dict[str, CompositeFeature] = {
+    "debt_to_income_ratio_latest": CompositeFeature(
+        ("sum_of_loan_balances_latest", "sum_of_credits"), debt_to_income_ratio
+    ),
+}
+
+
+def primitives_of(name: str) -> Set[str]:
+    """The primitive features a feature is computed from; itself if it's primitive."""
+    composite = COMPOSITE_FEATURES.get(name)
+    if composite is None:
+        return {name}
+    return set().union(
+        *[primitives_of(primitive) for primitive in composite.primitives]
+    )
+
+
+class ScoringSession:
+    """Features of one user and time window, each computed at most once.
+
+    Concurrent requests for the same feature share its computation. Failures are
+    memoized too, and raised to every caller.
+
+    Args:
+        api_client: Pngme Async API client
+        user_uuid: the Pngme user_uuid for the mobile phone user
+        utc_starttime: the UTC time to start the time window
+        utc_endtime: the UTC time to end the time window
+        compute_primitive: computes a feature that isn't composite, by name; by
+            default with its function in lib/
+    """
+
+    def __init__(
+        self,
+        api_client: Any,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        compute_primitive: Optional[Callable[[str], Awaitable[Any]]] = None,
+    ):
+        self.api_client = api_client
+        self.user_uuid = user_uuid
+        self.utc_starttime = utc_starttime
+        self.utc_endtime = utc_endtime
+        self._compute_primitive = compute_primitive or self._compute_with_lib
+        self._tasks: Dict[str, "asyncio.Future[Any]"] = {}
+
+    async def _compute_with_lib(self, name: str) -> Any:
+        return await load_feature(name)(
+            self.api_client, self.user_uuid, self.utc_starttime, self.utc_endtime
+        )
+
+    async def _compute(self, name: str) -> Any:
+        composite = COMPOSITE_FEATURES.get(name)
+        if composite is None:
+            return await self._compute_primitive(name)
+        values = await asyncio.gather(*[self.get(p) for p in composite.primitives])
+        return composite.combine(*values)
+
+    async def get(self, name: str) -> Any:
+        """The value of a feature, computed if it hasn't been yet."""
+        if name not in self._tasks:
+            self._tasks[name] = asyncio.ensure_future(self._compute(name))
+        # Cancelling one caller must not cancel the computation the others wait for
+        return await asyncio.shield(self._tasks[name])
+
+    async def get_many(self, names: Sequence[str]) -> Dict[str, Any]:
+        values = await asyncio.gather(*[self.get(name) for name in names])
+        return dict(zip(names, values))
+
+    def cancel(self) -> None:
+        """Cancel the computations still running."""
+        for task in self._tasks.values():
+            task.cancel()
@@ -0,0 +1,249 @@
+"""Per-user latency budgets, with partial results when the budget runs out.
+
+Features wait on every institution's records with asyncio.gather, so one slow
+institution holds up the whole feature. Within a latency budget, every API call a
+feature makes is bounded by the feature's deadline:
+
+- calls for one institution still running at the deadline are cancelled and answered
+  with no records, and the feature is computed from the institutions fetched in time;
+  the feature's later calls for that institution are answered with no records at once;
+- other calls, such as ``institutions.get``, raise DeadlineExceeded.
+
+Features fetching in rounds, such as balances and then transactions, still make their
+calls for the other institutions after the deadline: those are bounded by the end of
+the budget instead.
+
+The client must be wrapped in DeadlineClient, outside of any layer sharing calls
+between features (SingleFlightClient, CachingClient):
+
+    client = DeadlineClient(SingleFlightClient(AsyncClient(token)))
+    results = await compute_within_budget(
+        client, user_uuid, utc_starttime, utc_endtime, names, budget=0.5
+    )
+    results["sum_of_credits"].value, results["sum_of_credits"].completeness
+
+Each result tells how many of the institutions the feature asked for were fetched in
+time ("3 of 4 institutions"). Features still running at the end of the budget, that
+needed a call other than a per-institution one cut off, or that got no institution's
+records in time, are missing: their value is None and ``missing`` is set. Calls are
+cut off ``reserve`` seconds before the end of the budget so features have time to
+compute from what was fetched.
+
+A long-running caller passes its own ``feature`` loader, to instrument the features,
+and its SingleFlight, so concurrent requests within a budget share computations of the
+same feature, user and window. Those are keyed apart from computations without a
+budget, which never get partial values.
+"""
+
+import asyncio
+import contextvars
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Set
+
+from .client import ClientWrapper, Record
+from .composite import ScoringSession, primitives_of
+from .metrics import DEADLINE_CANCELLED_CALLS, DEADLINE_FEATURES
+from .registry import FeatureFunction, load_feature
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Seconds of the budget left to features to compute from the records fetched in time
+DEFAULT_RESERVE = 0.05
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a feature can't be computed, even partially, before its deadline."""
+
+
+class Deadline:
+    """The deadline of one feature's API calls, and the institutions they covered.
+
+    Args:
+        at: event loop time after which API calls are cut off
+        end: event loop time at which the budget runs out; ``at`` by default
+    """
+
+    def __init__(self, at: float, end: Optional[float] = None):
+        self.at = at
+        self.end = at if end is None else end
+        self.institutions: Set[str] = set()
+        self.late_institutions: Set[str] = set()
+
+    def remaining(self) -> float:
+        """Seconds a call made now may run for."""
+        # Once the deadline has passed, calls may use the reserve
+        now = asyncio.get_event_loop().time()
+        return max(self.at - now if now < self.at else self.end - now, 0.0)
+
+
+# Deadline of the feature computation running in the current context. asyncio tasks
+# copy the context when created, so the calls a feature fans out with asyncio.gather
+# share it.
+_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar(
+    "deadline", default=None
+)
+
+
+class DeadlineClient(ClientWrapper):
+    """Bound every resource call by the deadline of the feature making it.
+
+    Calls made outside of compute_within_budget are passed through.
+    """
+
+    async def _get(self, resource: str, params: Dict[str, Any]) -> List[Record]:
+        deadline = _deadline.get()
+        if deadline is None:
+            return await super()._get(resource, params)
+
+        institution_id = params.get("institution_id")
+        if institution_id is not None:
+            if institution_id in deadline.late_institutions:
+                # Already cut off for this feature: its records are incomplete anyway
+                DEADLINE_CANCELLED_CALLS.inc(resource=resource)
+                return []
+            deadline.institutions.add(institution_id)
+        try:
+            return await asyncio.wait_for(
+                super()._get(resource, params), deadline.remaining()
+            )
+        except asyncio.TimeoutError:
+            DEADLINE_CANCELLED_CALLS.inc(resource=resource)
+            if institution_id is None:
+                raise DeadlineExceeded(f"{resource} call cut off at the deadline")
+            deadline.late_institutions.add(institution_id)
+            return []
+
+
+class _Computation(NamedTuple):
+    """The outcome of a feature computed within a budget, shared between callers."""
+
+    deadline: Deadline
+    value: Any = None
+    exception: Optional[BaseException] = None
+
+
+class FeatureResult(NamedTuple):
+    value: Any
+    # Institutions whose records were all fetched in time, of those asked for
+    institutions_fetched: int
+    institutions_total: int
+    missing: bool = False
+    # Why the feature failed, if not for the deadline
+    error: Optional[str] = None
+
+    @property
+    def complete(self) -> bool:
+        return not self.missing and self.institutions_fetched == self.institutions_total
+
+    @property
+    def completeness(self) -> str:
+        return f"{self.institutions_fetched} of {self.institutions_total} institutions"
+
+
+async def compute_within_budget(
+    api_client: Any,
+    user_uuid: str,
+    utc_starttime: datetime,
+    utc_endtime: datetime,
+    names: Sequence[str],
+    budget: float,
+    reserve: float = DEFAULT_RESERVE,
+    feature: Callable[[str], FeatureFunction] = load_feature,
+    in_flight: Optional[SingleFlight[Any]] = None,
+) -> Dict[str, FeatureResult]:
+    """Compute features for one user, returning whatever is ready after ``budget`` seconds.
+
+    Features are computed in a ScoringSession, so composite features share their
+    primitives, and are as complete as the least complete of their primitives.
+
+    Args:
+        api_client: a client wrapped in DeadlineClient
+        budget: seconds until features still running are given up as missing
+        reserve: seconds before the end of the budget at which API calls are cut off
+        feature: the feature function of a name
+        in_flight: computations to join when the same feature, user and window is
+            already being computed within a budget
+    """
+    loop = asyncio.get_event_loop()
+    started = loop.time()
+    calls_deadline = started + max(budget - reserve, 0.0)
+    deadlines: Dict[str, Deadline] = {}
+
+    async def compute_primitive(name: str) -> Any:
+        async def compute() -> _Computation:
+            deadline = deadlines[name] = Deadline(calls_deadline, started + budget)
+            # Runs in the session's task for this feature, or the task SingleFlight
+            # starts for it, so only this feature's calls see it
+            _deadline.set(deadline)
+            try:
+                value = await feature(name)(
+                    api_client, user_uuid, utc_starttime, utc_endtime
+                )
+                if (
+                    deadline.institutions
+                    and deadline.institutions <= deadline.late_institutions
+                ):
+                    raise DeadlineExceeded(
+                        f"No institution's records fetched in time for {name}"
+                    )
+            except Exception as e:
+                return _Computation(deadline, exception=e)
+            return _Computation(deadline, value)
+
+        if in_flight is None:
+            computation = await compute()
+        else:
+            key = (name, user_uuid, utc_starttime, utc_endtime, "within_budget")
+            computation = await in_flight.do(key, compute)
+        # Joined computations tell the institutions they fetched through their deadline
+        deadlines[name] = computation.deadline
+        if computation.exception is not None:
+            raise computation.exception
+        return computation.value
+
+    session = ScoringSession(
+        api_client,
+        user_uuid,
+        utc_starttime,
+        utc_endtime,
+        compute_primitive=compute_primitive,
+    )
+    tasks = [asyncio.ensure_future(session.get(name)) for name in names]
+    _, pending = await asyncio.wait(
+        tasks, timeout=max(started + budget - loop.time(), 0.0)
+    )
+    session.cancel()
+    for task in pending:
+        task.cancel()
+
+    results: Dict[str, FeatureResult] = {}
+    for name, task in zip(names, tasks):
+        institutions: Set[str] = set()
+        late_institutions: Set[str] = set()
+        for primitive in primitives_of(name):
+            if primitive in deadlines:
+                institutions |= deadlines[primitive].institutions
+                late_institutions |= deadlines[primitive].late_institutions
+        fetched = len(institutions - late_institutions)
+
+        exception = None if task in pending else task.exception()
+        if task not in pending and exception is None:
+            result = FeatureResult(task.result(), fetched, len(institutions))
+        else:
+            error = None
+            if exception is not None and not isinstance(exception, DeadlineExceeded):
+                logger.error("Computing %s failed: %r", name, exception)
+                error = repr(exception)
+            result = FeatureResult(
+                None, fetched, len(institutions), missing=True, error=error
+            )
+        results[name] = result
+
+        if result.missing:
+            outcome = "missing"
+        else:
+            outcome = "complete" if result.complete else "partial"
+        DEADLINE_FEATURES.inc(feature=name, outcome=outcome)
+    return results
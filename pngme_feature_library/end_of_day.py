@@ -0,0 +1,163 @@
+"""Daily total end-of-day balances for the *_end_of_day_* features.
+
+Given balance records tagged with their institution_id, the transactions of the
+same institutions and a time window, ``daily_total_balances`` returns the total of
+every account's end-of-day balance on each active day of the window, active days
+being the days with any balance or transaction. As in the pandas implementation the
+features were written with:
+
+- an account's end-of-day balance is its last balance record of the UTC day;
+- the days of the window are ``utc_starttime`` plus a whole number of days, so a
+  window that doesn't start at midnight has no end-of-day balances at all;
+- a balance is carried forward for at most ``balance_valid_for_days`` days without
+  a newer one, and only from balances inside the window;
+- days on which no account has a balance are NaN, and are ignored by ``mean`` and
+  ``median``.
+
+The sums are computed in the same order and with the same algorithms as pandas, so
+both backends give bit-identical results.
+"""
+
+import math
+import statistics
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .backend import get_backend
+from .timestamps import parse_timestamp, to_timestamp
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+Record = Dict[str, Any]
+
+
+def daily_total_balances(
+    balances: List[Record],
+    transactions: List[Record],
+    utc_starttime: datetime,
+    utc_endtime: datetime,
+    balance_valid_for_days: int,
+) -> Optional[List[float]]:
+    """Total end-of-day balance on each active day of the window, oldest first.
+
+    Returns:
+        None if no account has a balance, otherwise one total per active day of the
+        window, NaN for the days on which no account has a balance
+    """
+    if get_backend() == "pandas":
+        from ._end_of_day_pandas import daily_total_balances as pandas_implementation
+
+        return pandas_implementation(
+            balances,
+            transactions,
+            utc_starttime,
+            utc_endtime,
+            balance_valid_for_days,
+        )
+
+    start = to_timestamp(utc_starttime)
+    end = to_timestamp(utc_endtime)
+    num_days = int((end - start) // SECONDS_PER_DAY) + 1
+    days = [start + day * SECONDS_PER_DAY for day in range(num_days)]
+
+    # Last balance of each UTC day for each account
+    end_of_day: Dict[Tuple[str, str], Dict[float, float]] = {}
+    active_days = set()
+    parsed = sorted(
+        ((parse_timestamp(balance["timestamp"]), balance) for balance in balances),
+        key=lambda pair: pair[0],
+    )
+    for timestamp, balance in parsed:
+        day = timestamp - timestamp % SECONDS_PER_DAY
+        active_days.add(day)
+        if balance["institution_id"] is None or balance["account_id"] is None:
+            continue
+        amount = balance["balance"]
+        account = (balance["institution_id"], balance["account_id"])
+        end_of_day.setdefault(account, {})[day] = (
+            math.nan if amount is None else float(amount)
+        )
+
+    if not end_of_day:
+        return None
+
+    for transaction in transactions:
+        timestamp = parse_timestamp(transaction["timestamp"])
+        active_days.add(timestamp - timestamp % SECONDS_PER_DAY)
+
+    # Carry balances forward in time, account by account in the order pandas groups
+    # them, adding each day's balances up with compensated summation as pandas does
+    totals = [0.0] * num_days
+    compensations = [0.0] * num_days
+    counts = [0] * num_days
+    for account in sorted(end_of_day):
+        eod_balances = end_of_day[account]
+        last_balance = math.nan
+        days_without_balance = 0
+        for ix, day in enumerate(days):
+            amount = eod_balances.get(day, math.nan)
+            if not math.isnan(amount):
+                last_balance = amount
+                days_without_balance = 0
+            else:
+                days_without_balance += 1
+                if days_without_balance > balance_valid_for_days:
+                    continue
+                amount = last_balance
+                if math.isnan(amount):
+                    continue
+
+            y = amount - compensations[ix]
+            t = totals[ix] + y
+            compensations[ix] = t - totals[ix] - y
+            if math.isnan(compensations[ix]):
+                compensations[ix] = 0.0
+            totals[ix] = t
+            counts[ix] += 1
+
+    return [
+        total if count else math.nan
+        for day, total, count in zip(days, totals, counts)
+        if day in active_days
+    ]
+
+
+def _pairwise_sum(values: List[float]) -> float:
+    # NumPy's pairwise summation of float64 arrays, which pandas uses for mean()
+    n = len(values)
+    if n < 8:
+        result = 0.0
+        for value in values:
+            result += value
+        return result
+    if n <= 128:
+        r = values[:8]
+        i = 8
+        while i < n - n % 8:
+            for j in range(8):
+                r[j] += values[i + j]
+            i += 8
+        result = ((r[0] + r[1]) + (r[2] + r[3])) + ((r[4] + r[5]) + (r[6] + r[7]))
+        for value in values[i:]:
+            result += value
+        return result
+    half = n // 2
+    half -= half % 8
+    return _pairwise_sum(values[:half]) + _pairwise_sum(values[half:])
+
+
+def mean(values: Iterable[float]) -> float:
+    """Mean of the values that aren't NaN, NaN if there are none (as pandas)."""
+    values = list(values)
+    count = sum(1 for value in values if not math.isnan(value))
+    if not count:
+        return math.nan
+    return _pairwise_sum([0.0 if math.isnan(v) else v for v in values]) / count
+
+
+def median(values: Iterable[float]) -> float:
+    """Median of the values that aren't NaN, NaN if there are none (as pandas)."""
+    values = [value for value in values if not math.isnan(value)]
+    if not values:
+        return math.nan
+    return statistics.median(values)
@@ -0,0 +1,68 @@
+"""The features in lib/ as an importable package, loaded lazily.
+
+Each feature's ``lib/<name>/main.py`` is importable as
+``pngme_feature_library.features.<name>``, and its feature function as an attribute of
+this package. Nothing is imported until it is first used, so a worker computing only
+one feature never imports the modules, or the dependencies, of the others:
+
+    from pngme_feature_library.features import get_data_recency_minutes
+
+The registry in pngme_feature_library.registry lists every feature.
+"""
+
+import importlib
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import sys
+from types import ModuleType
+from typing import Any, List, Optional, Sequence
+
+from ..registry import FEATURE_FUNCTIONS, LIB_DIR
+
+_FEATURES_BY_FUNCTION = {function: name for name, function in FEATURE_FUNCTIONS.items()}
+
+
+class _FeatureFinder(importlib.abc.MetaPathFinder):
+    """Find ``pngme_feature_library.features.<name>`` in ``lib/<name>/main.py``."""
+
+    def find_spec(
+        self,
+        fullname: str,
+        path: Optional[Sequence[str]],
+        target: Optional[ModuleType] = None,
+    ) -> Optional[importlib.machinery.ModuleSpec]:
+        package, _, name = fullname.rpartition(".")
+        if package != __name__ or name not in FEATURE_FUNCTIONS:
+            return None
+        main = LIB_DIR / name / "main.py"
+        if not main.is_file():
+            raise ModuleNotFoundError(
+                f"The module of feature {name} is missing: no {main}. Install "
+                "pngme-feature-library from a wheel or sdist, which include lib/, or "
+                "with pip install -e . from a checkout",
+                name=fullname,
+            )
+        return importlib.util.spec_from_file_location(fullname, main)
+
+
+sys.meta_path.append(_FeatureFinder())
+
+
+def __getattr__(attribute: str) -> Any:
+    if attribute in FEATURE_FUNCTIONS:
+        return importlib.import_module(f"{__name__}.{attribute}")
+
+    if attribute in _FEATURES_BY_FUNCTION:
+        module = importlib.import_module(
+            f"{__name__}.{_FEATURES_BY_FUNCTION[attribute]}"
+        )
+        function = getattr(module, attribute)
+        globals()[attribute] = function
+        return function
+
+    raise AttributeError(f"module {__name__!r} has no attribute {attribute!r}")
+
+
+def __dir__() -> List[str]:
+    return sorted([*globals(), *FEATURE_FUNCTIONS, *_FEATURES_BY_FUNCTION])
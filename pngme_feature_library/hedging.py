@@ -0,0 +1,191 @@
+"""Hedged resource calls, to cut the tail latency of slow institutions.
+
+A user's features take as long as the slowest of their per-institution calls, so the
+API's tail latency becomes the features' typical latency. HedgingClient sends a
+duplicate of any alerts, balances or transactions call still running after the
+resource's observed 95th percentile latency, and returns whichever response comes
+first, cancelling the other:
+
+    client = SingleFlightClient(HedgingClient(InstrumentedClient(AsyncClient(token))))
+
+A multi-page call takes as long as its slowest page, and its latency grows with the
+user's history, so under a PaginatedClient, hedge each page request with a
+HedgePolicy instead, keyed on page latencies:
+
+    client = PaginatedClient(AsyncClient(token), hedge=HedgePolicy())
+
+Duplicates are capped at ``max_hedge_rate`` of all calls (5% by default), so a slow
+API doesn't get twice the load. Calls aren't hedged until ``min_samples`` latencies
+of their resource have been observed; calls cancelled because their hedge won count
+with the time they ran, so the slowest calls aren't left out of the percentile.
+Outcomes are counted in ``pngme_hedged_calls_total`` and the current delay of each
+resource is exported as ``pngme_hedge_delay_seconds``.
+"""
+
+import asyncio
+import math
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+from .client import ClientWrapper, Record
+from .metrics import HEDGE_DELAY, HEDGED_CALLS
+
+HEDGED_RESOURCES = ("alerts", "balances", "transactions")
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """Percentiles of the most recent latencies of a resource's calls.
+
+    Args:
+        size: number of recent latencies kept
+        min_samples: latencies observed before percentiles are given
+    """
+
+    def __init__(self, size: int = 1000, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._latencies: Deque[float] = deque(maxlen=size)
+        self._sorted: Optional[List[float]] = None
+        # Sorting on every call would cost more than the percentile moves; the sorted
+        # latencies are refreshed after this many new observations
+        self._refresh_every = max(1, size // 50)
+        self._since_refresh = 0
+
+    def observe(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self._since_refresh += 1
+        if self._since_refresh >= self._refresh_every:
+            self._sorted = None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Nearest-rank percentile, or None before ``min_samples`` observations."""
+        if len(self._latencies) < self.min_samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._latencies)
+            self._since_refresh = 0
+        rank = math.ceil(q / 100 * len(self._sorted))
+        return self._sorted[max(rank, 1) - 1]
+
+
+class HedgePolicy:
+    """Duplicate requests outlasting their resource's latency percentile.
+
+    Args:
+        percentile: latency percentile after which a request is duplicated
+        max_hedge_rate: largest fraction of requests duplicated
+        min_samples: latencies observed per resource before its requests are hedged
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        max_hedge_rate: float = 0.05,
+        min_samples: int = 20,
+    ):
+        self.percentile = percentile
+        self.max_hedge_rate = max_hedge_rate
+        self.trackers = {
+            resource: LatencyTracker(min_samples=min_samples)
+            for resource in HEDGED_RESOURCES
+        }
+        # Token bucket: each request earns max_hedge_rate of a hedge, each hedge spends
+        # one, with at most a few saved up for bursts of slow requests
+        self._hedge_tokens = 0.0
+        self._max_hedge_tokens = max(1.0, 100 * max_hedge_rate)
+
+    async def _timed(
+        self, resource: str, request: Callable[[], Awaitable[T]], primary: bool = True
+    ) -> T:
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        try:
+            result = await request()
+        except asyncio.CancelledError:
+            # A primary request cancelled, most often because its hedge won, took at
+            # least this long: leaving it out would only keep the slowest requests
+            # out of the percentile
+            if primary:
+                self.trackers[resource].observe(loop.time() - started)
+            raise
+        self.trackers[resource].observe(loop.time() - started)
+        return result
+
+    async def call(self, resource: str, request: Callable[[], Awaitable[T]]) -> T:
+        """Make a request, and a duplicate if it outlasts the resource's percentile.
+
+        Returns:
+            the first successful response of the two
+        """
+        if resource not in self.trackers:
+            return await request()
+
+        self._hedge_tokens = min(
+            self._hedge_tokens + self.max_hedge_rate, self._max_hedge_tokens
+        )
+        delay = self.trackers[resource].percentile(self.percentile)
+        if delay is None:
+            return await self._timed(resource, request)
+        HEDGE_DELAY.set(delay, resource=resource)
+
+        primary = asyncio.ensure_future(self._timed(resource, request))
+        hedge: Optional["asyncio.Future[T]"] = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            if self._hedge_tokens < 1:
+                HEDGED_CALLS.inc(resource=resource, outcome="capped")
+                return await primary
+            self._hedge_tokens -= 1
+
+            hedge = asyncio.ensure_future(self._timed(resource, request, primary=False))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                # Of two responses arriving together, the original one wins
+                for future in sorted(done, key=lambda future: future is not primary):
+                    if future.exception() is None:
+                        outcome = "primary_won" if future is primary else "hedge_won"
+                        HEDGED_CALLS.inc(resource=resource, outcome=outcome)
+                        return future.result()
+            # Both failed
+            HEDGED_CALLS.inc(resource=resource, outcome="failed")
+            return primary.result()
+        finally:
+            primary.cancel()
+            if hedge is not None:
+                hedge.cancel()
+
+
+class HedgingClient(ClientWrapper):
+    """Duplicate resource calls outlasting the resource's latency percentile.
+
+    Calls are hedged whole: below a PaginatedClient, hedge its page requests instead
+    by passing it a HedgePolicy.
+
+    Args:
+        client: the client to wrap
+        percentile: latency percentile after which a call is duplicated
+        max_hedge_rate: largest fraction of calls duplicated
+        min_samples: latencies observed per resource before its calls are hedged
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        percentile: float = 95.0,
+        max_hedge_rate: float = 0.05,
+        min_samples: int = 20,
+    ):
+        super().__init__(client)
+        self.policy = HedgePolicy(percentile, max_hedge_rate, min_samples)
+
+    async def _get(self, resource: str, params: Dict[str, Any]) -> List[Record]:
+        async def request() -> List[Record]:
+            return await super(HedgingClient, self)._get(resource, params)
+
+        return await self.policy.call(resource, request)
@@ -0,0 +1,503 @@
+"""Local columnar store of users' records, for backfills at disk speed.
+
+Recomputing features over months of history for many users is bound by fetching the
+same records from the API again and again. HistoryStore keeps fetched alerts,
+balances and transactions in Parquet files partitioned by user hash and month:
+
+    <root>/<resource>/bucket=<NNN>/month=<YYYY-MM>/<user_uuid>-<part>.parquet
+
+along with each user's institutions and the time ranges already stored for each
+user, institution and resource. ``read_table`` returns the stored records as Arrow
+tables read from memory-mapped files, for engines working on columns, while ``read``
+converts them to the dicts the API returns.
+
+Records may reach the API well after their timestamp, when a phone syncs its SMS
+late. A time range is only stored for good once it's fetched ``settling_period``
+after it ended; ranges fetched earlier, such as windows ending now, are fetched again
+when a call needs them more than ``recheck`` after they were fetched, replacing their
+records, so records ingested late are picked up.
+
+HistoryClient is the fetch layer in front of it: it fetches the time ranges not stored
+yet, unfiltered, writes them to the store, and answers every call from the store
+with the same filters as the API, so features run unchanged:
+
+    store = HistoryStore("history/")
+    client = HistoryClient(AsyncClient(token), store)
+    await get_sum_of_credits(client, user_uuid, utc_starttime, utc_endtime)
+
+Without a wrapped client, calls are answered from the store only, e.g. to backfill
+features offline. Records are returned most recent first. Calls for a specific page,
+such as get_data_recency_minutes' first-page calls, are answered from the store too,
+as the slice of its records in that page of ``page_size`` records; the whole window
+is fetched and stored first if it wasn't yet. Calls without a time window are passed
+through to the wrapped client.
+
+Requires pyarrow (``pip install -e ".[history]"``).
+"""
+
+import asyncio
+import json
+import sqlite3
+import uuid
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import pyarrow as pa  # type: ignore
+import pyarrow.compute as pc  # type: ignore
+import pyarrow.parquet as pq  # type: ignore
+
+from .client import ClientWrapper, Record
+from .timestamps import EPOCH, MICROSECOND, to_microseconds
+
+HISTORY_RESOURCES = ("alerts", "balances", "transactions")
+
+# Columns added to the stored records, and removed when they are read back
+USER_COLUMN = "_user_uuid"
+INSTITUTION_COLUMN = "_institution_id"
+TIMESTAMP_COLUMN = "_timestamp_us"
+
+# Time after which records are assumed to have reached the API
+DEFAULT_SETTLING_PERIOD = timedelta(days=3)
+
+# Time after which ranges fetched before they settled are fetched again
+DEFAULT_RECHECK = timedelta(minutes=10)
+
+
+class HistoryUnavailable(Exception):
+    """Raised when records are not in the store and there is no client to fetch them."""
+
+
+def _datetime(microseconds: int) -> datetime:
+    """Naive UTC datetime, as the features in lib/ use."""
+    return (EPOCH + microseconds * MICROSECOND).replace(tzinfo=None)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _months(start_us: int, end_us: int) -> List[str]:
+    start = _datetime(start_us)
+    end = _datetime(end_us)
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+class HistoryStore:
+    """Parquet files of records, partitioned by user hash and month.
+
+    Args:
+        root: directory holding the store
+        num_buckets: number of user hash partitions; must stay the same for a store
+        settling_period: time after which records are assumed to have reached the API
+        recheck: time after which ranges fetched before they settled are fetched again
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        num_buckets: int = 256,
+        settling_period: timedelta = DEFAULT_SETTLING_PERIOD,
+        recheck: timedelta = DEFAULT_RECHECK,
+    ):
+        self.root = Path(root)
+        self.num_buckets = num_buckets
+        self.settling_period = settling_period
+        self.recheck = recheck
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.root / "coverage.sqlite")
+        # Ranges fetched before they settled have the time they were fetched at and
+        # their own Parquet files, which are replaced when they're fetched again
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS coverage (resource TEXT, user_uuid TEXT, "
+            "institution_id TEXT, start_us INTEGER, end_us INTEGER, "
+            "fetched_us INTEGER, parts TEXT);"
+            "CREATE INDEX IF NOT EXISTS coverage_key "
+            "ON coverage (resource, user_uuid, institution_id);"
+            "CREATE TABLE IF NOT EXISTS institutions "
+            "(user_uuid TEXT PRIMARY KEY, institutions TEXT);"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(coverage)")}
+        with self._db:
+            # Stores written before ranges could be unsettled
+            for column in ("fetched_us INTEGER", "parts TEXT"):
+                if column.split()[0] not in columns:
+                    self._db.execute(f"ALTER TABLE coverage ADD COLUMN {column}")
+
+    def _bucket(self, user_uuid: str) -> str:
+        return f"bucket={zlib.crc32(user_uuid.encode()) % self.num_buckets:03d}"
+
+    def _partition(self, resource: str, user_uuid: str, month: str) -> Path:
+        return self.root / resource / self._bucket(user_uuid) / f"month={month}"
+
+    def user_uuids(self) -> List[str]:
+        """Users whose institutions are stored."""
+        return [
+            user_uuid
+            for (user_uuid,) in self._db.execute(
+                "SELECT user_uuid FROM institutions ORDER BY user_uuid"
+            )
+        ]
+
+    def institutions(self, user_uuid: str) -> Optional[List[Record]]:
+        row = self._db.execute(
+            "SELECT institutions FROM institutions WHERE user_uuid = ?", (user_uuid,)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def write_institutions(self, user_uuid: str, institutions: List[Record]) -> None:
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO institutions VALUES (?, ?)",
+                (user_uuid, json.dumps(institutions)),
+            )
+
+    def _coverage(
+        self, resource: str, user_uuid: str, institution_id: str
+    ) -> List[Tuple[int, int, Optional[int]]]:
+        """Start, end and, if it wasn't settled then, fetch time of stored ranges."""
+        return self._db.execute(
+            "SELECT start_us, end_us, fetched_us FROM coverage WHERE resource = ? "
+            "AND user_uuid = ? AND institution_id = ? ORDER BY start_us",
+            (resource, user_uuid, institution_id),
+        ).fetchall()
+
+    def gaps(
+        self,
+        resource: str,
+        user_uuid: str,
+        institution_id: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        recheck: bool = True,
+    ) -> List[Tuple[datetime, datetime]]:
+        """Parts of a time window whose records are not stored.
+
+        Args:
+            recheck: whether ranges fetched before they settled, more than
+                ``self.recheck`` ago, are gaps; they're returned whole
+        """
+        start = to_microseconds(utc_starttime)
+        end = to_microseconds(utc_endtime)
+        recheck_before = to_microseconds(_now() - self.recheck)
+        coverage = []
+        for covered_start, covered_end, fetched in self._coverage(
+            resource, user_uuid, institution_id
+        ):
+            if (
+                recheck
+                and fetched is not None
+                and fetched < recheck_before
+                and covered_start <= end
+                and covered_end >= start
+            ):
+                start, end = min(start, covered_start), max(end, covered_end)
+            else:
+                coverage.append((covered_start, covered_end))
+
+        gaps = []
+        for covered_start, covered_end in coverage:
+            if covered_end < start:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > start:
+                gaps.append((start, covered_start))
+            start = max(start, covered_end)
+        if start < end:
+            gaps.append((start, end))
+        return [(_datetime(start), _datetime(end)) for start, end in gaps]
+
+    def write(
+        self,
+        resource: str,
+        user_uuid: str,
+        institution_id: str,
+        records: List[Record],
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+    ) -> int:
+        """Store all records of a time window, unfiltered, and mark it as stored.
+
+        Records falling in a part of the window that was already stored are skipped,
+        except in ranges fetched before they settled that the window covers, whose
+        records are replaced. The part of the window that hasn't settled yet is
+        stored apart, to be replaced in turn.
+
+        Returns:
+            the number of records written
+        """
+        start = to_microseconds(utc_starttime)
+        end = to_microseconds(utc_endtime)
+        now = _now()
+        settled = to_microseconds(now - self.settling_period)
+        key = (resource, user_uuid, institution_id)
+
+        replaced = self._db.execute(
+            "SELECT rowid, parts FROM coverage WHERE resource = ? AND user_uuid = ? "
+            "AND institution_id = ? AND fetched_us IS NOT NULL AND start_us >= ? "
+            "AND end_us <= ?",
+            key + (start, end),
+        ).fetchall()
+        replaced_rowids = {rowid for rowid, _ in replaced}
+        coverage = [
+            (a, b, fetched)
+            for rowid, a, b, fetched in self._db.execute(
+                "SELECT rowid, start_us, end_us, fetched_us FROM coverage "
+                "WHERE resource = ? AND user_uuid = ? AND institution_id = ?",
+                key,
+            )
+            if rowid not in replaced_rowids
+        ]
+
+        # Settled and unsettled rows, by month
+        rows_by_part: Dict[Tuple[bool, str], List[Record]] = defaultdict(list)
+        for record in records:
+            timestamp = datetime.fromisoformat(record["timestamp"])
+            timestamp_us = to_microseconds(timestamp)
+            if any(a <= timestamp_us <= b for a, b, _ in coverage):
+                continue
+            row = dict(record)
+            row[USER_COLUMN] = user_uuid
+            row[INSTITUTION_COLUMN] = institution_id
+            row[TIMESTAMP_COLUMN] = timestamp_us
+            month = _months(timestamp_us, timestamp_us)[0]
+            rows_by_part[(timestamp_us <= settled, month)].append(row)
+
+        unsettled_parts = []
+        for (is_settled, month), rows in rows_by_part.items():
+            partition = self._partition(resource, user_uuid, month)
+            partition.mkdir(parents=True, exist_ok=True)
+            path = partition / f"{user_uuid}-{uuid.uuid4().hex}.parquet"
+            pq.write_table(pa.Table.from_pylist(rows), path)
+            if not is_settled:
+                unsettled_parts.append(str(path.relative_to(self.root)))
+
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM coverage WHERE rowid = ?",
+                [(rowid,) for rowid in replaced_rowids],
+            )
+            if start <= settled:
+                settled_start, settled_end = start, min(end, settled)
+                # Merge the settled part with the settled ranges it overlaps or touches
+                for a, b, fetched in coverage:
+                    if fetched is None and a <= settled_end and b >= settled_start:
+                        settled_start = min(settled_start, a)
+                        settled_end = max(settled_end, b)
+                self._db.execute(
+                    "DELETE FROM coverage WHERE resource = ? AND user_uuid = ? "
+                    "AND institution_id = ? AND fetched_us IS NULL "
+                    "AND start_us <= ? AND end_us >= ?",
+                    key + (settled_end, settled_start),
+                )
+                self._db.execute(
+                    "INSERT INTO coverage VALUES (?, ?, ?, ?, ?, NULL, NULL)",
+                    key + (settled_start, settled_end),
+                )
+            if end > settled:
+                self._db.execute(
+                    "INSERT INTO coverage VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    key
+                    + (
+                        max(start, settled),
+                        end,
+                        to_microseconds(now),
+                        json.dumps(unsettled_parts),
+                    ),
+                )
+        for _, parts in replaced:
+            for part in json.loads(parts):
+                (self.root / part).unlink(missing_ok=True)
+        return sum(len(rows) for rows in rows_by_part.values())
+
+    def read_table(
+        self,
+        resource: str,
+        user_uuid: str,
+        institution_id: Optional[str],
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        account_types: Optional[Sequence[str]] = None,
+    ) -> Optional[pa.Table]:
+        """Arrow table of the stored records in a time window, most recent first.
+
+        Files are memory-mapped rather than read into buffers, and the records stay
+        columnar, for engines taking Arrow tables; Parquet pages are still decoded.
+        The window is inclusive at both ends, as in the API. Records of every
+        institution are read if ``institution_id`` is None. Returns None if there are
+        no records.
+        """
+        start = to_microseconds(utc_starttime)
+        end = to_microseconds(utc_endtime)
+        tables = [
+            pq.read_table(path, memory_map=True)
+            for month in _months(start, end)
+            for path in sorted(
+                self._partition(resource, user_uuid, month).glob(
+                    f"{user_uuid}-*.parquet"
+                )
+            )
+        ]
+        if not tables:
+            return None
+
+        table = pa.concat_tables(tables, promote_options="permissive")
+        mask = pc.and_(
+            pc.greater_equal(table[TIMESTAMP_COLUMN], start),
+            pc.less_equal(table[TIMESTAMP_COLUMN], end),
+        )
+        if institution_id is not None:
+            mask = pc.and_(mask, pc.equal(table[INSTITUTION_COLUMN], institution_id))
+        if account_types is not None:
+            if "account_type" not in table.column_names:
+                return None
+            mask = pc.and_(
+                mask,
+                pc.is_in(
+                    table["account_type"],
+                    value_set=pa.array(list(account_types), pa.string()),
+                ),
+            )
+        table = table.filter(mask)
+        return table.sort_by([(TIMESTAMP_COLUMN, "descending")]) if len(table) else None
+
+    def read(
+        self,
+        resource: str,
+        user_uuid: str,
+        institution_id: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        account_types: Optional[Sequence[str]] = None,
+        labels: Optional[Sequence[str]] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> List[Record]:
+        """Stored records as the API returns them, with the API's filters.
+
+        The records returned are converted to dicts for the features in lib/; use
+        read_table to keep them columnar.
+
+        Args:
+            offset: matching records skipped, most recent first
+            limit: matching records returned at most; all of them if None
+        """
+        table = self.read_table(
+            resource,
+            user_uuid,
+            institution_id,
+            utc_starttime,
+            utc_endtime,
+            account_types,
+        )
+        if table is None:
+            return []
+
+        table = table.drop_columns([USER_COLUMN, INSTITUTION_COLUMN, TIMESTAMP_COLUMN])
+        if labels is None:
+            # Only convert the records returned
+            return table.slice(offset, limit).to_pylist()  # type: ignore
+
+        wanted = set(labels)
+        records: List[Record] = [
+            r for r in table.to_pylist() if wanted.intersection(r["labels"] or [])
+        ]
+        return records[offset:] if limit is None else records[offset : offset + limit]
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class HistoryClient(ClientWrapper):
+    """Answer resource calls from a HistoryStore, fetching what it doesn't hold yet.
+
+    Args:
+        client: client to fetch missing records with, or None to only read the store
+        store: the history store
+        page_size: records per page of the API, for calls asking for a page
+    """
+
+    def __init__(self, client: Any, store: HistoryStore, page_size: int = 100):
+        super().__init__(client)
+        self.store = store
+        self.page_size = page_size
+        self._locks: Dict[Tuple[str, str, str], asyncio.Lock] = defaultdict(
+            asyncio.Lock
+        )
+
+    async def _get(self, resource: str, params: Dict[str, Any]) -> List[Record]:
+        if resource == "institutions":
+            return await self._institutions(params["user_uuid"])
+        if (
+            resource not in HISTORY_RESOURCES
+            or params.get("utc_starttime") is None
+            or params.get("utc_endtime") is None
+        ):
+            if self._client is None:
+                raise HistoryUnavailable(f"Cannot call {resource} without a client")
+            return await super()._get(resource, params)
+
+        user_uuid = params["user_uuid"]
+        institution_id = params["institution_id"]
+        utc_starttime = params["utc_starttime"]
+        utc_endtime = params["utc_endtime"]
+
+        # One fetch at a time per user, institution and resource, so that concurrent
+        # calls for overlapping windows don't store the same records twice
+        async with self._locks[(resource, user_uuid, institution_id)]:
+            for start, end in self.store.gaps(
+                resource,
+                user_uuid,
+                institution_id,
+                utc_starttime,
+                utc_endtime,
+                recheck=self._client is not None,
+            ):
+                if self._client is None:
+                    raise HistoryUnavailable(
+                        f"{resource} of {user_uuid} at {institution_id} from {start} "
+                        f"to {end} are not stored"
+                    )
+                records = await super()._get(
+                    resource,
+                    dict(
+                        user_uuid=user_uuid,
+                        institution_id=institution_id,
+                        utc_starttime=start,
+                        utc_endtime=end,
+                    ),
+                )
+                self.store.write(
+                    resource, user_uuid, institution_id, records, start, end
+                )
+
+        page = params.get("page")
+        return self.store.read(
+            resource,
+            user_uuid,
+            institution_id,
+            utc_starttime,
+            utc_endtime,
+            params.get("account_types"),
+            params.get("labels"),
+            offset=(page - 1) * self.page_size if page else 0,
+            limit=self.page_size if page else None,
+        )
+
+    async def _institutions(self, user_uuid: str) -> List[Record]:
+        institutions = self.store.institutions(user_uuid)
+        if institutions is not None:
+            return institutions
+        if self._client is None:
+            raise HistoryUnavailable(f"Institutions of {user_uuid} are not stored")
+        institutions = await super()._get("institutions", {"user_uuid": user_uuid})
+        self.store.write_institutions(user_uuid, institutions)
+        return institutions
@@ -0,0 +1,148 @@
+"""Cache of each user's institutions, including the absence of institutions.
+
+``api_client.institutions.get(user_uuid=...)`` is the first, serial step of every
+feature, and its result rarely changes. InstitutionCachingClient answers it from an
+InstitutionCache. Because the cache knows which account types each institution holds,
+it also answers calls for account types a user's institution does not have with an
+empty list, without a round trip. Features such as count_loan_defaulted_events
+therefore return immediately for users without loan accounts.
+
+pngme-api's AsyncClient memoizes responses for the lifetime of the process, so expiry
+and invalidation only reach the API when the wrapped client is a
+PersistentSessionClient.
+"""
+
+import json
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from .cache import TTLCache
+from .client import ClientWrapper, Record
+
+Institution = Dict[str, Any]
+
+
+class InstitutionCache:
+    """Institution lists per user, in memory and optionally on disk.
+
+    Args:
+        ttl_seconds: how long a user's institution list is considered fresh
+        negative_ttl_seconds: how long an empty institution list is considered fresh;
+            shorter, so that data from newly onboarded users is picked up quickly
+        max_size: maximum number of users held in memory
+        path: SQLite database file to persist entries across processes; memory only
+            if not given
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = 900.0,
+        negative_ttl_seconds: float = 60.0,
+        max_size: int = 100_000,
+        path: Optional[str] = None,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._memory = TTLCache[List[Institution]](
+            "institutions", ttl_seconds, max_size
+        )
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            self._db = sqlite3.connect(path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS institutions "
+                "(user_uuid TEXT PRIMARY KEY, institutions TEXT, expires_at REAL)"
+            )
+
+    def get(self, user_uuid: str) -> Optional[List[Institution]]:
+        """Return the cached institutions of a user, or None if unknown or expired."""
+        institutions = self._memory.get(user_uuid)
+        if institutions is not None or self._db is None:
+            return institutions
+
+        row = self._db.execute(
+            "SELECT institutions, expires_at FROM institutions WHERE user_uuid = ?",
+            (user_uuid,),
+        ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+
+        institutions = json.loads(row[0])
+        self._memory.set(user_uuid, institutions, ttl_seconds=row[1] - time.time())
+        return institutions
+
+    def set(self, user_uuid: str, institutions: List[Institution]) -> None:
+        ttl = self.ttl_seconds if institutions else self.negative_ttl_seconds
+        self._memory.set(user_uuid, institutions, ttl_seconds=ttl)
+        if self._db is not None:
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO institutions VALUES (?, ?, ?)",
+                    (user_uuid, json.dumps(institutions), time.time() + ttl),
+                )
+
+    def invalidate(self, user_uuid: Optional[str] = None) -> None:
+        """Forget the institutions of one user, or of every user if none is given."""
+        if user_uuid is None:
+            self._memory.clear()
+        else:
+            self._memory.pop(user_uuid)
+
+        if self._db is not None:
+            with self._db:
+                if user_uuid is None:
+                    self._db.execute("DELETE FROM institutions")
+                else:
+                    self._db.execute(
+                        "DELETE FROM institutions WHERE user_uuid = ?", (user_uuid,)
+                    )
+
+    def lacks_account_types(
+        self, user_uuid: str, institution_id: str, account_types: Sequence[str]
+    ) -> bool:
+        """Whether the cache knows an institution holds none of the given account types.
+
+        Returns False when the user or institution is not cached, since nothing is known.
+        """
+        institutions = self._memory.peek(user_uuid)
+        if institutions is None:
+            return False
+        for institution in institutions:
+            if institution["institution_id"] == institution_id:
+                return not set(account_types) & set(institution["account_types"])
+        return False
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class InstitutionCachingClient(ClientWrapper):
+    """Serve institutions from an InstitutionCache and skip calls it knows are empty."""
+
+    def __init__(self, client: Any, cache: Optional[InstitutionCache] = None):
+        super().__init__(client)
+        self.institution_cache = cache or InstitutionCache()
+
+    async def _get(self, resource: str, params: Dict[str, Any]) -> List[Record]:
+        if resource == "institutions":
+            user_uuid = params["user_uuid"]
+            institutions = self.institution_cache.get(user_uuid)
+            if institutions is None:
+                institutions = await super()._get(resource, params)
+                self.institution_cache.set(user_uuid, institutions)
+            return institutions
+
+        account_types = params.get("account_types")
+        if (
+            account_types
+            and "institution_id" in params
+            and self.institution_cache.lacks_account_types(
+                params["user_uuid"], params["institution_id"], account_types
+            )
+        ):
+            return []
+
+        return await super()._get(resource, params)
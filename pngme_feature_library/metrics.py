@@ -0,0 +1,472 @@
+"""Prometheus-style metrics for services that compute features.
+
+Metrics are collected at the two call sites every feature in lib/ shares:
+``api_client.<resource>.get`` (wrap the client in InstrumentedClient) and the
+feature coroutine itself (decorate it with instrument_feature):
+
+    client = InstrumentedClient(AsyncClient(token))
+    get_sum_of_credits = instrument_feature(get_sum_of_credits)
+
+    await serve_metrics(port=9464)        # GET http://127.0.0.1:9464/metrics
+    dump_metrics("/var/lib/node_exporter/features.prom")
+"""
+
+import abc
+import asyncio
+import contextvars
+import math
+import os
+import tempfile
+import threading
+import time
+from functools import wraps
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from ._http import Request, Response, start_http_server
+from .client import ClientWrapper, Record
+
+T = TypeVar("T")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RECORD_COUNT_BUCKETS = (0, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = [f'{n}="{_escape_label_value(v)}"' for n, v in zip(names, values)]
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric(abc.ABC):
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        """Suffix, label values and value of each sample, in exposition order."""
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for suffix, label_values, value in self.samples():
+            labelnames = self.labelnames
+            if len(label_values) > len(labelnames):
+                labelnames = labelnames + ("le",)
+            labels = _format_labels(labelnames, label_values)
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing value, e.g. number of API requests."""
+
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        with self._lock:
+            return [("", key, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """Value that can go up and down, e.g. number of in-flight requests."""
+
+    metric_type = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observations over fixed buckets, e.g. latency."""
+
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for ix, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    counts[ix] += 1
+                    break
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        samples: List[Tuple[str, LabelValues, float]] = []
+        with self._lock:
+            for key, counts in sorted(self._counts.items()):
+                cumulative = 0
+                for upper_bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    le = _format_value(upper_bound)
+                    samples.append(("_bucket", key + (le,), cumulative))
+                samples.append(("_sum", key, self._sums[key]))
+                samples.append(("_count", key, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together in Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self.register(metric)
+        return metric
+
+    def gauge(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Gauge:
+        metric = Gauge(name, documentation, labelnames)
+        self.register(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.register(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+FEATURE_LATENCY = REGISTRY.histogram(
+    "pngme_feature_latency_seconds",
+    "Wall time to compute a feature for one user",
+    ["feature", "outcome"],
+)
+FEATURES_IN_FLIGHT = REGISTRY.gauge(
+    "pngme_features_in_flight", "Feature computations currently running", ["feature"]
+)
+FEATURE_RECORDS_FETCHED = REGISTRY.histogram(
+    "pngme_feature_records_fetched",
+    "Records fetched from the API to compute a feature for one user",
+    ["feature"],
+    buckets=RECORD_COUNT_BUCKETS,
+)
+API_REQUEST_LATENCY = REGISTRY.histogram(
+    "pngme_api_request_latency_seconds",
+    "Latency of api_client.<resource>.get calls",
+    ["resource"],
+)
+API_REQUESTS = REGISTRY.counter(
+    "pngme_api_requests_total",
+    "Number of api_client.<resource>.get calls",
+    ["resource", "outcome"],
+)
+API_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "pngme_api_requests_in_flight",
+    "api_client.<resource>.get calls currently awaiting a response",
+    ["resource"],
+)
+API_RECORDS_FETCHED = REGISTRY.counter(
+    "pngme_api_records_fetched_total",
+    "Records returned by api_client.<resource>.get calls",
+    ["resource"],
+)
+PAGE_LATENCY = REGISTRY.histogram(
+    "pngme_api_page_latency_seconds",
+    "Latency of fetching one page of a paginated resource",
+    ["resource"],
+)
+PAGINATION_WINDOW = REGISTRY.gauge(
+    "pngme_pagination_window",
+    "Pages of a resource call currently allowed to be fetched concurrently",
+    ["resource"],
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "pngme_cache_lookups_total", "Cache lookups by result", ["cache", "result"]
+)
+CACHE_HIT_RATIO = REGISTRY.gauge(
+    "pngme_cache_hit_ratio", "Fraction of cache lookups that were hits", ["cache"]
+)
+SINGLEFLIGHT_CALLS = REGISTRY.counter(
+    "pngme_singleflight_calls_total",
+    "Coalesced calls; followers joined a call already in flight",
+    ["group", "role"],
+)
+DEADLINE_CANCELLED_CALLS = REGISTRY.counter(
+    "pngme_deadline_cancelled_calls_total",
+    "API calls cut off at the deadline of the feature making them",
+    ["resource"],
+)
+DEADLINE_FEATURES = REGISTRY.counter(
+    "pngme_deadline_features_total",
+    "Features computed within a latency budget, by completeness",
+    ["feature", "outcome"],
+)
+HEDGED_CALLS = REGISTRY.counter(
+    "pngme_hedged_calls_total",
+    "Calls outlasting their resource's hedge delay, by outcome: answered first by the "
+    "original or the duplicate request, both failed, or not hedged for the rate cap",
+    ["resource", "outcome"],
+)
+HEDGE_DELAY = REGISTRY.gauge(
+    "pngme_hedge_delay_seconds",
+    "Time after which a resource call still running is duplicated",
+    ["resource"],
+)
+RETRIES = REGISTRY.counter(
+    "pngme_retries_total",
+    "Requests retried after a transient failure, by outcome: retried, or given up "
+    "for running out of attempts or of the retry budget",
+    ["resource", "outcome"],
+)
+CIRCUIT_STATE = REGISTRY.gauge(
+    "pngme_circuit_state",
+    "State of each resource's circuit breaker: 0 closed, 1 half-open, 2 open",
+    ["resource"],
+)
+CIRCUIT_REJECTED_CALLS = REGISTRY.counter(
+    "pngme_circuit_rejected_calls_total",
+    "Requests failed without reaching the API because their circuit was open",
+    ["resource"],
+)
+POOL_CONNECTIONS = REGISTRY.gauge(
+    "pngme_pool_connections",
+    "Connections of the shared connection pool, by host and state: active or idle",
+    ["host", "state"],
+)
+POOL_CONNECTIONS_OPENED = REGISTRY.counter(
+    "pngme_pool_connections_opened_total",
+    "Connections opened by the shared connection pool, each a TCP and TLS handshake",
+    ["host"],
+)
+POOL_REQUESTS = REGISTRY.counter(
+    "pngme_pool_requests_total",
+    "Requests sent through the shared connection pool",
+    ["host"],
+)
+POOL_WAITING_REQUESTS = REGISTRY.gauge(
+    "pngme_pool_waiting_requests",
+    "Requests waiting for the per-host connection limit of the shared pool",
+    ["host"],
+)
+POOL_DNS_LOOKUPS = REGISTRY.counter(
+    "pngme_pool_dns_lookups_total",
+    "Host name lookups of the shared connection pool, by result: cache hit or miss",
+    ["result"],
+)
+QUERY_RECORDS = REGISTRY.counter(
+    "pngme_query_records_total",
+    "Records of query calls filtered at ingestion, by outcome: kept or discarded",
+    ["resource", "outcome"],
+)
+QUERY_BYTES_SAVED = REGISTRY.counter(
+    "pngme_query_bytes_saved_total",
+    "Estimated JSON bytes of the records and fields queries discarded at ingestion",
+    ["resource"],
+)
+PREFETCH_CALLS = REGISTRY.counter(
+    "pngme_prefetch_calls_total",
+    "Calls of prefetch sessions, by outcome: started by a prefetch, used by a feature "
+    "call, released unused, or started by a feature call before any prefetch did",
+    ["resource", "outcome"],
+)
+STALE_WHILE_REVALIDATE = REGISTRY.counter(
+    "pngme_stale_while_revalidate_total",
+    "Feature values asked for in stale-while-revalidate mode, by state of the value "
+    "held: fresh, stale and refreshed in the background, expired, or missing",
+    ["feature", "state"],
+)
+EVENT_LOOP_LAG = REGISTRY.histogram(
+    "pngme_event_loop_lag_seconds",
+    "Delay between a scheduled event loop wake-up and when it actually ran",
+)
+
+# Records fetched by the feature computation running in the current context. asyncio
+# tasks copy the context when created, so the API calls a feature fans out with
+# asyncio.gather add to the same tally.
+_records_tally: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar(
+    "records_tally", default=None
+)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    """Count a cache lookup; caches call this so their hit ratio is exported."""
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+    hits = CACHE_LOOKUPS.value(cache=cache, result="hit")
+    misses = CACHE_LOOKUPS.value(cache=cache, result="miss")
+    CACHE_HIT_RATIO.set(hits / (hits + misses), cache=cache)
+
+
+class InstrumentedClient(ClientWrapper):
+    """Record latency, outcome and record counts of every resource call."""
+
+    async def _get(self, resource: str, params: Dict[str, Any]) -> List[Record]:
+        API_REQUESTS_IN_FLIGHT.inc(resource=resource)
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            records = await super()._get(resource, params)
+            outcome = "ok"
+        finally:
+            API_REQUEST_LATENCY.observe(time.perf_counter() - start, resource=resource)
+            API_REQUESTS.inc(resource=resource, outcome=outcome)
+            API_REQUESTS_IN_FLIGHT.dec(resource=resource)
+
+        API_RECORDS_FETCHED.inc(len(records), resource=resource)
+        tally = _records_tally.get()
+        if tally is not None:
+            tally[0] += len(records)
+        return records
+
+
+def instrument_feature(
+    function: Callable[..., Awaitable[T]], name: Optional[str] = None
+) -> Callable[..., Awaitable[T]]:
+    """Wrap a feature coroutine function to record its latency and records fetched.
+
+    Args:
+        function: one of the ``get_<feature>`` coroutine functions in lib/
+        name: feature label; defaults to the function name without its ``get_`` prefix
+    """
+    feature = name or function.__name__
+    if name is None and feature.startswith("get_"):
+        feature = feature[len("get_") :]
+
+    @wraps(function)
+    async def instrumented(*args: Any, **kwargs: Any) -> T:
+        tally = [0]
+        token = _records_tally.set(tally)
+        FEATURES_IN_FLIGHT.inc(feature=feature)
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await function(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            FEATURE_LATENCY.observe(elapsed, feature=feature, outcome=outcome)
+            FEATURE_RECORDS_FETCHED.observe(tally[0], feature=feature)
+            FEATURES_IN_FLIGHT.dec(feature=feature)
+            _records_tally.reset(token)
+
+    return instrumented
+
+
+async def monitor_event_loop_lag(interval: float = 0.5) -> None:
+    """Sample event loop lag forever; run it as a background task."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - start - interval))
+
+
+def render_metrics() -> str:
+    """Return all metrics in Prometheus text exposition format."""
+    return REGISTRY.render()
+
+
+def dump_metrics(path: str) -> None:
+    """Atomically write all metrics to ``path``, e.g. for node_exporter's textfile collector."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(render_metrics())
+    os.replace(tmp_path, path)
+
+
+async def handle_metrics_request(request: Request) -> Response:
+    if request.method == "GET" and request.path == "/metrics":
+        return Response(200, render_metrics().encode(), PROMETHEUS_CONTENT_TYPE)
+    return Response(404, b"not found\n", "text/plain")
+
+
+async def serve_metrics(
+    host: str = "127.0.0.1", port: int = 9464
+) -> asyncio.AbstractServer:
+    """Expose ``GET /metrics`` on host:port until the returned server is closed."""
+    return await start_http_server(handle_metrics_request, host, port)
@@ -0,0 +1,166 @@
+"""Concurrent, adaptively bounded pagination of resource calls.
+
+pngme-api fetches the first page of a resource, then every remaining page at once.
+For users with a long history that is a burst of requests which competes for the
+client's whole concurrency limit with every other user being scored. PaginatedClient
+fetches the remaining pages concurrently through a per-resource window sized from
+observed page latency: the window widens while pages come back quickly and halves
+when the API slows down, so that heavy users take one or two round trips when the
+API has headroom without starving everyone else when it doesn't.
+
+The API has no page size parameter, so page size itself cannot be adapted.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from pngme.api import AsyncClient
+
+from .client import ClientWrapper, Record
+from .hedging import HedgePolicy
+from .metrics import PAGE_LATENCY, PAGINATION_WINDOW
+from .retry import RetryPolicy
+
+T = TypeVar("T")
+
+# Key holding the records in each paginated resource's response
+RECORDS_KEY = {
+    "alerts": "alerts",
+    "balances": "balances",
+    "transactions": "transactions",
+    "users": "users",
+}
+
+
+class AdaptiveWindow:
+    """Additive-increase/multiplicative-decrease limit on concurrent page fetches.
+
+    Args:
+        initial: starting number of pages fetched concurrently
+        minimum: smallest window, however slow the API gets
+        maximum: largest window, however fast the API is
+        tolerance: a page slower than ``tolerance`` times the typical latency counts
+            as a sign of congestion
+    """
+
+    def __init__(
+        self,
+        initial: int = 8,
+        minimum: int = 1,
+        maximum: int = 32,
+        tolerance: float = 2.0,
+    ):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.typical_latency = 0.0
+
+    def observe(self, latency: float) -> None:
+        if self.typical_latency and latency > self.tolerance * self.typical_latency:
+            self.limit = max(self.minimum, self.limit // 2)
+        else:
+            self.limit = min(self.maximum, self.limit + 1)
+
+        # Exponentially weighted moving average of page latency
+        if self.typical_latency:
+            self.typical_latency = 0.8 * self.typical_latency + 0.2 * latency
+        else:
+            self.typical_latency = latency
+
+
+class PaginatedClient(ClientWrapper):
+    """Fetch all pages of a resource call concurrently within an adaptive window.
+
+    Pages are requested with the wrapped AsyncClient's per-page method, so this must
+    be the innermost layer of a client stack. Calls that ask for a specific page are
+    passed through unchanged.
+
+    Args:
+        client: the AsyncClient to wrap
+        retry: policy retrying each page, and each call passed through, that fails
+            transiently
+        hedge: policy duplicating each page request, and each call passed through,
+            that outlasts the resource's page latency percentile
+    """
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        retry: Optional[RetryPolicy] = None,
+        hedge: Optional[HedgePolicy] = None,
+    ):
+        super().__init__(client)
+        self.windows = {resource: AdaptiveWindow() for resource in RECORDS_KEY}
+        self.retry = retry
+        self.hedge = hedge
+
+    async def _request(self, resource: str, request: Callable[[], Awaitable[T]]) -> T:
+        """Make one request to the API, hedged and retried as configured."""
+
+        async def attempt() -> T:
+            if self.hedge is None:
+                return await request()
+            return await self.hedge.call(resource, request)
+
+        if self.retry is None:
+            return await attempt()
+        return await self.retry.call(resource, attempt)
+
+    async def _get(self, resource: str, params: Dict[str, Any]) -> List[Record]:
+        if resource not in RECORDS_KEY or params.get("page"):
+
+            async def request() -> List[Record]:
+                return await super(PaginatedClient, self)._get(resource, params)
+
+            return await self._request(resource, request)
+
+        params = {k: v for k, v in params.items() if k != "page"}
+        first_page = await self._get_page(resource, params, 1)
+        pages = [first_page]
+
+        num_pages = first_page["num_pages"]
+        if num_pages > 1:
+            remaining = iter(range(2, num_pages + 1))
+            pages_by_number: Dict[int, Dict[str, Any]] = {}
+
+            async def worker() -> None:
+                for page in remaining:
+                    pages_by_number[page] = await self._get_page(resource, params, page)
+
+            window = self.windows[resource]
+            workers = [
+                asyncio.ensure_future(worker())
+                for _ in range(min(window.limit, num_pages - 1))
+            ]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                # When a page fails, gather doesn't cancel the other workers, whose
+                # pages would be fetched for nothing
+                for task in workers:
+                    task.cancel()
+            pages.extend(pages_by_number[page] for page in sorted(pages_by_number))
+
+        records_key = RECORDS_KEY[resource]
+        return [record for page in pages for record in page[records_key]]
+
+    async def _get_page(
+        self, resource: str, params: Dict[str, Any], page: int
+    ) -> Dict[str, Any]:
+        fetch = getattr(self._client, resource)._get_page
+
+        async def request() -> Dict[str, Any]:
+            response: Dict[str, Any] = await fetch(page=page, **params)
+            return response
+
+        start = time.perf_counter()
+        response = await self._request(resource, request)
+        latency = time.perf_counter() - start
+
+        window = self.windows[resource]
+        window.observe(latency)
+        PAGE_LATENCY.observe(latency, resource=resource)
+        PAGINATION_WINDOW.set(window.limit, resource=resource)
+        return response
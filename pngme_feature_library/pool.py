@@ -0,0 +1,279 @@
+"""One pool of keep-alive HTTP connections shared by every client in the process.
+
+pngme-api opens new connections, and so new TCP and TLS handshakes, for every client
+instance. A service scoring many users ends up with many clients and pays for those
+handshakes in every user's latency. A ConnectionPool holds the connections of every
+client using it:
+
+- connections are kept alive for ``keepalive_expiry`` seconds between requests;
+- at most ``max_connections_per_host`` requests are sent to a host at a time, out of
+  ``max_connections`` connections overall; further requests wait for one to finish;
+- host names are resolved once per ``dns_ttl`` seconds rather than for every new
+  connection.
+
+PersistentSessionClient uses the process-wide pool returned by shared_pool() unless
+given another one, so every client built by the library, including those of the
+feature server, shares its connections:
+
+    client = PersistentSessionClient(token)
+    shared_pool().stats()  # {"api.pngme.com": {"active": 3, "idle": 5, ...}}
+
+The pool's connections and handshakes are also exported as metrics, in
+``pngme_pool_connections`` and ``pngme_pool_connections_opened_total``. A pool belongs
+to the event loop that first uses it.
+"""
+
+import asyncio
+import socket
+from collections import defaultdict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import httpcore
+import httpx
+from httpcore.backends.auto import AutoBackend
+from httpcore.backends.base import AsyncNetworkBackend, AsyncNetworkStream
+
+from .metrics import (
+    POOL_CONNECTIONS,
+    POOL_CONNECTIONS_OPENED,
+    POOL_DNS_LOOKUPS,
+    POOL_REQUESTS,
+    POOL_WAITING_REQUESTS,
+)
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+class DNSCache:
+    """Addresses of host names, each resolved at most once per ``ttl`` seconds.
+
+    Args:
+        ttl: seconds an address is used before the host name is resolved again
+    """
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._addresses: Dict[Tuple[str, int], Tuple[str, float]] = {}
+
+    async def resolve(self, host: str, port: int) -> str:
+        loop = asyncio.get_event_loop()
+        cached = self._addresses.get((host, port))
+        if cached is not None and loop.time() - cached[1] < self.ttl:
+            POOL_DNS_LOOKUPS.inc(result="hit")
+            return cached[0]
+
+        POOL_DNS_LOOKUPS.inc(result="miss")
+        try:
+            infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except OSError as e:
+            raise httpcore.ConnectError(str(e)) from e
+        address = str(infos[0][4][0])
+        self._addresses[(host, port)] = (address, loop.time())
+        return address
+
+    def invalidate(self, host: str, port: int) -> None:
+        self._addresses.pop((host, port), None)
+
+
+class _CachingNetworkBackend(AsyncNetworkBackend):
+    """httpcore network backend connecting to addresses from a DNS cache.
+
+    TLS is still negotiated with the host name, which httpcore passes separately.
+    """
+
+    def __init__(self, dns_cache: DNSCache):
+        self.dns_cache = dns_cache
+        self._backend: Any = AutoBackend()
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        local_address: Optional[str] = None,
+    ) -> AsyncNetworkStream:
+        address = await self.dns_cache.resolve(host, port)
+        try:
+            stream = await self._backend.connect_tcp(
+                address, port, timeout=timeout, local_address=local_address
+            )
+        except httpcore.ConnectError:
+            # The host may have moved; resolve it again for the next attempt
+            self.dns_cache.invalidate(host, port)
+            raise
+        POOL_CONNECTIONS_OPENED.inc(host=host)
+        return stream
+
+    async def connect_unix_socket(
+        self, path: str, timeout: Optional[float] = None
+    ) -> AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(path, timeout=timeout)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response body that frees its request's per-host slot once closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release: Optional[Callable[[], None]] = release
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for part in self._stream:
+            yield part
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+class _PooledTransport(httpx.AsyncBaseTransport):
+    """Transport of the clients sharing a pool; closing a client leaves it open."""
+
+    def __init__(self, pool: "ConnectionPool"):
+        self._pool = pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._pool.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        pass
+
+
+class ConnectionPool:
+    """Keep-alive HTTP connections shared by clients, with per-host limits.
+
+    Args:
+        max_connections: connections open at once, to all hosts
+        max_connections_per_host: requests in flight to one host at once
+        keepalive_expiry: seconds an idle connection is kept open
+        dns_ttl: seconds a host name's address is used before it's resolved again
+        retries: attempts at connecting again when a connection can't be opened
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_connections_per_host: int = 50,
+        keepalive_expiry: float = 30.0,
+        dns_ttl: float = 300.0,
+        retries: int = 10,
+    ):
+        self.max_connections_per_host = max_connections_per_host
+        self.dns_cache = DNSCache(dns_ttl)
+        self._transport = httpx.AsyncHTTPTransport(retries=retries)
+        # httpx doesn't take a network backend; swap in a pool that has one
+        self._connections = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+            retries=retries,
+            network_backend=_CachingNetworkBackend(self.dns_cache),
+        )
+        # Not a public attribute: httpx and httpcore are pinned in pyproject.toml to
+        # the versions this was written against
+        self._transport._pool = self._connections  # type: ignore
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+        self._origins: Dict[str, httpcore.Origin] = {}
+        self._waiting: Dict[str, int] = defaultdict(int)
+
+    @property
+    def transport(self) -> httpx.AsyncBaseTransport:
+        """Transport for an ``httpx.AsyncClient`` sending its requests through the pool."""
+        return _PooledTransport(self)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        slots = self._slots.get(host)
+        if slots is None:
+            slots = self._slots[host] = asyncio.Semaphore(self.max_connections_per_host)
+            url = request.url
+            self._origins[host] = httpcore.Origin(
+                url.raw_scheme, url.raw_host, url.port or _DEFAULT_PORTS[url.scheme]
+            )
+
+        self._waiting[host] += 1
+        POOL_WAITING_REQUESTS.set(self._waiting[host], host=host)
+        try:
+            await slots.acquire()
+        finally:
+            self._waiting[host] -= 1
+            POOL_WAITING_REQUESTS.set(self._waiting[host], host=host)
+
+        def release() -> None:
+            slots.release()
+            self._export_connections()
+
+        POOL_REQUESTS.inc(host=host)
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        # The connection stays in use until the response body is read and closed
+        stream = response.stream  # type: ignore
+        assert isinstance(stream, httpx.AsyncByteStream)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(stream, release),
+            extensions=response.extensions,
+        )
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Connections and requests of each host: active and idle connections,
+        connections opened (each a TCP and TLS handshake), requests sent and requests
+        waiting for the host's limit."""
+        stats: Dict[str, Dict[str, int]] = {}
+        for host, states in self._connection_states().items():
+            stats[host] = {
+                "active": states["active"],
+                "idle": states["idle"],
+                "opened": int(POOL_CONNECTIONS_OPENED.value(host=host)),
+                "requests": int(POOL_REQUESTS.value(host=host)),
+                "waiting": self._waiting.get(host, 0),
+            }
+        return stats
+
+    def _connection_states(self) -> Dict[str, Dict[str, int]]:
+        states: Dict[str, Dict[str, int]] = {
+            host: {"active": 0, "idle": 0} for host in self._slots
+        }
+        connections: List[Any] = self._connections.connections
+        for connection in connections:
+            if connection.is_closed():
+                continue
+            # Pooled connections are httpcore.AsyncHTTPConnection, one per origin
+            for host, origin in self._origins.items():
+                if connection.can_handle_request(origin):
+                    state = "idle" if connection.is_idle() else "active"
+                    states[host][state] += 1
+                    break
+        return states
+
+    def _export_connections(self) -> None:
+        for host, states in self._connection_states().items():
+            for state, count in states.items():
+                POOL_CONNECTIONS.set(count, host=host, state=state)
+
+    async def aclose(self) -> None:
+        """Close every connection of the pool."""
+        await self._transport.aclose()
+
+
+_shared_pool: Optional[ConnectionPool] = None
+
+
+def shared_pool() -> ConnectionPool:
+    """The process-wide pool, created on first use."""
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = ConnectionPool()
+    return _shared_pool
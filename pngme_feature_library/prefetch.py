@@ -0,0 +1,190 @@
+"""Speculative prefetch of the records a user's features need.
+
+Decision services commonly ask for one feature, such as data_recency_minutes, and
+for a handful of others a few hundred milliseconds later. Prefetching starts every
+API call those features make as soon as scoring begins:
+
+    client = PrefetchingClient(SingleFlightClient(AsyncClient(token)))
+    async with client.prefetch(user_uuid, names, utc_starttime, utc_endtime):
+        await get_data_recency_minutes(client, user_uuid, utc_starttime, utc_endtime)
+        ...  # later features wait on the prefetched calls rather than repeat them
+
+The calls a feature makes depend on the user's institutions, so they are found by
+running the features themselves in the background, through the client, and keeping
+the outcome of every call they make for the session. Feature calls made with the same
+parameters, and so the same time window, while the session is open share those
+calls, finished or still in flight. Their values are discarded.
+
+Closing the session, when the ``async with`` block ends or with ``close()``, cancels
+the fetches no feature call waits for and releases the records. Sessions left open
+are closed ``ttl`` seconds after they started.
+"""
+
+import asyncio
+import contextvars
+import logging
+from datetime import datetime
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+)
+
+from .client import ClientWrapper, Record, request_key
+from .composite import primitives_of
+from .metrics import PREFETCH_CALLS
+from .registry import load_feature
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which a prefetch session nobody closed releases its records
+DEFAULT_TTL = 60.0
+
+# Session whose features are running in the current context. asyncio tasks copy the
+# context when created, so the calls a feature fans out with asyncio.gather see it.
+_prefetching: contextvars.ContextVar[Optional["PrefetchSession"]] = (
+    contextvars.ContextVar("prefetching", default=None)
+)
+
+
+class PrefetchSession:
+    """Calls prefetched for one user's features, shared until the session is closed."""
+
+    def __init__(
+        self,
+        client: "PrefetchingClient",
+        user_uuid: str,
+        names: Sequence[str],
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+    ):
+        self.client = client
+        self.user_uuid = user_uuid
+        self.names = list(names)
+        self.utc_starttime = utc_starttime
+        self.utc_endtime = utc_endtime
+        self.calls: Dict[Hashable, "asyncio.Future[List[Record]]"] = {}
+        self.closed = False
+        # Resources of the calls started by the prefetch, and the calls feature calls
+        # used
+        self._prefetched: Dict[Hashable, str] = {}
+        self._used: Set[Hashable] = set()
+        self._tasks: List["asyncio.Future[Any]"] = []
+        self._expiry: Optional[asyncio.TimerHandle] = None
+
+    def start(self, ttl: float) -> None:
+        primitives = sorted(set().union(*[primitives_of(n) for n in self.names]))
+        self._tasks = [
+            asyncio.ensure_future(self._run(primitive)) for primitive in primitives
+        ]
+        self._expiry = asyncio.get_event_loop().call_later(ttl, self.close)
+
+    async def _run(self, name: str) -> None:
+        _prefetching.set(self)
+        try:
+            await load_feature(name)(
+                self.client, self.user_uuid, self.utc_starttime, self.utc_endtime
+            )
+        except Exception as e:
+            # The feature call itself will fail too, and report why
+            logger.debug("Prefetching for %s failed: %r", name, e)
+
+    def call(
+        self,
+        resource: str,
+        key: Hashable,
+        fetch: Callable[[], Awaitable[List[Record]]],
+    ) -> "asyncio.Future[List[Record]]":
+        """The session's call for a key, started with ``fetch()`` if there's none."""
+        prefetching = _prefetching.get() is self
+        call = self.calls.get(key)
+        if call is None:
+            call = self.calls[key] = asyncio.ensure_future(fetch())
+            if prefetching:
+                self._prefetched[key] = resource
+                PREFETCH_CALLS.inc(resource=resource, outcome="prefetched")
+            else:
+                # The prefetch didn't get to this call yet, or doesn't make it
+                self._used.add(key)
+                PREFETCH_CALLS.inc(resource=resource, outcome="missed")
+        elif not prefetching and key not in self._used:
+            self._used.add(key)
+            PREFETCH_CALLS.inc(resource=resource, outcome="used")
+        return call
+
+    def close(self) -> None:
+        """Cancel the fetches no feature call waits for and release the records."""
+        if self.closed:
+            return
+        self.closed = True
+        if self._expiry is not None:
+            self._expiry.cancel()
+        for task in self._tasks:
+            task.cancel()
+        for key, resource in self._prefetched.items():
+            if key not in self._used:
+                self.calls[key].cancel()
+                PREFETCH_CALLS.inc(resource=resource, outcome="unused")
+        self.calls.clear()
+        self.client._release(self)
+
+    async def __aenter__(self) -> "PrefetchSession":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class PrefetchingClient(ClientWrapper):
+    """Share the calls of a user's prefetch session with the user's feature calls.
+
+    Calls of users without an open session are passed through.
+
+    Args:
+        client: the client to wrap
+        ttl: seconds after which sessions left open are closed
+    """
+
+    def __init__(self, client: Any, ttl: float = DEFAULT_TTL):
+        super().__init__(client)
+        self.ttl = ttl
+        self.sessions: Dict[str, PrefetchSession] = {}
+
+    def prefetch(
+        self,
+        user_uuid: str,
+        names: Sequence[str],
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+    ) -> PrefetchSession:
+        """Start fetching what the features need; replaces the user's open session."""
+        previous = self.sessions.get(user_uuid)
+        if previous is not None:
+            previous.close()
+        session = self.sessions[user_uuid] = PrefetchSession(
+            self, user_uuid, names, utc_starttime, utc_endtime
+        )
+        session.start(self.ttl)
+        return session
+
+    def _release(self, session: PrefetchSession) -> None:
+        if self.sessions.get(session.user_uuid) is session:
+            del self.sessions[session.user_uuid]
+
+    async def _get(self, resource: str, params: Dict[str, Any]) -> List[Record]:
+        session = self.sessions.get(params.get("user_uuid", ""))
+        if session is None:
+            return await super()._get(resource, params)
+
+        async def fetch() -> List[Record]:
+            return await super(PrefetchingClient, self)._get(resource, params)
+
+        call = session.call(resource, request_key(resource, params), fetch)
+        # Cancelling one caller must not cancel the call others wait for
+        return await asyncio.shield(call)
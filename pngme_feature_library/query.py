@@ -0,0 +1,144 @@
+"""Declarative record queries, filtered as early as the API allows.
+
+Features commonly fetch more records than they use and discard the rest: debits when
+summing credits, alerts without loan labels when counting loan activity. A Query
+declares the records and fields a feature needs:
+
+    credits = Query("transactions", account_types=("depository",), impacts=("CREDIT",))
+    by_institution = await fetch(
+        api_client, credits, user_uuid, institution_ids, utc_starttime, utc_endtime
+    )
+
+fetch passes the filters the API supports on to it, so those records are never
+downloaded: ``labels`` for every resource and ``account_types`` for balances and
+transactions. The other filters, and the projection to ``fields``, are applied to
+each call's records as they are ingested, before features build anything from them.
+The records and estimated bytes discarded at ingestion are counted in
+``pngme_query_records_total`` and ``pngme_query_bytes_saved_total``.
+
+The API's filters match any of the given values, and so do the others. Calls for the
+same pushed-down filters are identical whatever is filtered at ingestion, so features
+querying the same records still share them through SingleFlightClient and
+CachingClient.
+"""
+
+import asyncio
+import json
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .client import Record
+from .metrics import QUERY_BYTES_SAVED, QUERY_RECORDS
+
+# Filters each resource's API call accepts
+PUSHDOWN_FILTERS: Dict[str, Tuple[str, ...]] = {
+    "alerts": ("labels",),
+    "balances": ("account_types", "labels"),
+    "transactions": ("account_types", "labels"),
+}
+
+
+class Query(NamedTuple):
+    """Records of a resource a feature needs, and the fields it reads of them."""
+
+    resource: str
+    account_types: Optional[Tuple[str, ...]] = None
+    labels: Optional[Tuple[str, ...]] = None
+    impacts: Optional[Tuple[str, ...]] = None
+    # Fields kept of each record; all of them if None
+    fields: Optional[Tuple[str, ...]] = None
+
+    def pushed_down(self) -> Dict[str, List[str]]:
+        """Parameters of the API call applying the filters the API supports."""
+        params = {}
+        for name in PUSHDOWN_FILTERS[self.resource]:
+            values = getattr(self, name)
+            if values is not None:
+                params[name] = list(values)
+        return params
+
+    def residual_filters(self) -> Dict[str, Tuple[str, ...]]:
+        """Filters the API doesn't support, by name."""
+        filters = {}
+        for name in ("account_types", "labels", "impacts"):
+            values = getattr(self, name)
+            if values is not None and name not in PUSHDOWN_FILTERS[self.resource]:
+                filters[name] = values
+        return filters
+
+    def ingest(self, records: List[Record]) -> List[Record]:
+        """Apply the filters the API didn't and keep only the query's fields."""
+        filters = self.residual_filters()
+        if not records or (not filters and self.fields is None):
+            return records
+
+        kept = records
+        if filters:
+            account_types = filters.get("account_types")
+            labels = set(filters.get("labels", ()))
+            impacts = filters.get("impacts")
+            kept = [
+                record
+                for record in records
+                if (account_types is None or record["account_type"] in account_types)
+                and (not labels or labels.intersection(record["labels"] or ()))
+                and (impacts is None or record["impact"] in impacts)
+            ]
+        if self.fields is not None:
+            fields = self.fields
+            kept = [{field: record[field] for field in fields} for record in kept]
+
+        self._report(records, kept)
+        return kept
+
+    def _report(self, records: List[Record], kept: List[Record]) -> None:
+        # Records of a call are alike; estimate their size from the first one rather
+        # than serializing them all
+        record_bytes = _json_size(records[0])
+        kept_bytes = record_bytes
+        if self.fields is not None:
+            kept_bytes = _json_size({f: records[0][f] for f in self.fields})
+        discarded = len(records) - len(kept)
+        saved = discarded * record_bytes + len(kept) * (record_bytes - kept_bytes)
+
+        QUERY_RECORDS.inc(len(kept), resource=self.resource, outcome="kept")
+        QUERY_RECORDS.inc(discarded, resource=self.resource, outcome="discarded")
+        QUERY_BYTES_SAVED.inc(saved, resource=self.resource)
+
+
+def _json_size(record: Record) -> int:
+    return len(json.dumps(record, default=str))
+
+
+async def fetch(
+    api_client: Any,
+    query: Query,
+    user_uuid: str,
+    institution_ids: Sequence[str],
+    utc_starttime: datetime,
+    utc_endtime: datetime,
+) -> List[List[Record]]:
+    """Records matching a query of each of a user's institutions, in order.
+
+    Args:
+        api_client: Pngme Async API client
+        query: the records to fetch
+        user_uuid: the Pngme user_uuid for the mobile phone user
+        institution_ids: the institutions to fetch the records of
+        utc_starttime: the UTC time to start the time window
+        utc_endtime: the UTC time to end the time window
+    """
+    resource = getattr(api_client, query.resource)
+    pushed_down = query.pushed_down()
+
+    async def fetch_institution(institution_id: str) -> List[Record]:
+        records: List[Record] = await resource.get(
+            user_uuid=user_uuid,
+            institution_id=institution_id,
+            utc_starttime=utc_starttime,
+            utc_endtime=utc_endtime,
+            **pushed_down,
+        )
+        return query.ingest(records)
+
+    return await asyncio.gather(*[fetch_institution(i) for i in institution_ids])
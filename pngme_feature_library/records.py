@@ -0,0 +1,269 @@
+"""Compact record types for transactions, balances and alerts.
+
+The API returns each record as a dict of strings, and features flattening the records
+of several institutions commonly copy those dicts to add an ``institution_id``. The
+types here are NamedTuples, storing their fields in a tuple rather than a dict: a
+Balance takes less than half the memory of a copy of the dict it's built from, and
+reading a field is an attribute lookup. Identifiers, account types and impacts are
+interned, so the thousands of records of a user share one string per institution or
+account, and timestamps are parsed once to POSIX seconds, so that ordering records
+compares floats.
+
+    balances = to_balances(balances_by_institution, institution_ids)
+    sum_balances(latest_balances(balances).values())
+
+Amounts are summed as floats, or, within ``fixed_point_amounts()``, as integer minor
+units (see pngme_feature_library.fixed_point) converted to floats only once summed.
+Transactions built within the block carry their amount's minor units, encoded once:
+
+    with fixed_point_amounts(decimals=2):
+        total, count = sum_amounts(transactions, impact="CREDIT")
+
+Fields missing from a record, such as those a Query didn't keep, are None; every
+balance has a balance.
+"""
+
+import contextlib
+import contextvars
+import sys
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from .client import Record
+from .fixed_point import MinorUnits
+from .timestamps import parse_timestamp
+
+# Decimal places of the minor units amounts are summed in by the feature calls running
+# in the current context, or None to sum them as floats
+_amount_decimals: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar(
+    "amount_decimals", default=None
+)
+
+
+class Transaction(NamedTuple):
+    institution_id: str
+    account_id: Optional[str]
+    account_type: Optional[str]
+    # POSIX seconds
+    timestamp: Optional[float]
+    amount: Optional[float]
+    impact: Optional[str]
+    # Minor units of the amount, for transactions built within fixed_point_amounts()
+    amount_minor_units: Optional[int] = None
+
+
+class Balance(NamedTuple):
+    institution_id: str
+    account_id: Optional[str]
+    account_type: Optional[str]
+    # POSIX seconds
+    timestamp: Optional[float]
+    balance: float
+
+
+class Alert(NamedTuple):
+    institution_id: str
+    # POSIX seconds
+    timestamp: Optional[float]
+    labels: Tuple[str, ...]
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return None if value is None else sys.intern(value)
+
+
+def _timestamp(record: Record) -> Optional[float]:
+    timestamp = record.get("timestamp")
+    return None if timestamp is None else parse_timestamp(timestamp)
+
+
+def _minor_units() -> Optional[MinorUnits]:
+    decimals = _amount_decimals.get()
+    return None if decimals is None else MinorUnits(decimals)
+
+
+def _encode(amount: Optional[float], units: Optional[MinorUnits]) -> Optional[int]:
+    return None if amount is None or units is None else units.encode(amount)
+
+
+def to_transactions(
+    records_by_institution: Iterable[List[Record]], institution_ids: Sequence[str]
+) -> List[Transaction]:
+    """Transactions of each institution's records, in order.
+
+    Args:
+        records_by_institution: transaction records, one list per institution
+        institution_ids: the institution of each list
+    """
+    units = _minor_units()
+    return [
+        Transaction(
+            institution_id,
+            _intern(record.get("account_id")),
+            _intern(record.get("account_type")),
+            _timestamp(record),
+            record.get("amount"),
+            _intern(record.get("impact")),
+            _encode(record.get("amount"), units),
+        )
+        for institution_id, records in zip(
+            map(sys.intern, institution_ids), records_by_institution
+        )
+        for record in records
+    ]
+
+
+def to_balances(
+    records_by_institution: Iterable[List[Record]], institution_ids: Sequence[str]
+) -> List[Balance]:
+    """Balances of each institution's records, in order.
+
+    Args:
+        records_by_institution: balance records, one list per institution
+        institution_ids: the institution of each list
+    """
+    return [
+        Balance(
+            institution_id,
+            _intern(record.get("account_id")),
+            _intern(record.get("account_type")),
+            _timestamp(record),
+            record["balance"],
+        )
+        for institution_id, records in zip(
+            map(sys.intern, institution_ids), records_by_institution
+        )
+        for record in records
+    ]
+
+
+def to_alerts(
+    records_by_institution: Iterable[List[Record]], institution_ids: Sequence[str]
+) -> List[Alert]:
+    """Alerts of each institution's records, in order.
+
+    Args:
+        records_by_institution: alert records, one list per institution
+        institution_ids: the institution of each list
+    """
+    return [
+        Alert(
+            institution_id,
+            _timestamp(record),
+            tuple(map(sys.intern, record.get("labels") or ())),
+        )
+        for institution_id, records in zip(
+            map(sys.intern, institution_ids), records_by_institution
+        )
+        for record in records
+    ]
+
+
+@contextlib.contextmanager
+def fixed_point_amounts(decimals: Optional[int] = 2) -> Iterator[None]:
+    """Sum amounts as integer minor units in the feature calls made within the block.
+
+    Args:
+        decimals: decimal places of the minor units; None sums amounts as floats
+    """
+    token = _amount_decimals.set(decimals)
+    try:
+        yield
+    finally:
+        _amount_decimals.reset(token)
+
+
+def _sum_minor_units(
+    transactions: Iterable[Transaction], impact: Optional[str], units: MinorUnits
+) -> Tuple[int, int]:
+    total = 0
+    count = 0
+    for transaction in transactions:
+        if impact is None or transaction.impact == impact:
+            minor_units = transaction.amount_minor_units
+            if minor_units is None:
+                if transaction.amount is None:
+                    continue
+                # Built outside of fixed_point_amounts()
+                minor_units = units.encode(transaction.amount)
+            total += minor_units
+            count += 1
+    return total, count
+
+
+def sum_amounts(
+    transactions: Iterable[Transaction], impact: Optional[str] = None
+) -> Tuple[float, int]:
+    """Total and number of the amounts of transactions, of the given impact if any.
+
+    Transactions without an amount are left out of both.
+    """
+    units = _minor_units()
+    if units is not None:
+        total_units, count = _sum_minor_units(transactions, impact, units)
+        return units.decode(total_units), count
+
+    total: float = 0
+    count = 0
+    for transaction in transactions:
+        if transaction.amount is not None and (
+            impact is None or transaction.impact == impact
+        ):
+            total += transaction.amount
+            count += 1
+    return total, count
+
+
+def net_amounts(
+    transactions: Sequence[Transaction],
+    inflow: str = "CREDIT",
+    outflow: str = "DEBIT",
+) -> Tuple[float, int]:
+    """Total of inflow amounts less outflow amounts, and the number of both."""
+    units = _minor_units()
+    if units is not None:
+        inflow_units, inflow_count = _sum_minor_units(transactions, inflow, units)
+        outflow_units, outflow_count = _sum_minor_units(transactions, outflow, units)
+        return (
+            units.decode(inflow_units - outflow_units),
+            inflow_count + outflow_count,
+        )
+
+    inflow_total, inflow_count = sum_amounts(transactions, inflow)
+    outflow_total, outflow_count = sum_amounts(transactions, outflow)
+    return inflow_total - outflow_total, inflow_count + outflow_count
+
+
+def sum_balances(balances: Iterable[float]) -> float:
+    """Total of balances, such as the values of latest_balances."""
+    units = _minor_units()
+    if units is not None:
+        return units.decode(units.sum(balances))
+    return sum(balances)
+
+
+def latest_balances(
+    balances: Iterable[Balance],
+) -> Dict[Tuple[str, Optional[str]], float]:
+    """Latest balance of each institution's account, latest accounts first.
+
+    Of balances with the same timestamp, the first one given is the latest.
+    """
+    latest: Dict[Tuple[str, Optional[str]], float] = {}
+    for balance in sorted(balances, key=_balance_time, reverse=True):
+        key = (balance.institution_id, balance.account_id)
+        if key not in latest:
+            latest[key] = balance.balance
+    return latest
+
+
+def _balance_time(balance: Balance) -> float:
+    return balance.timestamp if balance.timestamp is not None else float("-inf")
@@ -0,0 +1,74 @@
+"""Registry of the features implemented in lib/.
+
+Each feature lives in ``lib/<name>/main.py`` as a standalone example script, which is
+importable as the module ``pngme_feature_library.features.<name>``. The registry maps
+feature names to the coroutine function computing them and imports the module the
+first time a feature is requested.
+"""
+
+import importlib
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+_PACKAGE_DIR = Path(__file__).resolve().parent
+
+# Installed packages ship the features as pngme_feature_library/lib/; in a checkout,
+# or an editable install of one, lib/ sits next to the package
+LIB_DIR = _PACKAGE_DIR / "lib"
+if not LIB_DIR.is_dir():
+    LIB_DIR = _PACKAGE_DIR.parent / "lib"
+
+# Every feature takes (api_client, user_uuid, utc_starttime, utc_endtime) positionally
+FeatureFunction = Callable[[Any, str, datetime, datetime], Awaitable[Any]]
+
+FEATURE_FUNCTIONS: Dict[str, str] = {
+    "average_end_of_day_depository_balance": "get_average_end_of_day_depository_balance",
+    "average_end_of_day_loan_balance": "get_average_end_of_day_loan_balance",
+    "count_betting_and_lottery_events": "get_count_betting_and_lottery_events",
+    "count_insufficient_funds_events": "get_count_insufficient_funds_events",
+    "count_loan_declined_events": "get_count_loan_declined_events",
+    "count_loan_defaulted_events": "get_count_loan_defaulted_events",
+    "count_loan_repaid_events": "get_count_loan_repaid_events",
+    "count_loan_repayment_events": "get_count_loan_repayment_events",
+    "count_missed_payment_events": "get_count_missed_payment_events",
+    "count_opened_loans": "get_count_institutions_with_open_loans",
+    "count_overdraft_events": "get_count_overdraft_events",
+    "count_transactions_depository": "get_count_transactions_depository",
+    "count_user_shared_device_ids": "get_count_user_shared_device_ids",
+    "daily_average_of_stacked_loan_alerts": "get_daily_average_of_stacked_loan_alerts",
+    "data_recency_minutes": "get_data_recency_minutes",
+    "debt_to_income_ratio_latest": "get_debt_to_income_ratio_latest",
+    "median_end_of_day_depository_balance": "get_median_end_of_day_depository_balance",
+    "net_cash_flow": "get_net_cash_flow",
+    "standard_deviation_of_week_to_week_sum_of_credits": "get_standard_deviation_of_week_to_week_sum_of_credits",
+    "sum_of_credits": "get_sum_of_credits",
+    "sum_of_debits": "get_sum_of_debits",
+    "sum_of_depository_balances_latest": "get_sum_of_depository_balances_latest",
+    "sum_of_loan_balances_latest": "get_sum_of_loan_balances_latest",
+    "sum_of_loan_repayments": "get_sum_of_loan_repayments",
+}
+
+_loaded: Dict[str, FeatureFunction] = {}
+
+
+def feature_names() -> List[str]:
+    return sorted(FEATURE_FUNCTIONS)
+
+
+def load_feature(name: str) -> FeatureFunction:
+    """Import the module of a feature if needed and return its feature function.
+
+    Raises:
+        KeyError: if no feature with this name exists
+    """
+    if name in _loaded:
+        return _loaded[name]
+
+    if name not in FEATURE_FUNCTIONS:
+        raise KeyError(f"Unknown feature: {name}")
+
+    module = importlib.import_module(f"pngme_feature_library.features.{name}")
+    function: FeatureFunction = getattr(module, FEATURE_FUNCTIONS[name])
+    _loaded[name] = function
+    return function
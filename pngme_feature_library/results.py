@@ -0,0 +1,209 @@
+"""Cache of feature values keyed by the version of the user's data.
+
+A user re-scored without new SMS data gets the same feature values, so values are
+cached under (feature, user_uuid, window, data version). The data version is probed
+the way get_data_recency_minutes finds the most recent record: one first-page call
+per resource and institution, whose most recent timestamps change when new data
+arrives. A re-score with unchanged data costs a probe instead of fetching every
+record and computing every feature:
+
+    version = await probe_data_version(api_client, user_uuid, utc_starttime, utc_endtime)
+    value = cache.get(name, user_uuid, utc_starttime, utc_endtime, version)
+
+Like get_data_recency_minutes, the probe relies on the first page holding a
+resource's most recent records. The version only covers that first page: a record
+ingested late with a timestamp older than the first page's changes neither its most
+recent timestamp nor its length, and the API reports no total of the whole window. So
+values are also cached for at most ``ttl`` seconds, which bounds how long such records
+go unnoticed.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Hashable, NamedTuple, Optional, Tuple
+
+from .metrics import record_cache_lookup
+from .timestamps import parse_timestamp
+
+PROBED_RESOURCES = ("alerts", "balances", "transactions")
+
+# Features whose values depend on data the probe doesn't cover; never cached
+UNVERSIONED_FEATURES = frozenset({"count_user_shared_device_ids"})
+
+# Features such as the end-of-day balances read balances from before the window, so
+# the probe looks back this far to notice them
+DEFAULT_PROBE_LOOKBACK = timedelta(days=10)
+
+# (institution_id, resource, most recent timestamp, records on the first page) for
+# each probed call, sorted
+DataVersion = Tuple[Tuple[str, str, float, int], ...]
+
+# Seconds feature values are cached for, whatever their data version
+DEFAULT_RESULT_TTL = 3600.0
+
+# Returned by FeatureResultCache.get for values that aren't cached, as None is a
+# valid feature value
+MISSING = object()
+
+
+async def probe_data_version(
+    api_client: Any,
+    user_uuid: str,
+    utc_starttime: datetime,
+    utc_endtime: datetime,
+    lookback: timedelta = DEFAULT_PROBE_LOOKBACK,
+) -> DataVersion:
+    """Version of the user's alerts, balances and transactions in a time window."""
+    institutions = await api_client.institutions.get(user_uuid=user_uuid)
+    calls = [
+        (institution["institution_id"], resource)
+        for institution in institutions
+        for resource in PROBED_RESOURCES
+    ]
+    first_pages = await asyncio.gather(
+        *[
+            getattr(api_client, resource).get(
+                user_uuid=user_uuid,
+                institution_id=institution_id,
+                utc_starttime=utc_starttime - lookback,
+                utc_endtime=utc_endtime,
+                page=1,
+            )
+            for institution_id, resource in calls
+        ]
+    )
+    return tuple(
+        sorted(
+            (
+                institution_id,
+                resource,
+                max(
+                    (parse_timestamp(record["timestamp"]) for record in records),
+                    default=0.0,
+                ),
+                len(records),
+            )
+            for (institution_id, resource), records in zip(calls, first_pages)
+        )
+    )
+
+
+class ResultCacheStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class FeatureResultCache:
+    """LRU cache of feature values, keyed by feature, user, window and data version.
+
+    Lookups are reported to the metrics module under ``name``, and counted in
+    ``stats()`` along with evictions.
+
+    Args:
+        max_size: values kept, the least recently used being dropped first
+        name: name of the cache in metrics
+        ttl: seconds a value is cached for, as data versions don't notice every
+            change; None to keep values until they're evicted
+    """
+
+    def __init__(
+        self,
+        max_size: int = 100_000,
+        name: str = "feature_results",
+        ttl: Optional[float] = DEFAULT_RESULT_TTL,
+    ):
+        self.max_size = max_size
+        self.name = name
+        self.ttl = ttl
+        # Values and the time they were cached at
+        self._values: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def _key(
+        name: str,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        version: DataVersion,
+    ) -> Hashable:
+        return (name, user_uuid, utc_starttime, utc_endtime, version)
+
+    def get(
+        self,
+        name: str,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        version: DataVersion,
+    ) -> Any:
+        """Return the cached value, or MISSING."""
+        key = self._key(name, user_uuid, utc_starttime, utc_endtime, version)
+        hit = self._fresh(key)
+        record_cache_lookup(self.name, hit=hit)
+        if not hit:
+            self._misses += 1
+            return MISSING
+        self._hits += 1
+        self._values.move_to_end(key)
+        return self._values[key][0]
+
+    def _fresh(self, key: Hashable) -> bool:
+        """Whether a value is cached and younger than the TTL, dropping it if not."""
+        entry = self._values.get(key)
+        if entry is None:
+            return False
+        if self.ttl is not None and time.monotonic() - entry[1] >= self.ttl:
+            del self._values[key]
+            return False
+        return True
+
+    def contains(
+        self,
+        name: str,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        version: DataVersion,
+    ) -> bool:
+        """Whether a value is cached, without counting a lookup."""
+        key = self._key(name, user_uuid, utc_starttime, utc_endtime, version)
+        return self._fresh(key)
+
+    def set(
+        self,
+        name: str,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        version: DataVersion,
+        value: Any,
+    ) -> None:
+        if name in UNVERSIONED_FEATURES:
+            return
+        key = self._key(name, user_uuid, utc_starttime, utc_endtime, version)
+        self._values[key] = (value, time.monotonic())
+        self._values.move_to_end(key)
+        while len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+            self._evictions += 1
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def stats(self) -> ResultCacheStats:
+        return ResultCacheStats(self._hits, self._misses, self._evictions, len(self))
+
+    def __len__(self) -> int:
+        return len(self._values)
@@ -0,0 +1,230 @@
+"""Retries with jittered exponential backoff, and a circuit breaker per resource.
+
+A feature gathers one call per institution, so a single transient error or 429 fails
+the whole feature, and callers retrying whole features multiply the load on an API
+that is already struggling. A RetryPolicy retries the individual requests instead:
+
+- only transient failures are retried: connection errors and timeouts, 429 and 5xx
+  responses. Every resource call is a read, so repeating a request is safe and
+  returns the same records;
+- retries back off exponentially with full jitter, so that callers which failed
+  together don't retry together, and wait at least as long as a 429's Retry-After;
+- retries are paid for from a budget earning ``retry_ratio`` of a retry per request,
+  so that when most requests fail the API sees little more than the original load;
+- each resource has a circuit breaker. After ``failure_threshold`` consecutive
+  transient failures it opens and requests fail at once with CircuitOpen, without
+  reaching the API, for ``reset_timeout`` seconds. A single probe request then
+  decides whether it closes again.
+
+PaginatedClient retries each page through a policy, as built by the feature server;
+in front of any other client, use RetryingClient:
+
+    client = RetryingClient(AsyncClient(token))
+
+pngme-api's AsyncClient raises an assertion for a 429, which isn't retried;
+PersistentSessionClient raises RetryableStatus for 429 and 5xx responses instead.
+"""
+
+import asyncio
+import enum
+import logging
+import random
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import httpx
+from pngme.api.errors import ServerError
+
+from .client import ClientWrapper, Record, RetryableStatus
+from .metrics import CIRCUIT_REJECTED_CALLS, CIRCUIT_STATE, RETRIES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CircuitOpen(Exception):
+    """Raised instead of making a request while its resource's circuit is open."""
+
+
+def is_transient(exception: BaseException) -> bool:
+    """Whether a request failing with ``exception`` may succeed if repeated."""
+    return isinstance(exception, (RetryableStatus, ServerError, httpx.TransportError))
+
+
+class CircuitState(enum.IntEnum):
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class CircuitBreaker:
+    """Fail requests fast while an endpoint keeps failing.
+
+    Args:
+        failure_threshold: consecutive transient failures that open the circuit
+        reset_timeout: seconds the circuit stays open before a probe request
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """Whether a request may be made now; if so, it must be recorded."""
+        if self.state == CircuitState.CLOSED:
+            return True
+        if self.state == CircuitState.OPEN:
+            now = asyncio.get_event_loop().time()
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            self.state = CircuitState.HALF_OPEN
+        # Half-open: let a single probe request through
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def release(self) -> None:
+        """Forget a request allowed through that was cancelled before completing."""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.state = CircuitState.CLOSED
+        self._failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probing = False
+        if (
+            self.state == CircuitState.HALF_OPEN
+            or self._failures >= self.failure_threshold
+        ):
+            if self.state != CircuitState.OPEN:
+                logger.warning(
+                    "Circuit opened after %d consecutive failures", self._failures
+                )
+            self.state = CircuitState.OPEN
+            self._opened_at = asyncio.get_event_loop().time()
+
+
+class RetryPolicy:
+    """Retry transient failures of requests, with a circuit breaker per resource.
+
+    Args:
+        max_attempts: attempts of a request, including the first
+        base_delay: seconds of the largest possible delay before the first retry,
+            doubling with every retry
+        max_delay: largest possible delay before any retry
+        retry_ratio: retries earned by each request, capping retries to this fraction
+            of requests when failures persist
+        failure_threshold: consecutive transient failures of a resource that open its
+            circuit
+        reset_timeout: seconds a resource's circuit stays open before a probe request
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base_delay: float = 0.1,
+        max_delay: float = 5.0,
+        retry_ratio: float = 0.2,
+        failure_threshold: int = 5,
+        reset_timeout: float = 10.0,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_ratio = retry_ratio
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        # Token bucket: each request earns retry_ratio of a retry, each retry spends
+        # one, with a few saved up for isolated failures
+        self._retry_tokens = self._max_retry_tokens = 10.0
+
+    def breaker(self, resource: str) -> CircuitBreaker:
+        breaker = self.breakers.get(resource)
+        if breaker is None:
+            breaker = self.breakers[resource] = CircuitBreaker(
+                self.failure_threshold, self.reset_timeout
+            )
+        return breaker
+
+    def backoff(self, retry: int) -> float:
+        """Delay before the given retry, counting from 0: "full jitter" backoff."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**retry))
+
+    async def call(self, resource: str, request: Callable[[], Awaitable[T]]) -> T:
+        """Make a request, retrying it while it fails transiently.
+
+        Raises:
+            CircuitOpen: if the resource's circuit is open
+        """
+        breaker = self.breaker(resource)
+        self._retry_tokens = min(
+            self._retry_tokens + self.retry_ratio, self._max_retry_tokens
+        )
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                CIRCUIT_REJECTED_CALLS.inc(resource=resource)
+                raise CircuitOpen(f"Circuit of {resource} is open")
+            try:
+                result = await request()
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except Exception as exception:
+                if not is_transient(exception):
+                    # The API answered; a client error says nothing of its health
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                CIRCUIT_STATE.set(breaker.state, resource=resource)
+
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    RETRIES.inc(resource=resource, outcome="attempts_exhausted")
+                    raise
+                if self._retry_tokens < 1:
+                    RETRIES.inc(resource=resource, outcome="budget_exhausted")
+                    raise
+                self._retry_tokens -= 1
+                RETRIES.inc(resource=resource, outcome="retried")
+
+                delay = self.backoff(attempt - 1)
+                retry_after = getattr(exception, "retry_after", None)
+                if retry_after is not None:
+                    delay = max(delay, min(retry_after, self.max_delay))
+                await asyncio.sleep(delay)
+            else:
+                breaker.record_success()
+                CIRCUIT_STATE.set(breaker.state, resource=resource)
+                return result
+
+
+class RetryingClient(ClientWrapper):
+    """Retry resource calls that fail transiently, per RetryPolicy.
+
+    Retries whole calls; below a PaginatedClient, pass the policy to it instead so
+    that only the failed pages are retried.
+
+    Args:
+        client: the client to wrap
+        policy: retry policy; a default RetryPolicy if not given
+    """
+
+    def __init__(self, client: Any, policy: Optional[RetryPolicy] = None):
+        super().__init__(client)
+        self.policy = policy or RetryPolicy()
+
+    async def _get(self, resource: str, params: Dict[str, Any]) -> List[Record]:
+        async def request() -> List[Record]:
+            return await super(RetryingClient, self)._get(resource, params)
+
+        return await self.policy.call(resource, request)
@@ -0,0 +1,629 @@
+"""Daily rollups of each user's records, from which most features are computed.
+
+Most features reduce to daily aggregates per institution and account. RollupStore
+fetches a user's transactions, balances and alerts once, keeps per UTC day:
+
+- the count and sum of transactions per institution, account, account type and impact;
+- the last balance of each account;
+- the number of alerts per institution and label;
+
+and computes features from these few hundred rows instead of the raw records:
+
+    store = RollupStore("rollups.sqlite")
+    await store.update(api_client, user_uuid, utc_starttime, utc_endtime)
+    store.compute("sum_of_credits", user_uuid, utc_starttime, utc_endtime)
+
+Only whole days are rolled up, and ``update`` only fetches the days not rolled up yet,
+so updating a user daily appends one day at a time. Records may reach the API well
+after their timestamp, when a phone syncs its SMS late, so days rolled up less than
+``settling_period`` after they ended are rolled up again by every update until they
+have settled.
+
+Features are computed for windows starting and ending at midnight UTC, taken as the
+whole days from ``utc_starttime`` up to but excluding ``utc_endtime``; records at
+exactly ``utc_endtime``, which the API includes in a window, are left out. Sums of
+amounts are added up day by day, so they may differ from the features in lib/ by
+floating-point rounding.
+"""
+
+import asyncio
+import json
+import sqlite3
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .end_of_day import daily_total_balances, mean, median
+from .timestamps import parse_timestamp, to_timestamp
+from .weekly import WeeklyBuckets
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Balances are carried forward for this many days by the end-of-day balance features,
+# which fetch as many days of balances before their window
+BALANCE_VALID_FOR_DAYS = 10
+
+# Days rolled up on a user's first update if no start is given
+DEFAULT_HISTORY = timedelta(days=365)
+
+# Time after which records are assumed to have reached the API
+DEFAULT_SETTLING_PERIOD = timedelta(days=3)
+
+# Label counted by each count_*_events feature, and the account type an institution
+# must hold for its alerts to be counted, if any
+LABEL_COUNT_FEATURES: Dict[str, Tuple[str, Optional[str]]] = {
+    "count_betting_and_lottery_events": ("BettingAndLottery", "depository"),
+    "count_insufficient_funds_events": ("InsufficientFunds", "depository"),
+    "count_loan_declined_events": ("LoanDeclined", "loan"),
+    "count_loan_defaulted_events": ("LoanDefaulted", "loan"),
+    "count_loan_repaid_events": ("LoanRepaid", None),
+    "count_loan_repayment_events": ("LoanRepayment", None),
+    "count_missed_payment_events": ("LoanMissedPayment", None),
+    "count_overdraft_events": ("Overdraft", None),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup_coverage (
+    user_uuid TEXT PRIMARY KEY, first_day INTEGER, end_day INTEGER,
+    settled_end_day INTEGER
+);
+CREATE TABLE IF NOT EXISTS rollup_institutions (
+    user_uuid TEXT, institution_id TEXT, account_types TEXT
+);
+CREATE TABLE IF NOT EXISTS transaction_rollups (
+    user_uuid TEXT, day INTEGER, institution_id TEXT, account_id TEXT,
+    account_type TEXT, impact TEXT, count INTEGER, amount_count INTEGER,
+    amount_sum REAL
+);
+CREATE TABLE IF NOT EXISTS balance_rollups (
+    user_uuid TEXT, day INTEGER, institution_id TEXT, account_id TEXT,
+    account_type TEXT, timestamp TEXT, balance REAL
+);
+CREATE TABLE IF NOT EXISTS alert_rollups (
+    user_uuid TEXT, day INTEGER, institution_id TEXT, label TEXT, count INTEGER
+);
+CREATE INDEX IF NOT EXISTS rollup_institutions_user
+    ON rollup_institutions (user_uuid);
+CREATE INDEX IF NOT EXISTS transaction_rollups_user_day
+    ON transaction_rollups (user_uuid, day);
+CREATE INDEX IF NOT EXISTS balance_rollups_user_day
+    ON balance_rollups (user_uuid, day);
+CREATE INDEX IF NOT EXISTS alert_rollups_user_day ON alert_rollups (user_uuid, day);
+"""
+
+Record = Dict[str, Any]
+
+
+class RollupUnavailable(Exception):
+    """Raised when a feature cannot be computed from the rollups of a time window."""
+
+
+def _day(timestamp: float) -> int:
+    return int(timestamp // SECONDS_PER_DAY)
+
+
+def _day_of(value: datetime) -> int:
+    """Day number of a datetime that must be a midnight UTC."""
+    timestamp = to_timestamp(value)
+    if timestamp % SECONDS_PER_DAY:
+        raise RollupUnavailable(f"{value} is not a midnight UTC")
+    return _day(timestamp)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _midnight(day: int) -> datetime:
+    return datetime.fromtimestamp(day * SECONDS_PER_DAY, timezone.utc).replace(
+        tzinfo=None
+    )
+
+
+class RollupStore:
+    """Daily rollups of users' records in SQLite.
+
+    Args:
+        path: SQLite database file; in memory if not given
+        settling_period: time after which records are assumed to have reached the API
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        settling_period: timedelta = DEFAULT_SETTLING_PERIOD,
+    ):
+        self.settling_period = settling_period
+        self._db = sqlite3.connect(path or ":memory:")
+        self._db.executescript(_SCHEMA)
+        columns = {
+            row[1] for row in self._db.execute("PRAGMA table_info(rollup_coverage)")
+        }
+        if "settled_end_day" not in columns:
+            # Stores written before days could be unsettled
+            with self._db:
+                self._db.execute(
+                    "ALTER TABLE rollup_coverage ADD COLUMN settled_end_day INTEGER"
+                )
+
+    def coverage(self, user_uuid: str) -> Optional[Tuple[datetime, datetime]]:
+        """First and end (excluded) midnights of the days rolled up for a user."""
+        row = self._db.execute(
+            "SELECT first_day, end_day FROM rollup_coverage WHERE user_uuid = ?",
+            (user_uuid,),
+        ).fetchone()
+        return None if row is None else (_midnight(row[0]), _midnight(row[1]))
+
+    async def update(
+        self,
+        api_client: Any,
+        user_uuid: str,
+        utc_starttime: Optional[datetime] = None,
+        utc_endtime: Optional[datetime] = None,
+    ) -> int:
+        """Roll up the whole days between two times that aren't rolled up yet.
+
+        Days already rolled up that hadn't settled then are rolled up again.
+
+        Args:
+            api_client: Pngme Async API client
+            user_uuid: the Pngme user_uuid for the mobile phone user
+            utc_starttime: the first day to roll up; by default the first day already
+                rolled up, or DEFAULT_HISTORY before ``utc_endtime`` for a new user
+            utc_endtime: days before this one are rolled up; by default now
+
+        Returns:
+            the number of days rolled up
+        """
+        now = _now()
+        if utc_endtime is None:
+            utc_endtime = now
+        end_day = _day(to_timestamp(utc_endtime))
+
+        row = self._db.execute(
+            "SELECT first_day, end_day, COALESCE(settled_end_day, end_day) "
+            "FROM rollup_coverage WHERE user_uuid = ?",
+            (user_uuid,),
+        ).fetchone()
+        if utc_starttime is None:
+            first_day = (
+                row[0] if row else _day(to_timestamp(utc_endtime - DEFAULT_HISTORY))
+            )
+        else:
+            first_day = _day(to_timestamp(utc_starttime))
+
+        # Keep the rolled up days contiguous: fetch what's missing before and after,
+        # along with the days that hadn't settled when they were rolled up
+        if row is None:
+            ranges = [(first_day, end_day)]
+        else:
+            ranges = [(first_day, row[0]), (max(row[0], row[2]), max(end_day, row[1]))]
+            first_day = min(first_day, row[0])
+            end_day = max(end_day, row[1])
+        ranges = [(start, end) for start, end in ranges if start < end]
+        if not ranges:
+            return 0
+        # Days ending at least settling_period ago
+        settled_end_day = min(end_day, _day(to_timestamp(now - self.settling_period)))
+
+        institutions = await api_client.institutions.get(user_uuid=user_uuid)
+        rollups = [
+            await self._fetch_rollups(api_client, user_uuid, institutions, start, end)
+            for start, end in ranges
+        ]
+
+        with self._db:
+            self._db.execute(
+                "DELETE FROM rollup_institutions WHERE user_uuid = ?", (user_uuid,)
+            )
+            self._db.executemany(
+                "INSERT INTO rollup_institutions VALUES (?, ?, ?)",
+                [
+                    (
+                        user_uuid,
+                        institution["institution_id"],
+                        json.dumps(institution["account_types"]),
+                    )
+                    for institution in institutions
+                ],
+            )
+            for (start, end), rows_by_table in zip(ranges, rollups):
+                for table, rows in rows_by_table.items():
+                    self._db.execute(
+                        f"DELETE FROM {table} WHERE user_uuid = ? AND day >= ? "
+                        "AND day < ?",
+                        (user_uuid, start, end),
+                    )
+                    if rows:
+                        placeholders = ", ".join("?" * len(rows[0]))
+                        self._db.executemany(
+                            f"INSERT INTO {table} VALUES ({placeholders})", rows
+                        )
+            self._db.execute(
+                "INSERT OR REPLACE INTO rollup_coverage VALUES (?, ?, ?, ?)",
+                (user_uuid, first_day, end_day, settled_end_day),
+            )
+        return sum(end - start for start, end in ranges)
+
+    async def _fetch_rollups(
+        self,
+        api_client: Any,
+        user_uuid: str,
+        institutions: List[Record],
+        first_day: int,
+        end_day: int,
+    ) -> Dict[str, List[Tuple[Any, ...]]]:
+        utc_starttime = _midnight(first_day)
+        utc_endtime = _midnight(end_day)
+        transactions: Dict[Tuple[Any, ...], List[Any]] = defaultdict(
+            lambda: [0, 0, 0.0]
+        )
+        balances: Dict[Tuple[Any, ...], Tuple[float, str, Optional[float]]] = {}
+        alerts: Dict[Tuple[Any, ...], int] = defaultdict(int)
+
+        calls = [
+            getattr(api_client, resource).get(
+                user_uuid=user_uuid,
+                institution_id=institution["institution_id"],
+                utc_starttime=utc_starttime,
+                utc_endtime=utc_endtime,
+            )
+            for institution in institutions
+            for resource in ("transactions", "balances", "alerts")
+        ]
+        responses = iter(await asyncio.gather(*calls))
+
+        for institution in institutions:
+            institution_id = institution["institution_id"]
+            for record in next(responses):
+                day = _day(parse_timestamp(record["timestamp"]))
+                if day >= end_day:
+                    continue
+                key = (
+                    user_uuid,
+                    day,
+                    institution_id,
+                    record["account_id"],
+                    record["account_type"],
+                    record["impact"],
+                )
+                rollup = transactions[key]
+                rollup[0] += 1
+                if record["amount"] is not None:
+                    rollup[1] += 1
+                    rollup[2] += record["amount"]
+
+            for record in next(responses):
+                timestamp = parse_timestamp(record["timestamp"])
+                day = _day(timestamp)
+                if day >= end_day:
+                    continue
+                account = (
+                    user_uuid,
+                    day,
+                    institution_id,
+                    record["account_id"],
+                    record["account_type"],
+                )
+                # Keep the last balance of the day
+                if account not in balances or timestamp >= balances[account][0]:
+                    balances[account] = (
+                        timestamp,
+                        record["timestamp"],
+                        record["balance"],
+                    )
+
+            for record in next(responses):
+                day = _day(parse_timestamp(record["timestamp"]))
+                if day >= end_day:
+                    continue
+                for label in set(record["labels"]):
+                    alerts[(user_uuid, day, institution_id, label)] += 1
+
+        return {
+            "transaction_rollups": [key + tuple(v) for key, v in transactions.items()],
+            "balance_rollups": [key + v[1:] for key, v in balances.items()],
+            "alert_rollups": [key + (count,) for key, count in alerts.items()],
+        }
+
+    def _window(
+        self, user_uuid: str, utc_starttime: datetime, utc_endtime: datetime
+    ) -> Tuple[int, int]:
+        first_day = _day_of(utc_starttime)
+        end_day = _day_of(utc_endtime)
+        row = self._db.execute(
+            "SELECT first_day, end_day FROM rollup_coverage WHERE user_uuid = ?",
+            (user_uuid,),
+        ).fetchone()
+        if row is None or first_day < row[0] or end_day > row[1]:
+            raise RollupUnavailable(
+                f"Days from {utc_starttime} to {utc_endtime} are not rolled up for "
+                f"{user_uuid}"
+            )
+        return first_day, end_day
+
+    def _institutions_with(self, user_uuid: str, account_type: str) -> List[str]:
+        return [
+            institution_id
+            for institution_id, account_types in self._db.execute(
+                "SELECT institution_id, account_types FROM rollup_institutions "
+                "WHERE user_uuid = ?",
+                (user_uuid,),
+            )
+            if account_type in json.loads(account_types)
+        ]
+
+    def _depository_transactions(
+        self, user_uuid: str, utc_starttime: datetime, utc_endtime: datetime
+    ) -> List[Tuple[int, str, int, int, float]]:
+        """(day, impact, count, amount count, amount sum) of depository transactions."""
+        first_day, end_day = self._window(user_uuid, utc_starttime, utc_endtime)
+        institution_ids = set(self._institutions_with(user_uuid, "depository"))
+        return [
+            row[1:]
+            for row in self._db.execute(
+                "SELECT institution_id, day, impact, count, amount_count, amount_sum "
+                "FROM transaction_rollups WHERE user_uuid = ? AND day >= ? "
+                "AND day < ? AND account_type = 'depository' ORDER BY day",
+                (user_uuid, first_day, end_day),
+            )
+            if row[0] in institution_ids
+        ]
+
+    def sum_of_transactions(
+        self,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        impact: str,
+    ) -> Optional[float]:
+        """As sum_of_credits (impact CREDIT) and sum_of_debits (impact DEBIT)."""
+        total = 0.0
+        count = 0
+        for _, row_impact, _, amount_count, amount_sum in self._depository_transactions(
+            user_uuid, utc_starttime, utc_endtime
+        ):
+            if row_impact == impact:
+                total += amount_sum
+                count += amount_count
+        return total if count else None
+
+    def net_cash_flow(
+        self, user_uuid: str, utc_starttime: datetime, utc_endtime: datetime
+    ) -> Optional[float]:
+        cash_in = 0.0
+        cash_out = 0.0
+        count = 0
+        for _, impact, row_count, _, amount_sum in self._depository_transactions(
+            user_uuid, utc_starttime, utc_endtime
+        ):
+            if impact == "CREDIT":
+                cash_in += amount_sum
+                count += row_count
+            elif impact == "DEBIT":
+                cash_out += amount_sum
+                count += row_count
+        return cash_in - cash_out if count else None
+
+    def count_transactions_depository(
+        self, user_uuid: str, utc_starttime: datetime, utc_endtime: datetime
+    ) -> int:
+        return sum(
+            row_count
+            for _, impact, row_count, _, _ in self._depository_transactions(
+                user_uuid, utc_starttime, utc_endtime
+            )
+            if impact in ("CREDIT", "DEBIT")
+        )
+
+    def standard_deviation_of_week_to_week_sum_of_credits(
+        self, user_uuid: str, utc_starttime: datetime, utc_endtime: datetime
+    ) -> Optional[float]:
+        # Each day's credits are bucketed at noon, inside the same week as each of
+        # the day's transactions
+        credits = [
+            (_midnight(day) + timedelta(hours=12), amount_sum)
+            for day, impact, _, amount_count, amount_sum in self._depository_transactions(
+                user_uuid, utc_starttime, utc_endtime
+            )
+            if impact == "CREDIT" and amount_count
+        ]
+        if not credits:
+            return None
+        return WeeklyBuckets.from_records(credits, utc_starttime, utc_endtime).std()
+
+    def count_label_events(
+        self,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        label: str,
+        account_type: Optional[str] = None,
+    ) -> int:
+        """As the count_*_events features: the number of alerts with a label.
+
+        Only alerts from institutions holding ``account_type`` accounts are counted,
+        if given.
+        """
+        first_day, end_day = self._window(user_uuid, utc_starttime, utc_endtime)
+        institution_ids = (
+            None
+            if account_type is None
+            else set(self._institutions_with(user_uuid, account_type))
+        )
+        return sum(
+            count
+            for institution_id, count in self._db.execute(
+                "SELECT institution_id, count FROM alert_rollups WHERE user_uuid = ? "
+                "AND day >= ? AND day < ? AND label = ?",
+                (user_uuid, first_day, end_day, label),
+            )
+            if institution_ids is None or institution_id in institution_ids
+        )
+
+    def daily_total_balances(
+        self,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        account_type: str,
+    ) -> Optional[List[float]]:
+        """As pngme_feature_library.end_of_day.daily_total_balances, from rollups.
+
+        Balances and active days are taken from the institutions holding
+        ``account_type`` accounts for depository accounts, and from every institution
+        for loan accounts, as the end-of-day balance features do.
+        """
+        first_day, end_day = self._window(
+            user_uuid,
+            utc_starttime - timedelta(days=BALANCE_VALID_FOR_DAYS),
+            utc_endtime,
+        )
+        if account_type == "loan":
+            institution_ids = None
+        else:
+            institution_ids = set(self._institutions_with(user_uuid, account_type))
+
+        balances = [
+            {
+                "institution_id": institution_id,
+                "account_id": account_id,
+                "timestamp": timestamp,
+                "balance": balance,
+            }
+            for institution_id, account_id, timestamp, balance in self._db.execute(
+                "SELECT institution_id, account_id, timestamp, balance "
+                "FROM balance_rollups WHERE user_uuid = ? AND day >= ? AND day < ? "
+                "AND account_type = ?",
+                (user_uuid, first_day, end_day, account_type),
+            )
+            if institution_ids is None or institution_id in institution_ids
+        ]
+        if not balances:
+            return None
+
+        # One transaction per active day is enough to mark it active
+        transaction_days = [
+            {"timestamp": _midnight(day).replace(tzinfo=timezone.utc).isoformat()}
+            for institution_id, day in self._db.execute(
+                "SELECT DISTINCT institution_id, day FROM transaction_rollups "
+                "WHERE user_uuid = ? AND day >= ? AND day < ?",
+                (user_uuid, _day_of(utc_starttime), end_day),
+            )
+            if institution_ids is None or institution_id in institution_ids
+        ]
+        return daily_total_balances(
+            balances,
+            transaction_days,
+            utc_starttime,
+            utc_endtime,
+            BALANCE_VALID_FOR_DAYS,
+        )
+
+    def average_end_of_day_depository_balance(
+        self, user_uuid: str, utc_starttime: datetime, utc_endtime: datetime
+    ) -> Optional[float]:
+        totals = self.daily_total_balances(
+            user_uuid, utc_starttime, utc_endtime, "depository"
+        )
+        return None if totals is None else mean(totals)
+
+    def median_end_of_day_depository_balance(
+        self, user_uuid: str, utc_starttime: datetime, utc_endtime: datetime
+    ) -> Optional[float]:
+        totals = self.daily_total_balances(
+            user_uuid, utc_starttime, utc_endtime, "depository"
+        )
+        return None if totals is None else median(totals)
+
+    def average_end_of_day_loan_balance(
+        self, user_uuid: str, utc_starttime: datetime, utc_endtime: datetime
+    ) -> Optional[float]:
+        first_day, end_day = self._window(
+            user_uuid,
+            utc_starttime - timedelta(days=BALANCE_VALID_FOR_DAYS),
+            utc_endtime,
+        )
+        (has_balances,) = self._db.execute(
+            "SELECT EXISTS (SELECT 1 FROM balance_rollups WHERE user_uuid = ? "
+            "AND day >= ? AND day < ?)",
+            (user_uuid, first_day, end_day),
+        ).fetchone()
+        if not has_balances:
+            return None
+
+        totals = self.daily_total_balances(
+            user_uuid, utc_starttime, utc_endtime, "loan"
+        )
+        # Users with balances but no loan accounts have no loan balance
+        return 0.0 if totals is None else mean(totals)
+
+    def compute(
+        self,
+        name: str,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+    ) -> Any:
+        """Compute a feature from rollups.
+
+        Raises:
+            KeyError: if the feature cannot be computed from rollups
+            RollupUnavailable: if the window isn't whole days that are rolled up
+        """
+        return ROLLUP_FEATURES[name](self, user_uuid, utc_starttime, utc_endtime)
+
+    def close(self) -> None:
+        self._db.close()
+
+
+RollupFeature = Callable[[RollupStore, str, datetime, datetime], Any]
+
+
+def _sum_feature(impact: str) -> RollupFeature:
+    def sum_of_transactions(
+        store: RollupStore,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+    ) -> Optional[float]:
+        return store.sum_of_transactions(user_uuid, utc_starttime, utc_endtime, impact)
+
+    return sum_of_transactions
+
+
+def _label_count_feature(label: str, account_type: Optional[str]) -> RollupFeature:
+    def count_label_events(
+        store: RollupStore,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+    ) -> int:
+        return store.count_label_events(
+            user_uuid, utc_starttime, utc_endtime, label, account_type
+        )
+
+    return count_label_events
+
+
+# Features computed from rollups, by name
+ROLLUP_FEATURES: Dict[str, RollupFeature] = {
+    "average_end_of_day_depository_balance": (
+        RollupStore.average_end_of_day_depository_balance
+    ),
+    "average_end_of_day_loan_balance": RollupStore.average_end_of_day_loan_balance,
+    "count_transactions_depository": RollupStore.count_transactions_depository,
+    "median_end_of_day_depository_balance": (
+        RollupStore.median_end_of_day_depository_balance
+    ),
+    "net_cash_flow": RollupStore.net_cash_flow,
+    "standard_deviation_of_week_to_week_sum_of_credits": (
+        RollupStore.standard_deviation_of_week_to_week_sum_of_credits
+    ),
+    "sum_of_credits": _sum_feature("CREDIT"),
+    "sum_of_debits": _sum_feature("DEBIT"),
+    **{
+        name: _label_count_feature(label, account_type)
+        for name, (label, account_type) in LABEL_COUNT_FEATURES.items()
+    },
+}
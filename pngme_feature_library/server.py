@@ -0,0 +1,662 @@
+"""Long-running HTTP service computing features with warm caches.
+
+Running ``python main.py`` per feature pays for interpreter start-up, imports and new
+API connections every time. The feature server keeps one client, its connections and
+its caches alive across requests:
+
+    PNGME_TOKEN=... python -m pngme_feature_library.server --port 8080
+
+    GET /users/{user_uuid}/features?names=sum_of_credits,net_cash_flow
+        &start=2021-09-01T00:00:00&end=2021-10-01T00:00:00
+    DELETE /users/{user_uuid}/institutions    (forget the user's cached institutions)
+    POST /users/{user_uuid}/prefetch?names=...&start=...&end=...
+    DELETE /users/{user_uuid}/prefetch        (release the user's prefetched records)
+    GET /pool                                 (connections of the shared pool per host)
+    GET /metrics
+
+``start`` and ``end`` are ISO 8601 UTC times; ``end`` defaults to now and ``start`` to
+30 days before ``end``. ``names`` defaults to every feature.
+
+With ``budget_ms`` (or ``--budget-ms``), features are computed within that latency
+budget, see pngme_feature_library.deadline: the response holds what was ready in
+time, ``completeness`` tells how many institutions each feature was computed from and
+``missing`` lists the features given up. Such requests bypass the result cache.
+
+With ``mode=stale-while-revalidate`` (or ``--stale-while-revalidate``), values computed
+earlier are served while they're fresh enough, see pngme_feature_library.stale:
+values older than their feature's soft TTL are refreshed in the background and those
+older than its hard TTL are computed again before responding. ``staleness`` tells the
+age of each value, in seconds, and whether it was fresh, stale or computed. Requests
+without ``end`` share the values of their rolling window whatever their exact time.
+Such requests bypass the result cache and any latency budget; ``mode=fresh`` turns
+the mode off for a request.
+
+With ``--fixed-point-amounts DECIMALS``, features sum amounts exactly as integers of
+minor units, see pngme_feature_library.fixed_point.
+
+``POST .../prefetch`` starts fetching the records of the given features in the
+background, see pngme_feature_library.prefetch; feature requests for the same
+``start`` and ``end`` then wait on those fetches instead of repeating them. ``end`` is
+required: a window ending now would end at a different time for every request.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from ._http import Request, Response, start_http_server
+from .cache import CachingClient
+from .client import PersistentSessionClient, find_layer
+from .composite import ScoringSession
+from .deadline import DeadlineClient, compute_within_budget
+from .hedging import HedgePolicy
+from .institutions import InstitutionCache, InstitutionCachingClient
+from .metrics import (
+    InstrumentedClient,
+    handle_metrics_request,
+    instrument_feature,
+    monitor_event_loop_lag,
+)
+from .pagination import PaginatedClient
+from .pool import shared_pool
+from .prefetch import PrefetchingClient
+from .registry import FeatureFunction, feature_names, load_feature
+from .records import fixed_point_amounts
+from .results import (
+    DEFAULT_RESULT_TTL,
+    MISSING,
+    UNVERSIONED_FEATURES,
+    DataVersion,
+    FeatureResultCache,
+    probe_data_version,
+)
+from .retry import RetryPolicy
+from .singleflight import SingleFlight, SingleFlightClient
+from .stale import DEFAULT_FEATURE_TTL, FeatureTTL, StaleWhileRevalidate
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = timedelta(days=30)
+
+
+class BadRequest(Exception):
+    """Raised when query parameters cannot be interpreted."""
+
+
+def _parse_utc_datetime(value: str) -> datetime:
+    """Parse an ISO 8601 time to a naive UTC datetime, as the features in lib/ expect."""
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise BadRequest(f"Invalid datetime: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _json_response(status: int, payload: Dict[str, Any]) -> Response:
+    return Response(status, json.dumps(payload).encode())
+
+
+class FeatureServer:
+    """Compute features for users, sharing one client and coalescing identical work.
+
+    Concurrent requests asking for the same feature for the same user and time window
+    share a single computation. With a result cache, the version of the user's data is
+    probed once per request and features already computed on the same data aren't
+    computed again.
+
+    Args:
+        stale_while_revalidate: serve requests in stale-while-revalidate mode unless
+            they ask otherwise
+        feature_ttls: TTLs of the values served in stale-while-revalidate mode, by
+            feature name
+        default_ttl: TTLs of the other features' values
+        amount_decimals: sum amounts as integers of minor units with these decimal
+            places, see pngme_feature_library.fixed_point; as floats if None
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        institution_cache: Optional[InstitutionCache] = None,
+        result_cache: Optional[FeatureResultCache] = None,
+        budget: Optional[float] = None,
+        stale_while_revalidate: bool = False,
+        feature_ttls: Optional[Dict[str, FeatureTTL]] = None,
+        default_ttl: FeatureTTL = DEFAULT_FEATURE_TTL,
+        amount_decimals: Optional[int] = None,
+    ):
+        self.client = client
+        self.budget = budget
+        self.amount_decimals = amount_decimals
+        self.institution_cache = institution_cache
+        self.result_cache = result_cache
+        self.prefetcher = find_layer(client, PrefetchingClient)
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale = StaleWhileRevalidate(
+            self._compute_latest, feature_ttls, default_ttl
+        )
+        self._features: Dict[str, FeatureFunction] = {}
+        self._in_flight: SingleFlight[Any] = SingleFlight("features")
+
+    def _feature(self, name: str) -> FeatureFunction:
+        if name not in self._features:
+            self._features[name] = instrument_feature(load_feature(name), name=name)
+        return self._features[name]
+
+    async def _compute_feature(
+        self,
+        name: str,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+    ) -> Any:
+        return await self._in_flight.do(
+            (name, user_uuid, utc_starttime, utc_endtime),
+            lambda: self._feature(name)(
+                self.client, user_uuid, utc_starttime, utc_endtime
+            ),
+        )
+
+    async def _cached_feature(
+        self,
+        name: str,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        version: Optional[DataVersion],
+    ) -> Any:
+        if self.result_cache is None or version is None or name in UNVERSIONED_FEATURES:
+            return await self._compute_feature(
+                name, user_uuid, utc_starttime, utc_endtime
+            )
+
+        key = (name, user_uuid, utc_starttime, utc_endtime, version)
+        value = self.result_cache.get(*key)
+        if value is MISSING:
+            value = await self._compute_feature(
+                name, user_uuid, utc_starttime, utc_endtime
+            )
+            self.result_cache.set(*key, value)
+        return value
+
+    async def _compute_latest(
+        self,
+        name: str,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+    ) -> Any:
+        session = ScoringSession(
+            self.client,
+            user_uuid,
+            utc_starttime,
+            utc_endtime,
+            compute_primitive=lambda primitive: self._compute_feature(
+                primitive, user_uuid, utc_starttime, utc_endtime
+            ),
+        )
+        return await session.get(name)
+
+    async def compute_stale(
+        self,
+        user_uuid: str,
+        names: List[str],
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        window: Optional[Hashable] = None,
+    ) -> Tuple[Dict[str, Any], Dict[str, str], Dict[str, Dict[str, Any]]]:
+        """Serve features for one user in stale-while-revalidate mode.
+
+        Returns:
+            feature values by name, error messages by name for features that failed,
+            and the staleness of each value by name
+        """
+        results = await asyncio.gather(
+            *[
+                self.stale.get(name, user_uuid, utc_starttime, utc_endtime, window)
+                for name in names
+            ],
+            return_exceptions=True,
+        )
+
+        values: Dict[str, Any] = {}
+        errors: Dict[str, str] = {}
+        staleness: Dict[str, Dict[str, Any]] = {}
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                logger.error("Computing %s failed: %r", name, result)
+                errors[name] = repr(result)
+            else:
+                values[name], served = result
+                staleness[name] = {
+                    "age_seconds": round(served.age, 3),
+                    "state": served.state,
+                }
+        return values, errors, staleness
+
+    async def compute(
+        self,
+        user_uuid: str,
+        names: List[str],
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        cacheable: bool = True,
+    ) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """Compute features for one user.
+
+        Args:
+            cacheable: whether the time window may be asked for again, so that values
+                are worth caching; windows ending now never are
+
+        Returns:
+            feature values by name, and error messages by name for features that failed
+        """
+        version = None
+        if self.result_cache is not None and cacheable:
+            try:
+                version = await probe_data_version(
+                    self.client, user_uuid, utc_starttime, utc_endtime
+                )
+            except Exception as e:
+                logger.warning("Probing data version of %s failed: %r", user_uuid, e)
+
+        # Composite features share the primitives they depend on with each other and
+        # with the features requested
+        session = ScoringSession(
+            self.client,
+            user_uuid,
+            utc_starttime,
+            utc_endtime,
+            compute_primitive=lambda name: self._cached_feature(
+                name, user_uuid, utc_starttime, utc_endtime, version
+            ),
+        )
+        results = await asyncio.gather(
+            *[session.get(name) for name in names], return_exceptions=True
+        )
+
+        values: Dict[str, Any] = {}
+        errors: Dict[str, str] = {}
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                logger.error("Computing %s failed: %r", name, result)
+                errors[name] = repr(result)
+            else:
+                values[name] = result
+        return values, errors
+
+    async def handle(self, request: Request) -> Response:
+        with fixed_point_amounts(self.amount_decimals):
+            return await self._handle(request)
+
+    async def _handle(self, request: Request) -> Response:
+        if request.path == "/metrics":
+            return await handle_metrics_request(request)
+        if request.path == "/pool":
+            return _json_response(200, shared_pool().stats())
+
+        parts = request.path.strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "users" and parts[2] == "institutions":
+            if request.method != "DELETE" or self.institution_cache is None:
+                return _json_response(405, {"error": "method not allowed"})
+            self.institution_cache.invalidate(parts[1])
+            return _json_response(200, {"user_uuid": parts[1], "invalidated": True})
+        if len(parts) == 3 and parts[0] == "users" and parts[2] == "prefetch":
+            return self._handle_prefetch(request, parts[1])
+
+        if len(parts) != 3 or parts[0] != "users" or parts[2] != "features":
+            return _json_response(404, {"error": "not found"})
+        if request.method != "GET":
+            return _json_response(405, {"error": "method not allowed"})
+
+        try:
+            names, utc_starttime, utc_endtime = self._parse_query(request.query)
+            budget = self._parse_budget(request.query)
+            stale = self._parse_mode(request.query)
+        except BadRequest as e:
+            return _json_response(400, {"error": str(e)})
+
+        completeness: Dict[str, Any] = {}
+        if stale:
+            window: Optional[Hashable] = None
+            if "end" not in request.query:
+                # A rolling window ending now: later requests may share its values
+                window = (
+                    "rolling",
+                    utc_starttime if "start" in request.query else DEFAULT_WINDOW,
+                )
+            values, errors, staleness = await self.compute_stale(
+                parts[1], names, utc_starttime, utc_endtime, window
+            )
+            completeness["staleness"] = staleness
+        elif budget is None:
+            # Without an explicit end, the window ends now and is never asked for
+            # again: probing the data version would only add calls and fill the
+            # result cache with entries that can't be hit
+            values, errors = await self.compute(
+                parts[1],
+                names,
+                utc_starttime,
+                utc_endtime,
+                cacheable="end" in request.query,
+            )
+        else:
+            results = await compute_within_budget(
+                self.client,
+                parts[1],
+                utc_starttime,
+                utc_endtime,
+                names,
+                budget,
+                feature=self._feature,
+                in_flight=self._in_flight,
+            )
+            values = {name: result.value for name, result in results.items()}
+            errors = {
+                name: result.error
+                for name, result in results.items()
+                if result.error is not None
+            }
+            completeness["completeness"] = {
+                name: result.completeness
+                for name, result in results.items()
+                if not result.missing
+            }
+            completeness["missing"] = [
+                name for name, result in results.items() if result.missing
+            ]
+
+        payload: Dict[str, Any] = {
+            "user_uuid": parts[1],
+            "utc_starttime": utc_starttime.isoformat(),
+            "utc_endtime": utc_endtime.isoformat(),
+            "features": values,
+            **completeness,
+        }
+        if errors:
+            payload["errors"] = errors
+        return _json_response(200 if values or not errors else 502, payload)
+
+    def _handle_prefetch(self, request: Request, user_uuid: str) -> Response:
+        if self.prefetcher is None or request.method not in ("POST", "DELETE"):
+            return _json_response(405, {"error": "method not allowed"})
+        if request.method == "DELETE":
+            session = self.prefetcher.sessions.get(user_uuid)
+            if session is not None:
+                session.close()
+            return _json_response(
+                200, {"user_uuid": user_uuid, "released": session is not None}
+            )
+
+        try:
+            if "end" not in request.query:
+                # A window ending now would end later for every feature request, whose
+                # calls would never match the prefetched ones
+                raise BadRequest("end is required to prefetch")
+            names, utc_starttime, utc_endtime = self._parse_query(request.query)
+        except BadRequest as e:
+            return _json_response(400, {"error": str(e)})
+        self.prefetcher.prefetch(user_uuid, names, utc_starttime, utc_endtime)
+        return _json_response(
+            202,
+            {
+                "user_uuid": user_uuid,
+                "utc_starttime": utc_starttime.isoformat(),
+                "utc_endtime": utc_endtime.isoformat(),
+                "prefetching": names,
+            },
+        )
+
+    def _parse_query(
+        self, query: Dict[str, List[str]]
+    ) -> Tuple[List[str], datetime, datetime]:
+        names = [
+            name
+            for value in query.get("names", [])
+            for name in value.split(",")
+            if name
+        ] or feature_names()
+        unknown = sorted(set(names) - set(feature_names()))
+        if unknown:
+            raise BadRequest(f"Unknown features: {', '.join(unknown)}")
+
+        if "end" in query:
+            utc_endtime = _parse_utc_datetime(query["end"][0])
+        else:
+            utc_endtime = datetime.now(timezone.utc).replace(tzinfo=None)
+        if "start" in query:
+            utc_starttime = _parse_utc_datetime(query["start"][0])
+        else:
+            utc_starttime = utc_endtime - DEFAULT_WINDOW
+        if utc_starttime > utc_endtime:
+            raise BadRequest("start must not be after end")
+
+        # Deduplicate while keeping the requested order
+        return list(dict.fromkeys(names)), utc_starttime, utc_endtime
+
+    def _parse_budget(self, query: Dict[str, List[str]]) -> Optional[float]:
+        if "budget_ms" not in query:
+            return self.budget
+        try:
+            budget_ms = float(query["budget_ms"][0])
+        except ValueError:
+            raise BadRequest(f"Invalid budget_ms: {query['budget_ms'][0]}")
+        if budget_ms <= 0:
+            raise BadRequest("budget_ms must be positive")
+        return budget_ms / 1000
+
+    def _parse_mode(self, query: Dict[str, List[str]]) -> bool:
+        """Whether to serve the request in stale-while-revalidate mode."""
+        if "mode" not in query:
+            return self.stale_while_revalidate
+        mode = query["mode"][0]
+        if mode not in ("fresh", "stale-while-revalidate"):
+            raise BadRequest(f"Invalid mode: {mode}")
+        return mode == "stale-while-revalidate"
+
+    async def serve(
+        self, host: str = "127.0.0.1", port: int = 8080
+    ) -> asyncio.AbstractServer:
+        return await start_http_server(self.handle, host, port)
+
+
+def build_client(
+    access_token: str,
+    concurrency_limit: int = 50,
+    institution_cache: Optional[InstitutionCache] = None,
+    hedge: bool = False,
+) -> Any:
+    """Client stack used by the feature server.
+
+    From the outside in: deadlines of requests with a latency budget, prefetch
+    sessions, record caches, the institution cache, coalescing of identical in-flight
+    calls, metrics on the calls that actually reach the API, adaptive concurrent
+    pagination retrying failed pages and optionally hedging slow ones, and a session
+    on the shared connection pool.
+    """
+    client = InstrumentedClient(
+        PaginatedClient(
+            PersistentSessionClient(access_token, concurrency_limit),
+            RetryPolicy(),
+            HedgePolicy() if hedge else None,
+        )
+    )
+    return DeadlineClient(
+        PrefetchingClient(
+            CachingClient(
+                InstitutionCachingClient(SingleFlightClient(client), institution_cache)
+            )
+        )
+    )
+
+
+async def run(
+    access_token: str,
+    host: str,
+    port: int,
+    concurrency_limit: int = 50,
+    preload: Optional[List[str]] = None,
+    institution_cache_path: Optional[str] = None,
+    result_cache_size: int = 100_000,
+    result_cache_ttl: Optional[float] = DEFAULT_RESULT_TTL,
+    budget: Optional[float] = None,
+    hedge: bool = False,
+    stale_while_revalidate: bool = False,
+    feature_ttls: Optional[Dict[str, FeatureTTL]] = None,
+    default_ttl: FeatureTTL = DEFAULT_FEATURE_TTL,
+    amount_decimals: Optional[int] = None,
+) -> None:
+    institution_cache = InstitutionCache(path=institution_cache_path)
+    server = FeatureServer(
+        build_client(access_token, concurrency_limit, institution_cache, hedge),
+        institution_cache,
+        (
+            FeatureResultCache(result_cache_size, ttl=result_cache_ttl)
+            if result_cache_size > 0
+            else None
+        ),
+        budget,
+        stale_while_revalidate,
+        feature_ttls,
+        default_ttl,
+        amount_decimals,
+    )
+    # Import feature modules up front so the first requests don't pay for it
+    for name in preload or []:
+        server._feature(name)
+
+    lag_monitor = asyncio.ensure_future(monitor_event_loop_lag())
+    http_server = await server.serve(host, port)
+    logger.info("Serving features on http://%s:%d", host, port)
+    try:
+        await http_server.serve_forever()
+    finally:
+        lag_monitor.cancel()
+        await server.client.aclose()
+        await shared_pool().aclose()
+        institution_cache.close()
+
+
+def _parse_ttl(value: str) -> FeatureTTL:
+    """Parse ``soft:hard`` seconds."""
+    try:
+        soft, hard = (float(seconds) for seconds in value.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected soft:hard seconds, got {value}")
+    if not 0 <= soft <= hard:
+        raise argparse.ArgumentTypeError("TTLs must satisfy 0 <= soft <= hard")
+    return FeatureTTL(soft, hard)
+
+
+def _parse_feature_ttl(value: str) -> Tuple[str, FeatureTTL]:
+    """Parse ``name=soft:hard``."""
+    name, _, ttl = value.partition("=")
+    if not name or not ttl:
+        raise argparse.ArgumentTypeError(f"expected name=soft:hard, got {value}")
+    return name, _parse_ttl(ttl)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--concurrency-limit", type=int, default=50)
+    parser.add_argument(
+        "--preload",
+        default=",".join(feature_names()),
+        help="comma-separated features to import at start-up",
+    )
+    parser.add_argument(
+        "--institution-cache-path",
+        help="SQLite file persisting cached institutions across restarts",
+    )
+    parser.add_argument(
+        "--result-cache-size",
+        type=int,
+        default=100_000,
+        help="feature values cached by data version; 0 disables the cache",
+    )
+    parser.add_argument(
+        "--result-cache-ttl",
+        type=float,
+        default=DEFAULT_RESULT_TTL,
+        help="seconds feature values are cached for, bounding how long records "
+        "ingested late for older times go unnoticed (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        help="default latency budget of a request, returning partial results",
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="duplicate alerts, balances and transactions pages slower than their p95",
+    )
+    parser.add_argument(
+        "--stale-while-revalidate",
+        action="store_true",
+        help="serve feature values computed earlier while they're fresh enough",
+    )
+    parser.add_argument(
+        "--stale-ttl",
+        type=_parse_ttl,
+        default=DEFAULT_FEATURE_TTL,
+        metavar="SOFT:HARD",
+        help="seconds a value is served before being refreshed in the background, "
+        "and before not being served anymore (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--feature-ttl",
+        type=_parse_feature_ttl,
+        action="append",
+        default=[],
+        metavar="NAME=SOFT:HARD",
+        help="TTLs of one feature's values; may be repeated",
+    )
+    parser.add_argument(
+        "--fixed-point-amounts",
+        type=int,
+        metavar="DECIMALS",
+        help="sum amounts exactly as integers of minor units with these decimal places",
+    )
+    args = parser.parse_args(argv)
+    if args.budget_ms is not None and args.budget_ms <= 0:
+        parser.error("--budget-ms must be positive")
+    if args.result_cache_ttl <= 0:
+        parser.error("--result-cache-ttl must be positive")
+    unknown = sorted({name for name, _ in args.feature_ttl} - set(feature_names()))
+    if unknown:
+        parser.error(f"unknown features in --feature-ttl: {', '.join(unknown)}")
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(
+        run(
+            os.environ["PNGME_TOKEN"],
+            args.host,
+            args.port,
+            args.concurrency_limit,
+            [name for name in args.preload.split(",") if name],
+            args.institution_cache_path,
+            args.result_cache_size,
+            args.result_cache_ttl,
+            args.budget_ms / 1000 if args.budget_ms else None,
+            args.hedge,
+            args.stale_while_revalidate,
+            dict(args.feature_ttl),
+            args.stale_ttl,
+            args.fixed_point_amounts,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
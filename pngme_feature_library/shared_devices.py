@@ -0,0 +1,132 @@
+"""Population-wide index of users by device id.
+
+get_count_user_shared_device_ids makes two sequential ``users.get(search=...)`` calls
+per user, one to resolve the user's device_id and one to find the users sharing it.
+For batches, SharedDeviceIndex is built from a single scan of all users instead, after
+which each user's count is two binary searches:
+
+    index = SharedDeviceIndex()
+    await index.refresh(api_client)
+    counts = index.count_many(user_uuids, utc_starttime, utc_endtime)
+
+Calling ``refresh`` again only scans users created since the previous refresh, which
+is cheap but misses changes to existing users: counts are windowed on ``updated_at``,
+and a user's updated_at or device_id may change after the user was created. Those
+changes are only picked up by ``refresh(full=True)``, which scans every user again, or
+by applying the changed users with ``add_users``. A service keeping an index should
+schedule full refreshes; between them, its counts may lag
+get_count_user_shared_device_ids:
+
+    await index.refresh(api_client)             # every minute: new users
+    await index.refresh(api_client, full=True)  # every hour: every user
+"""
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .timestamps import parse_timestamp, to_timestamp
+
+User = Dict[str, Any]
+
+
+class SharedDeviceIndex:
+    """Users grouped by device_id, each group sorted by updated_at."""
+
+    def __init__(self) -> None:
+        # device_id -> parallel lists of updated_at timestamps (sorted) and user uuids
+        self._timestamps: Dict[str, List[float]] = {}
+        self._uuids: Dict[str, List[str]] = {}
+        # uuid -> (device_id, updated_at timestamp)
+        self._users: Dict[str, Tuple[str, float]] = {}
+        self.last_refreshed_at: Optional[datetime] = None
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def add_users(self, users: Iterable[User]) -> None:
+        """Insert user records, replacing earlier versions of the same users."""
+        for user in users:
+            uuid = user["uuid"]
+            device_id = user["device_id"]
+            updated_at = parse_timestamp(user["updated_at"])
+
+            if uuid in self._users:
+                if self._users[uuid] == (device_id, updated_at):
+                    continue
+                self._remove(uuid)
+
+            timestamps = self._timestamps.setdefault(device_id, [])
+            uuids = self._uuids.setdefault(device_id, [])
+            ix = bisect_right(timestamps, updated_at)
+            timestamps.insert(ix, updated_at)
+            uuids.insert(ix, uuid)
+            self._users[uuid] = (device_id, updated_at)
+
+    def _remove(self, uuid: str) -> None:
+        device_id, updated_at = self._users.pop(uuid)
+        timestamps = self._timestamps[device_id]
+        uuids = self._uuids[device_id]
+        ix = bisect_left(timestamps, updated_at)
+        while uuids[ix] != uuid:
+            ix += 1
+        del timestamps[ix]
+        del uuids[ix]
+
+    async def refresh(self, api_client: Any, full: bool = False) -> int:
+        """Scan users created since the last refresh, or all users.
+
+        Args:
+            api_client: Pngme Async API client
+            full: scan every user, applying changes to existing users and dropping
+                users no longer returned; always done by the first refresh
+
+        Returns:
+            the number of user records scanned
+        """
+        scan_started_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        if full or self.last_refreshed_at is None:
+            users = await api_client.users.get()
+            # add_users skips the users that didn't change
+            scanned = {user["uuid"] for user in users}
+            for uuid in [uuid for uuid in self._users if uuid not in scanned]:
+                self._remove(uuid)
+        else:
+            users = await api_client.users.get(created_after=self.last_refreshed_at)
+
+        self.add_users(users)
+        self.last_refreshed_at = scan_started_at
+        return len(users)
+
+    def count(
+        self, user_uuid: str, utc_starttime: datetime, utc_endtime: datetime
+    ) -> Optional[int]:
+        """Number of other users on the same device updated within the time window.
+
+        Same semantics as get_count_user_shared_device_ids: the window is inclusive at
+        both ends, and None is returned for unknown users.
+        """
+        if user_uuid not in self._users:
+            return None
+
+        device_id, updated_at = self._users[user_uuid]
+        start = to_timestamp(utc_starttime)
+        end = to_timestamp(utc_endtime)
+        timestamps = self._timestamps[device_id]
+        count = bisect_right(timestamps, end) - bisect_left(timestamps, start)
+
+        # The user is not counted as sharing a device with themselves
+        if start <= updated_at <= end:
+            count -= 1
+        return count
+
+    def count_many(
+        self,
+        user_uuids: Iterable[str],
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+    ) -> Dict[str, Optional[int]]:
+        return {
+            user_uuid: self.count(user_uuid, utc_starttime, utc_endtime)
+            for user_uuid in user_uuids
+        }
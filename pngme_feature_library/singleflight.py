@@ -0,0 +1,66 @@
+"""Coalescing of identical concurrent calls.
+
+When several features, or several scoring requests for the same user, ask for the
+same resource with the same parameters at the same time, only the first call reaches
+the API; the others wait on its result. Nothing is kept once the call completes, so
+this never serves data older than the call a caller joined.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, List, TypeVar
+
+from .client import ClientWrapper, Record, request_key
+from .metrics import SINGLEFLIGHT_CALLS
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """Run at most one call per key at a time and share its outcome between callers.
+
+    Args:
+        name: label for the calls counted in metrics
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: Dict[Hashable, "asyncio.Future[T]"] = {}
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        future = self._in_flight.get(key)
+        if future is None:
+            SINGLEFLIGHT_CALLS.inc(group=self.name, role="leader")
+            future = asyncio.ensure_future(call())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            SINGLEFLIGHT_CALLS.inc(group=self.name, role="follower")
+
+        # Shield the shared call so that one caller being cancelled does not cancel it
+        # for every other caller waiting on it
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: "asyncio.Future[T]") -> None:
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+
+class SingleFlightClient(ClientWrapper):
+    """Share one in-flight API call between concurrent identical resource calls."""
+
+    def __init__(self, client: Any):
+        super().__init__(client)
+        self._flights: Dict[str, SingleFlight[List[Record]]] = {}
+
+    async def _get(self, resource: str, params: Dict[str, Any]) -> List[Record]:
+        flight = self._flights.get(resource)
+        if flight is None:
+            flight = self._flights[resource] = SingleFlight(resource)
+
+        async def call() -> List[Record]:
+            return await super(SingleFlightClient, self)._get(resource, params)
+
+        return await flight.do(request_key(resource, params), call)
@@ -0,0 +1,433 @@
+"""Features as set-based SQL over the local history store, for whole populations.
+
+SQLBackend runs DuckDB over the Parquet files of a HistoryStore and computes features
+for every stored user in a single query, one row per user:
+
+    backend = SQLBackend(HistoryStore("history/"))
+    values = backend.compute(utc_starttime, utc_endtime, ["sum_of_credits", ...])
+    values["958a5ae8-..."]["sum_of_credits"]
+
+Each feature is a common table expression in FEATURE_SQL following the same rules
+as its implementation in lib/: the same institution and account type filters, the
+window inclusive at both ends, and for the end-of-day balance features the last
+balance of each UTC day carried forward for at most BALANCE_VALID_FOR_DAYS days
+over the days ``utc_starttime + k days``. Results agree with the features in lib/ up
+to floating-point rounding. The views ``transactions``, ``balances``, ``alerts`` and
+``institution_account_types`` can also be queried directly through ``connection``.
+
+Requires DuckDB and pyarrow (``pip install -e ".[sql]"``).
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+import duckdb  # type: ignore
+import pyarrow as pa  # type: ignore
+
+from .history import (
+    INSTITUTION_COLUMN,
+    TIMESTAMP_COLUMN,
+    USER_COLUMN,
+    HistoryStore,
+)
+from .rollups import BALANCE_VALID_FOR_DAYS, LABEL_COUNT_FEATURES
+from .timestamps import to_microseconds
+
+MICROSECONDS_PER_DAY = 24 * 60 * 60 * 1_000_000
+MICROSECONDS_PER_WEEK = 7 * MICROSECONDS_PER_DAY
+
+# Columns the queries need from each resource, used when none of its files exist
+_COLUMNS = {
+    "alerts": {"labels": "VARCHAR[]"},
+    "balances": {
+        "account_id": "VARCHAR",
+        "account_type": "VARCHAR",
+        "balance": "DOUBLE",
+    },
+    "transactions": {
+        "account_type": "VARCHAR",
+        "impact": "VARCHAR",
+        "amount": "DOUBLE",
+    },
+}
+
+# Shared by the feature queries; DuckDB skips those no feature refers to
+_BASE_SQL = f"""
+depository_institutions AS (
+    SELECT user_uuid, institution_id FROM institution_account_types
+    WHERE account_type = 'depository'
+),
+loan_institutions AS (
+    SELECT user_uuid, institution_id FROM institution_account_types
+    WHERE account_type = 'loan'
+),
+window_transactions AS (
+    SELECT * FROM transactions
+    WHERE {TIMESTAMP_COLUMN} BETWEEN $start_us AND $end_us
+),
+depository_transactions AS (
+    SELECT t.* FROM window_transactions t
+    JOIN depository_institutions i
+        ON t.{USER_COLUMN} = i.user_uuid AND t.{INSTITUTION_COLUMN} = i.institution_id
+    WHERE t.account_type = 'depository'
+),
+loan_transactions AS (
+    SELECT t.* FROM window_transactions t
+    JOIN loan_institutions i
+        ON t.{USER_COLUMN} = i.user_uuid AND t.{INSTITUTION_COLUMN} = i.institution_id
+    WHERE t.account_type = 'loan'
+),
+window_alerts AS (
+    SELECT * FROM alerts WHERE {TIMESTAMP_COLUMN} BETWEEN $start_us AND $end_us
+)"""
+
+
+def _latest_balances_sql(account_type: str) -> str:
+    return f"""
+    SELECT user_uuid, SUM(balance) AS value FROM (
+        SELECT b.{USER_COLUMN} AS user_uuid, b.balance
+        FROM balances b
+        JOIN {account_type}_institutions i
+            ON b.{USER_COLUMN} = i.user_uuid AND b.{INSTITUTION_COLUMN} = i.institution_id
+        WHERE b.account_type = '{account_type}'
+            AND b.{TIMESTAMP_COLUMN} BETWEEN $start_us AND $end_us
+        QUALIFY row_number() OVER (
+            PARTITION BY b.{USER_COLUMN}, b.{INSTITUTION_COLUMN}, b.account_id
+            ORDER BY b.{TIMESTAMP_COLUMN} DESC
+        ) = 1
+    )
+    GROUP BY user_uuid"""
+
+
+def _end_of_day_sql(account_type: str) -> str:
+    """Mean and median daily total balance on active days, per user.
+
+    Depository balances and active days come from institutions holding depository
+    accounts; loan balances and active days from every institution, as in lib/.
+    """
+    if account_type == "depository":
+        institutions_join = f"""
+        JOIN depository_institutions i
+            ON r.{USER_COLUMN} = i.user_uuid AND r.{INSTITUTION_COLUMN} = i.institution_id"""
+    else:
+        institutions_join = ""
+
+    # Index of the day in the window, if a record's UTC day is one of the window's days
+    day = f"r.{TIMESTAMP_COLUMN} // {MICROSECONDS_PER_DAY} * {MICROSECONDS_PER_DAY}"
+    in_window = (
+        f"{day} BETWEEN $start_us AND $end_us "
+        f"AND ({day} - $start_us) % {MICROSECONDS_PER_DAY} = 0"
+    )
+    day_index = f"({day} - $start_us) // {MICROSECONDS_PER_DAY}"
+
+    return f"""
+    WITH end_of_day AS (
+        SELECT
+            r.{USER_COLUMN} AS user_uuid,
+            r.{INSTITUTION_COLUMN} AS institution_id,
+            r.account_id,
+            {day_index} AS day_index,
+            r.balance
+        FROM balances r {institutions_join}
+        WHERE r.account_type = '{account_type}'
+            AND r.{TIMESTAMP_COLUMN} BETWEEN $lookback_start_us AND $end_us
+            AND {in_window}
+        QUALIFY row_number() OVER (
+            PARTITION BY r.{USER_COLUMN}, r.{INSTITUTION_COLUMN}, r.account_id, {day}
+            ORDER BY r.{TIMESTAMP_COLUMN} DESC
+        ) = 1
+    ),
+    valid_end_of_day AS (SELECT * FROM end_of_day WHERE balance IS NOT NULL),
+    account_days AS (
+        SELECT a.*, days.day_index
+        FROM (SELECT DISTINCT user_uuid, institution_id, account_id
+              FROM valid_end_of_day) a
+        CROSS JOIN range(0, $num_days) days(day_index)
+    ),
+    carried_forward AS (
+        SELECT d.user_uuid, d.day_index, e.balance
+        FROM account_days d
+        ASOF JOIN valid_end_of_day e
+            ON d.user_uuid = e.user_uuid
+            AND d.institution_id = e.institution_id
+            AND d.account_id = e.account_id
+            AND d.day_index >= e.day_index
+        WHERE d.day_index - e.day_index <= {BALANCE_VALID_FOR_DAYS}
+    ),
+    daily_totals AS (
+        SELECT user_uuid, day_index, SUM(balance) AS total
+        FROM carried_forward GROUP BY user_uuid, day_index
+    ),
+    active_days AS (
+        SELECT DISTINCT r.{USER_COLUMN} AS user_uuid, {day_index} AS day_index
+        FROM balances r {institutions_join}
+        WHERE r.account_type = '{account_type}'
+            AND r.{TIMESTAMP_COLUMN} BETWEEN $lookback_start_us AND $end_us
+            AND {in_window}
+        UNION
+        SELECT DISTINCT r.{USER_COLUMN}, {day_index}
+        FROM window_transactions r {institutions_join}
+        WHERE {in_window}
+    ),
+    users_with_balances AS (
+        SELECT DISTINCT r.{USER_COLUMN} AS user_uuid
+        FROM balances r {institutions_join}
+        WHERE r.account_type = '{account_type}'
+            AND r.{TIMESTAMP_COLUMN} BETWEEN $lookback_start_us AND $end_us
+    ),
+    active_totals AS (
+        SELECT * FROM daily_totals JOIN active_days USING (user_uuid, day_index)
+    )
+    SELECT
+        u.user_uuid,
+        COALESCE(AVG(t.total), 'NaN'::DOUBLE) AS mean,
+        COALESCE(MEDIAN(t.total), 'NaN'::DOUBLE) AS median
+    FROM users_with_balances u
+    LEFT JOIN active_totals t USING (user_uuid)
+    GROUP BY u.user_uuid"""
+
+
+def _label_count_sql(label: str, account_type: Optional[str]) -> str:
+    if account_type is None:
+        return f"""
+    SELECT {USER_COLUMN} AS user_uuid, COUNT(*) AS value FROM window_alerts
+    WHERE list_contains(labels, '{label}')
+    GROUP BY 1"""
+    return f"""
+    SELECT a.{USER_COLUMN} AS user_uuid, COUNT(*) AS value FROM window_alerts a
+    JOIN {account_type}_institutions i
+        ON a.{USER_COLUMN} = i.user_uuid AND a.{INSTITUTION_COLUMN} = i.institution_id
+    WHERE list_contains(a.labels, '{label}')
+    GROUP BY 1"""
+
+
+# Each feature: a query with one row per user, and the expression of its value, in
+# which {table} stands for the query's name
+FEATURE_SQL: Dict[str, Dict[str, str]] = {
+    "sum_of_credits": {
+        "query": f"""
+    SELECT {USER_COLUMN} AS user_uuid,
+        SUM(amount) FILTER (WHERE impact = 'CREDIT') AS value
+    FROM depository_transactions GROUP BY user_uuid""",
+        "value": "{table}.value",
+    },
+    "sum_of_debits": {
+        "query": f"""
+    SELECT {USER_COLUMN} AS user_uuid,
+        SUM(amount) FILTER (WHERE impact = 'DEBIT') AS value
+    FROM depository_transactions GROUP BY user_uuid""",
+        "value": "{table}.value",
+    },
+    "net_cash_flow": {
+        "query": f"""
+    SELECT {USER_COLUMN} AS user_uuid,
+        CASE WHEN COUNT(*) FILTER (WHERE impact IN ('CREDIT', 'DEBIT')) > 0 THEN
+            COALESCE(SUM(amount) FILTER (WHERE impact = 'CREDIT'), 0)
+            - COALESCE(SUM(amount) FILTER (WHERE impact = 'DEBIT'), 0)
+        END AS value
+    FROM depository_transactions GROUP BY user_uuid""",
+        "value": "{table}.value",
+    },
+    "sum_of_loan_repayments": {
+        "query": f"""
+    SELECT {USER_COLUMN} AS user_uuid,
+        SUM(amount) FILTER (WHERE impact = 'CREDIT') AS value
+    FROM loan_transactions GROUP BY user_uuid""",
+        "value": "COALESCE({table}.value, 0)",
+    },
+    "count_transactions_depository": {
+        "query": f"""
+    SELECT {USER_COLUMN} AS user_uuid,
+        COUNT(*) FILTER (WHERE impact IN ('CREDIT', 'DEBIT')) AS value
+    FROM depository_transactions GROUP BY user_uuid""",
+        "value": "COALESCE({table}.value, 0)",
+    },
+    "sum_of_depository_balances_latest": {
+        "query": _latest_balances_sql("depository"),
+        "value": "{table}.value",
+    },
+    "sum_of_loan_balances_latest": {
+        "query": _latest_balances_sql("loan"),
+        "value": "{table}.value",
+    },
+    "average_end_of_day_depository_balance": {
+        "query": _end_of_day_sql("depository"),
+        "value": "{table}.mean",
+    },
+    "median_end_of_day_depository_balance": {
+        "query": _end_of_day_sql("depository"),
+        "value": "{table}.median",
+    },
+    "average_end_of_day_loan_balance": {
+        "query": _end_of_day_sql("loan"),
+        # Users with balances but no loan balances have no loan balance
+        "value": f"""CASE
+        WHEN {{table}}.user_uuid IS NOT NULL THEN {{table}}.mean
+        WHEN EXISTS (
+            SELECT 1 FROM balances b
+            WHERE b.{USER_COLUMN} = population.user_uuid
+                AND b.{TIMESTAMP_COLUMN} BETWEEN $lookback_start_us AND $end_us
+        ) THEN 0.0
+    END""",
+    },
+    "standard_deviation_of_week_to_week_sum_of_credits": {
+        # Weeks are counted back from the end of the window, as in weekly.py
+        "query": f"""
+    WITH credits AS (
+        SELECT {USER_COLUMN} AS user_uuid,
+            ($end_us - {TIMESTAMP_COLUMN}) // {MICROSECONDS_PER_WEEK} AS week, amount
+        FROM depository_transactions
+        WHERE impact = 'CREDIT' AND amount IS NOT NULL
+    ),
+    weekly_sums AS (
+        SELECT user_uuid, week, SUM(amount) AS total FROM credits
+        WHERE week < $num_weeks GROUP BY user_uuid, week
+    )
+    SELECT u.user_uuid,
+        CASE WHEN $num_weeks >= 2 THEN STDDEV_SAMP(COALESCE(w.total, 0)) END AS value
+    FROM (SELECT DISTINCT user_uuid FROM credits) u
+    CROSS JOIN range(0, $num_weeks) weeks(week)
+    LEFT JOIN weekly_sums w ON w.user_uuid = u.user_uuid AND w.week = weeks.week
+    GROUP BY u.user_uuid""",
+        "value": "{table}.value",
+    },
+    **{
+        name: {
+            "query": _label_count_sql(label, account_type),
+            "value": "COALESCE({table}.value, 0)",
+        }
+        for name, (label, account_type) in LABEL_COUNT_FEATURES.items()
+    },
+}
+
+
+class SQLBackend:
+    """Compute features for whole populations with DuckDB over a HistoryStore.
+
+    Args:
+        store: the history store to read
+        database: DuckDB database file; in memory if not given
+    """
+
+    def __init__(self, store: HistoryStore, database: str = ":memory:"):
+        self.store = store
+        self.connection = duckdb.connect(database)
+        self.refresh()
+
+    def refresh(self) -> None:
+        """(Re)create the views over the store, picking up new users and resources."""
+        for resource, columns in _COLUMNS.items():
+            pattern = self.store.root / resource / "*" / "*" / "*.parquet"
+            if any((self.store.root / resource).glob("*/*/*.parquet")):
+                source = (
+                    f"read_parquet('{pattern}', union_by_name = true, "
+                    "hive_partitioning = false)"
+                )
+            else:
+                typed_nulls = ", ".join(
+                    f"NULL::{type_} AS {name}"
+                    for name, type_ in {
+                        USER_COLUMN: "VARCHAR",
+                        INSTITUTION_COLUMN: "VARCHAR",
+                        TIMESTAMP_COLUMN: "BIGINT",
+                        **columns,
+                    }.items()
+                )
+                source = f"(SELECT {typed_nulls} WHERE false)"
+            self.connection.execute(
+                f"CREATE OR REPLACE VIEW {resource} AS SELECT * FROM {source}"
+            )
+
+        rows = [
+            {
+                "user_uuid": user_uuid,
+                "institution_id": institution["institution_id"],
+                "account_type": account_type,
+            }
+            for user_uuid in self.store.user_uuids()
+            for institution in self.store.institutions(user_uuid) or []
+            for account_type in institution["account_types"]
+        ]
+        institution_account_types = pa.Table.from_pylist(
+            rows,
+            schema=pa.schema(
+                [
+                    ("user_uuid", pa.string()),
+                    ("institution_id", pa.string()),
+                    ("account_type", pa.string()),
+                ]
+            ),
+        )
+        self.connection.register("institution_account_types", institution_account_types)
+
+    def query(self, names: Sequence[str]) -> str:
+        """The SQL computing features for every user in the ``population`` table."""
+        ctes = [_BASE_SQL]
+        columns = []
+        joins = []
+        for name in names:
+            feature = FEATURE_SQL[name]
+            ctes.append(f"{name} AS ({feature['query']}\n)")
+            joins.append(f"LEFT JOIN {name} USING (user_uuid)")
+            columns.append(f"{feature['value'].replace('{table}', name)} AS {name}")
+        return (
+            "WITH "
+            + ",\n".join(ctes)
+            + "\nSELECT population.user_uuid, "
+            + ", ".join(columns)
+            + "\nFROM population\n"
+            + "\n".join(joins)
+        )
+
+    def compute(
+        self,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        names: Optional[Sequence[str]] = None,
+        user_uuids: Optional[Sequence[str]] = None,
+    ) -> Dict[str, Dict[str, Any]]:
+        """Compute features for a population of users in one query.
+
+        Args:
+            utc_starttime: the UTC time to start the time window
+            utc_endtime: the UTC time to end the time window
+            names: the features to compute; by default all features in FEATURE_SQL
+            user_uuids: the users to compute features for; by default every user with
+                stored institutions
+
+        Returns:
+            feature values by name, by user_uuid
+        """
+        names = list(FEATURE_SQL if names is None else names)
+        unknown = sorted(set(names) - set(FEATURE_SQL))
+        if unknown:
+            raise KeyError(f"Features not available in SQL: {', '.join(unknown)}")
+
+        start_us = to_microseconds(utc_starttime)
+        end_us = to_microseconds(utc_endtime)
+        params = {
+            "start_us": start_us,
+            "end_us": end_us,
+            "lookback_start_us": to_microseconds(
+                utc_starttime - timedelta(days=BALANCE_VALID_FOR_DAYS)
+            ),
+            "num_days": (end_us - start_us) // MICROSECONDS_PER_DAY + 1,
+            "num_weeks": (end_us - start_us) // MICROSECONDS_PER_WEEK,
+        }
+        population = pa.table(
+            {
+                "user_uuid": pa.array(
+                    self.store.user_uuids() if user_uuids is None else list(user_uuids),
+                    type=pa.string(),
+                )
+            }
+        )
+        self.connection.register("population", population)
+        query = self.query(names)
+        # DuckDB rejects parameters the query doesn't use
+        params = {key: value for key, value in params.items() if f"${key}" in query}
+        result = self.connection.execute(query, params).fetchall()
+        return {row[0]: dict(zip(names, row[1:])) for row in result}
+
+    def close(self) -> None:
+        self.connection.close()
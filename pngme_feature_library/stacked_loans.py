@@ -0,0 +1,92 @@
+"""Distinct institutions with loan activity per day, for stacked-loan features.
+
+Days are counted from the earliest loan alert, as in
+get_daily_average_of_stacked_loan_alerts: day ``d`` covers the 24 hours starting
+``d`` days after that alert. Each alert is reduced to one integer packing its day
+and institution, so the distinct (day, institution) pairs are a set of ints and
+each day's count is a tally of the pairs' days.
+
+    stacked = StackedLoans.from_alerts(loan_alerts)
+    stacked.mean()                # the daily average of stacked loan alerts
+    stacked.max(), stacked.percentile(90)
+    stacked.daily_counts()        # {day index: number of institutions}
+"""
+
+import math
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .timestamps import parse_timestamp
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class StackedLoans:
+    """Number of distinct institutions with a loan alert on each active day.
+
+    Args:
+        counts: the number of institutions for each day index with any loan alert
+        num_institutions: the number of distinct institutions across all days
+    """
+
+    def __init__(self, counts: Dict[int, int], num_institutions: int):
+        self.counts = counts
+        self.num_institutions = num_institutions
+
+    @classmethod
+    def from_alerts(cls, alerts: Iterable[Tuple[str, str]]) -> "StackedLoans":
+        """Count (API timestamp, institution_id) pairs of loan alerts."""
+        timestamps: List[float] = []
+        institution_indexes: List[int] = []
+        institutions: Dict[str, int] = {}
+        for timestamp, institution_id in alerts:
+            timestamps.append(parse_timestamp(timestamp))
+            institution_indexes.append(
+                institutions.setdefault(institution_id, len(institutions))
+            )
+
+        if not timestamps:
+            return cls({}, 0)
+
+        first = min(timestamps)
+        num_institutions = len(institutions)
+        pairs = {
+            int((timestamp - first) // SECONDS_PER_DAY) * num_institutions + index
+            for timestamp, index in zip(timestamps, institution_indexes)
+        }
+        counts = Counter(pair // num_institutions for pair in pairs)
+        return cls(dict(sorted(counts.items())), num_institutions)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def daily_counts(self, include_inactive_days: bool = False) -> Dict[int, int]:
+        """Institutions per day index; days without loan alerts are zero if included."""
+        if not include_inactive_days or not self.counts:
+            return dict(self.counts)
+        return {day: self.counts.get(day, 0) for day in range(max(self.counts) + 1)}
+
+    def mean(self) -> Optional[float]:
+        """Average over the days with any loan alert; None if there are none."""
+        if not self.counts:
+            return None
+        return sum(self.counts.values()) / len(self.counts)
+
+    def max(self) -> Optional[int]:
+        return max(self.counts.values()) if self.counts else None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """``q``-th percentile (0-100) over the days with any loan alert.
+
+        Linearly interpolated between the closest ranks, as numpy and pandas do.
+        """
+        if not self.counts:
+            return None
+        values = sorted(self.counts.values())
+        rank = (len(values) - 1) * q / 100
+        lower = math.floor(rank)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+    def percentiles(self, qs: Iterable[float]) -> Dict[float, Optional[float]]:
+        return {q: self.percentile(q) for q in qs}
@@ -0,0 +1,182 @@
+"""Stale-while-revalidate serving of feature values.
+
+Dashboards and other low-risk surfaces would rather show a slightly stale value at
+once than wait on the API. StaleWhileRevalidate keeps the last value of each feature,
+user and window, and serves it according to its age and the feature's TTLs:
+
+- younger than the soft TTL, the value is returned as is;
+- between the soft and hard TTLs, it is returned and refreshed in the background;
+- older than the hard TTL, or never computed, the call waits for a fresh value.
+
+Concurrent refreshes of the same value share one computation. A failed background
+refresh leaves the stale value in place, to be refreshed again on the next call;
+failures of calls that wait are raised.
+
+    swr = StaleWhileRevalidate(compute, {"net_cash_flow": FeatureTTL(300, 3600)})
+    value, staleness = await swr.get("net_cash_flow", user_uuid, utc_starttime, utc_endtime)
+    staleness.age, staleness.state  # 12.5, "fresh"
+
+``window`` identifies the values a call may be served; by default its exact start and
+end. Rolling windows ending now should pass something like their length instead, so
+that calls made later may share values.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from .metrics import STALE_WHILE_REVALIDATE
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class FeatureTTL(NamedTuple):
+    # Seconds a value is served without being refreshed
+    soft: float
+    # Seconds after which a value isn't served anymore
+    hard: float
+
+
+DEFAULT_FEATURE_TTL = FeatureTTL(soft=60.0, hard=600.0)
+
+
+class Staleness(NamedTuple):
+    # Seconds since the value served was computed
+    age: float
+    # "fresh" within the soft TTL, "stale" when refreshed in the background, and
+    # "computed" when the call waited for it
+    state: str
+
+
+class _Entry(NamedTuple):
+    value: Any
+    computed_at: float
+
+
+class StaleWhileRevalidate:
+    """Serve feature values from memory while they're fresh enough, refreshing them.
+
+    Args:
+        compute: computes a feature, called with its name, the user_uuid and the time
+            window
+        ttls: TTLs of features, by name
+        default_ttl: TTLs of features not in ``ttls``
+        max_size: values kept, the least recently used being dropped first
+    """
+
+    def __init__(
+        self,
+        compute: Callable[[str, str, datetime, datetime], Awaitable[Any]],
+        ttls: Optional[Dict[str, FeatureTTL]] = None,
+        default_ttl: FeatureTTL = DEFAULT_FEATURE_TTL,
+        max_size: int = 100_000,
+    ):
+        self.compute = compute
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[str, str, Hashable], _Entry]" = OrderedDict()
+        self._refreshes: SingleFlight[Any] = SingleFlight("stale_while_revalidate")
+        self._background: Set["asyncio.Future[Any]"] = set()
+
+    def ttl(self, name: str) -> FeatureTTL:
+        return self.ttls.get(name, self.default_ttl)
+
+    async def get(
+        self,
+        name: str,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+        window: Optional[Hashable] = None,
+    ) -> Tuple[Any, Staleness]:
+        """Value of a feature, and how stale it is.
+
+        Args:
+            window: identifies the values the call may be served; its start and end
+                by default
+        """
+        if window is None:
+            window = (utc_starttime, utc_endtime)
+        key = (name, user_uuid, window)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            age = time.monotonic() - entry.computed_at
+            ttl = self.ttl(name)
+            if age < ttl.soft:
+                STALE_WHILE_REVALIDATE.inc(feature=name, state="fresh")
+                return entry.value, Staleness(age, "fresh")
+            if age < ttl.hard:
+                STALE_WHILE_REVALIDATE.inc(feature=name, state="stale")
+                self._revalidate(key, name, user_uuid, utc_starttime, utc_endtime)
+                return entry.value, Staleness(age, "stale")
+
+        STALE_WHILE_REVALIDATE.inc(
+            feature=name, state="missing" if entry is None else "expired"
+        )
+        value = await self._refresh(key, name, user_uuid, utc_starttime, utc_endtime)
+        return value, Staleness(0.0, "computed")
+
+    async def _refresh(
+        self,
+        key: Tuple[str, str, Hashable],
+        name: str,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+    ) -> Any:
+        async def compute() -> Any:
+            value = await self.compute(name, user_uuid, utc_starttime, utc_endtime)
+            self._entries[key] = _Entry(value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return value
+
+        return await self._refreshes.do(key, compute)
+
+    def _revalidate(
+        self,
+        key: Tuple[str, str, Hashable],
+        name: str,
+        user_uuid: str,
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+    ) -> None:
+        refresh = asyncio.ensure_future(
+            self._refresh(key, name, user_uuid, utc_starttime, utc_endtime)
+        )
+        # Keep a reference, as the event loop only keeps weak ones to tasks
+        self._background.add(refresh)
+        refresh.add_done_callback(self._refreshed)
+
+    def _refreshed(self, refresh: "asyncio.Future[Any]") -> None:
+        self._background.discard(refresh)
+        if not refresh.cancelled() and refresh.exception() is not None:
+            logger.warning(
+                "Refreshing a stale feature value failed: %r", refresh.exception()
+            )
+
+    def invalidate(self, user_uuid: str) -> None:
+        """Forget every value of a user."""
+        for key in [key for key in self._entries if key[1] == user_uuid]:
+            del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
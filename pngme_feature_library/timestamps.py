@@ -0,0 +1,25 @@
+"""Conversions between API timestamps, datetimes and POSIX seconds."""
+
+from datetime import datetime, timedelta, timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def to_timestamp(value: datetime) -> float:
+    """POSIX seconds of a datetime; naive datetimes are taken to be UTC."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def to_microseconds(value: datetime) -> int:
+    """Microseconds since the epoch, exactly; naive datetimes are taken to be UTC."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // MICROSECOND
+
+
+def parse_timestamp(value: str) -> float:
+    """POSIX seconds of an ISO 8601 timestamp as returned by the API."""
+    return to_timestamp(datetime.fromisoformat(value))
@@ -0,0 +1,104 @@
+"""Weekly bucketing of amounts for income-consistency features.
+
+Weeks are anchored to the end of the time window, not to the calendar: week 0 covers
+the 7 days up to and including ``utc_endtime``, week 1 the 7 days before that, and so
+on. A window holds ``floor((utc_endtime - utc_starttime) / 7 days)`` whole weeks; a
+leading partial week is left out so that every bucket spans exactly 7 days. Weeks
+without any amount count as zero, including weeks at either edge of the window.
+
+    buckets = WeeklyBuckets.from_records(credits, utc_starttime, utc_endtime)
+    buckets.std()                  # over the whole window
+    buckets.statistics([4, 8, 12]) # over the most recent 4, 8 and 12 weeks
+"""
+
+import math
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from .timestamps import to_timestamp
+
+WEEK = timedelta(days=7)
+SECONDS_PER_WEEK = WEEK.total_seconds()
+
+
+class WeeklyStatistics(NamedTuple):
+    weeks: int
+    mean: float
+    std: Optional[float]
+    coefficient_of_variation: Optional[float]
+    zero_weeks: int
+
+
+class WeeklyBuckets:
+    """Sum of amounts per week, most recent week first.
+
+    Args:
+        sums: the sum for each week, index 0 being the most recent week
+    """
+
+    def __init__(self, sums: List[float]):
+        self.sums = sums
+
+    @classmethod
+    def from_records(
+        cls,
+        records: Iterable[Tuple[datetime, float]],
+        utc_starttime: datetime,
+        utc_endtime: datetime,
+    ) -> "WeeklyBuckets":
+        """Bucket (timestamp, amount) pairs; records outside the whole weeks are ignored."""
+        end = to_timestamp(utc_endtime)
+        num_weeks = int((end - to_timestamp(utc_starttime)) // SECONDS_PER_WEEK)
+        sums = [0.0] * num_weeks
+        for timestamp, amount in records:
+            seconds_before_end = end - to_timestamp(timestamp)
+            if seconds_before_end < 0:
+                continue
+            week = int(seconds_before_end // SECONDS_PER_WEEK)
+            if week < num_weeks:
+                sums[week] += amount
+        return cls(sums)
+
+    def __len__(self) -> int:
+        return len(self.sums)
+
+    def window(self, weeks: Optional[int] = None) -> List[float]:
+        """Sums of the most recent ``weeks`` weeks, or of every week."""
+        return self.sums if weeks is None else self.sums[:weeks]
+
+    def mean(self, weeks: Optional[int] = None) -> Optional[float]:
+        sums = self.window(weeks)
+        return sum(sums) / len(sums) if sums else None
+
+    def std(self, weeks: Optional[int] = None) -> Optional[float]:
+        """Sample standard deviation (ddof=1, as pandas); None for fewer than 2 weeks."""
+        sums = self.window(weeks)
+        if len(sums) < 2:
+            return None
+        mean = sum(sums) / len(sums)
+        return math.sqrt(sum((x - mean) ** 2 for x in sums) / (len(sums) - 1))
+
+    def coefficient_of_variation(self, weeks: Optional[int] = None) -> Optional[float]:
+        """Standard deviation relative to the mean; None if the mean is zero."""
+        mean = self.mean(weeks)
+        std = self.std(weeks)
+        if std is None or not mean:
+            return None
+        return std / mean
+
+    def zero_weeks(self, weeks: Optional[int] = None) -> int:
+        return sum(1 for x in self.window(weeks) if x == 0)
+
+    def statistics(self, windows: Sequence[int]) -> Dict[int, WeeklyStatistics]:
+        """Statistics over several windows, each given as a number of recent weeks."""
+        result = {}
+        for weeks in windows:
+            sums = self.window(weeks)
+            result[weeks] = WeeklyStatistics(
+                weeks=len(sums),
+                mean=self.mean(weeks) or 0.0,
+                std=self.std(weeks),
+                coefficient_of_variation=self.coefficient_of_variation(weeks),
+                zero_weeks=self.zero_weeks(weeks),
+            )
+        return result
@@ -5,9 +5,13 @@ cd $(dirname "${BASH_SOURCE[0]}")/..
 python3 -m venv .venv
 source .venv/bin/activate
 
-pip install black mypy
+pip install black mypy pytest
+
+echo "Installing package: pngme_feature_library"
+pip install -e .
 
 for FEATUREDIR in lib/*; do
     echo "\Installing dependencies: $FEATUREDIR"
-    pip install -r $FEATUREDIR/requirements.txt
+    # Requirements may refer to this repository relative to the feature directory
+    (cd $FEATUREDIR && pip install -r requirements.txt)
 done
@@ -3,6 +3,13 @@ set -e
 cd $(dirname "${BASH_SOURCE[0]}")/..
 source .venv/bin/activate
 
+# Let mypy resolve pngme_feature_library imports made by the features
+export MYPYPATH=$(pwd)
+
+echo "Checking: pngme_feature_library"
+black --check pngme_feature_library tests
+mypy pngme_feature_library
+
 for FEATUREDIR in lib/*; do
     echo "Checking: $FEATUREDIR"
 
@@ -3,6 +3,9 @@ set -e
 cd $(dirname "${BASH_SOURCE[0]}")/..
 source .venv/bin/activate
 
+echo "Checking: tests"
+python -m pytest -q tests
+
 for FEATUREDIR in lib/*; do
     echo "Checking: $FEATUREDIR"
     (cd $FEATUREDIR && python main.py)
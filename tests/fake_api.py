@@ -0,0 +1,168 @@
+"""A synthetic Pngme API for the tests: users with random histories, answered with the
+filters of the API."""
+
+import asyncio
+import math
+import random
+from datetime import datetime, timedelta, timezone
+
+LABELS = (
+    "BettingAndLottery",
+    "InsufficientFunds",
+    "LoanApproved",
+    "LoanDeclined",
+    "LoanDefaulted",
+    "LoanDisbursed",
+    "LoanMissedPayment",
+    "LoanRepaid",
+    "LoanRepayment",
+    "LoanRepaymentReminder",
+    "Overdraft",
+)
+
+INSTITUTIONS = (
+    {"institution_id": "bank1", "account_types": ["depository"]},
+    {"institution_id": "lender1", "account_types": ["loan"]},
+    {"institution_id": "bank2", "account_types": ["depository", "loan"]},
+)
+
+RESOURCES = ("transactions", "balances", "alerts")
+
+HISTORY_START = datetime(2021, 7, 1)
+HISTORY_DAYS = 120
+
+# Records per page, as HistoryClient assumes by default
+PAGE_SIZE = 100
+
+
+def timestamp(time):
+    """API timestamp of a naive UTC datetime."""
+    return time.replace(tzinfo=timezone.utc).isoformat()
+
+
+def _time(rng, start, days):
+    return start + timedelta(seconds=rng.randrange(days * 24 * 60 * 60))
+
+
+def transaction(time, rng):
+    return {
+        "timestamp": timestamp(time),
+        "amount": round(rng.uniform(1, 500), 2),
+        "currency": "KES",
+        "impact": rng.choice(("CREDIT", "DEBIT")),
+        "description": "",
+        "account_id": rng.choice(("a1", "a2")),
+        "account_type": rng.choice(("depository", "loan")),
+        "labels": [],
+    }
+
+
+def balance(time, rng):
+    return {
+        "timestamp": timestamp(time),
+        "balance": round(rng.uniform(0, 5000), 2),
+        "currency": "KES",
+        "account_id": rng.choice(("a1", "a2")),
+        "account_type": rng.choice(("depository", "loan")),
+    }
+
+
+def alert(time, rng):
+    return {"timestamp": timestamp(time), "labels": rng.sample(LABELS, 2)}
+
+
+def make_user(rng, start=HISTORY_START, days=HISTORY_DAYS):
+    """Institutions of a user and their records, by institution and resource."""
+    institutions = [
+        dict(institution) for institution in INSTITUTIONS if rng.random() < 0.8
+    ]
+    has_balances = rng.random() < 0.9
+    records = {
+        institution["institution_id"]: {
+            "transactions": [
+                transaction(_time(rng, start, days), rng)
+                for _ in range(rng.randrange(150))
+            ],
+            "balances": [
+                balance(_time(rng, start, days), rng)
+                for _ in range(rng.randrange(1, 60) if has_balances else 0)
+            ],
+            "alerts": [
+                alert(_time(rng, start, days), rng) for _ in range(rng.randrange(40))
+            ],
+        }
+        for institution in institutions
+    }
+    return institutions, records
+
+
+def make_users(num_users, seed):
+    rng = random.Random(seed)
+    return {f"user{k}": make_user(rng) for k in range(num_users)}
+
+
+def _within(record, utc_starttime, utc_endtime):
+    time = datetime.fromisoformat(record["timestamp"]).replace(tzinfo=None)
+    return (utc_starttime is None or time >= utc_starttime.replace(tzinfo=None)) and (
+        utc_endtime is None or time <= utc_endtime.replace(tzinfo=None)
+    )
+
+
+class FakeResource:
+    def __init__(self, api, name):
+        self.api = api
+        self.name = name
+
+    async def get(
+        self,
+        user_uuid,
+        institution_id=None,
+        utc_starttime=None,
+        utc_endtime=None,
+        labels=None,
+        account_types=None,
+        page=None,
+    ):
+        self.api.calls.append((self.name, user_uuid, institution_id, page))
+        await asyncio.sleep(0)
+        institutions, records = self.api.users.get(user_uuid, ([], {}))
+        if self.name == "institutions":
+            return [dict(institution) for institution in institutions]
+
+        matching = [
+            dict(record)
+            for record in records[institution_id][self.name]
+            if _within(record, utc_starttime, utc_endtime)
+            and (labels is None or set(labels) & set(record["labels"]))
+            and (account_types is None or record["account_type"] in account_types)
+        ]
+        # Most recent first
+        matching.sort(key=lambda record: record["timestamp"], reverse=True)
+        if page:
+            return matching[(page - 1) * PAGE_SIZE : page * PAGE_SIZE]
+        return matching
+
+
+class FakeClient:
+    """Client answering calls from ``users``, by user_uuid: their institutions, and
+    records by institution and resource. Calls made are kept in ``calls``."""
+
+    def __init__(self, users):
+        self.users = users
+        self.calls = []
+        for name in ("institutions", *RESOURCES):
+            setattr(self, name, FakeResource(self, name))
+
+    async def aclose(self):
+        pass
+
+
+def same(a, b):
+    """Whether two feature values agree up to floating-point rounding."""
+    if a is None or b is None:
+        return a is b
+    return (
+        a == b
+        or (math.isnan(a) and math.isnan(b))
+        or math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+    )
@@ -0,0 +1,45 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+from fake_api import FakeClient, balance
+
+from pngme_feature_library.registry import load_feature
+
+FEATURE = "average_end_of_day_loan_balance"
+UTC_ENDTIME = datetime(2021, 10, 1)
+UTC_STARTTIME = UTC_ENDTIME - timedelta(days=30)
+INSTITUTIONS = [{"institution_id": "lender1", "account_types": ["loan"]}]
+
+
+def _client(account_type):
+    records = {"transactions": [], "balances": [], "alerts": []}
+    if account_type is not None:
+        record = balance(datetime(2021, 9, 15, 12), random.Random(0))
+        record["account_type"] = account_type
+        records["balances"].append(record)
+    return FakeClient({"user": (INSTITUTIONS, {"lender1": records})})
+
+
+def _compute(client):
+    return asyncio.run(
+        load_feature(FEATURE)(client, "user", UTC_STARTTIME, UTC_ENDTIME)
+    )
+
+
+def _pages_probed(client):
+    return [call for call in client.calls if call[0] == "balances" and call[3] == 1]
+
+
+def test_users_with_loan_balances_are_not_probed():
+    client = _client("loan")
+    assert _compute(client) > 0
+    assert _pages_probed(client) == []
+
+
+def test_users_without_loan_balances_are_probed():
+    client = _client("depository")
+    assert _compute(client) == 0.0
+    assert len(_pages_probed(client)) == 1
+
+    assert _compute(_client(None)) is None
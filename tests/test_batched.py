@@ -0,0 +1,90 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from fake_api import RESOURCES, FakeClient, make_users, same
+
+pd = pytest.importorskip("pandas")
+
+from pngme_feature_library.batched import BATCHED_FEATURES, Batch  # noqa: E402
+from pngme_feature_library.registry import load_feature  # noqa: E402
+
+NUM_USERS = 20
+
+
+def _windows(rng):
+    for _ in range(6):
+        utc_endtime = datetime(2021, 8, 1) + timedelta(days=rng.randrange(90))
+        # Half of the windows don't start at midnight
+        if rng.random() < 0.5:
+            utc_endtime += timedelta(seconds=rng.randrange(24 * 60 * 60))
+        yield utc_endtime - timedelta(days=rng.choice((1, 7, 30, 45))), utc_endtime
+
+
+def _tagged(users):
+    """Records of each user by resource, tagged with user_uuid and institution_id."""
+    tagged = {}
+    for user_uuid, (institutions, records) in users.items():
+        tagged[user_uuid] = {
+            "institutions": [
+                {"user_uuid": user_uuid, **institution} for institution in institutions
+            ]
+        }
+        for resource in RESOURCES:
+            tagged[user_uuid][resource] = [
+                {"user_uuid": user_uuid, "institution_id": institution_id, **record}
+                for institution_id, by_resource in records.items()
+                for record in by_resource[resource]
+            ]
+    return tagged
+
+
+def _listed(tagged):
+    return {
+        resource: [record for user in tagged.values() for record in user[resource]]
+        for resource in ("institutions", *RESOURCES)
+    }
+
+
+def _concatenated(tagged):
+    """One DataFrame per user and resource, concatenated as they come: the index of
+    each user's frame starts at 0."""
+    return {
+        resource: pd.concat([pd.DataFrame(user[resource]) for user in tagged.values()])
+        for resource in ("institutions", *RESOURCES)
+    }
+
+
+async def _parity(seed, records):
+    users = make_users(NUM_USERS, seed)
+    client = FakeClient(users)
+    # And a user unknown to the batch
+    user_uuids = [*users, "nobody"]
+    batch = Batch(**records(_tagged(users)), user_uuids=user_uuids)
+
+    mismatches = []
+    for utc_starttime, utc_endtime in _windows(random.Random(seed)):
+        values = batch.compute(list(BATCHED_FEATURES), utc_starttime, utc_endtime)
+        for user_uuid in user_uuids:
+            for name in BATCHED_FEATURES:
+                expected = await load_feature(name)(
+                    client, user_uuid, utc_starttime, utc_endtime
+                )
+                value = values.loc[user_uuid, name]
+                # NaN where the feature in lib/ returns None
+                if not same(value, float("nan") if expected is None else expected):
+                    mismatches.append(
+                        (user_uuid, name, utc_starttime, utc_endtime, expected, value)
+                    )
+    return mismatches
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_features_match_lib(seed):
+    assert asyncio.run(_parity(seed, _listed)) == []
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_features_of_concatenated_frames_match_lib(seed):
+    assert asyncio.run(_parity(seed, _concatenated)) == []
@@ -0,0 +1,140 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from pngme_feature_library.deadline import DeadlineClient, compute_within_budget
+from pngme_feature_library.registry import load_feature
+from pngme_feature_library.singleflight import SingleFlight
+
+FEATURE = "average_end_of_day_depository_balance"
+UTC_ENDTIME = datetime(2021, 10, 1)
+UTC_STARTTIME = UTC_ENDTIME - timedelta(days=30)
+
+INSTITUTIONS = [
+    {"institution_id": institution_id, "account_types": ["depository"]}
+    for institution_id in ("bank1", "bank2", "bank3")
+]
+
+
+def _balances(institution_id):
+    return [
+        {
+            "timestamp": f"2021-09-{day:02d}T12:00:00+00:00",
+            "balance": 1000.0 + 100 * day,
+            "account_id": f"{institution_id}-account",
+            "account_type": "depository",
+        }
+        for day in (2, 9, 16, 23)
+    ]
+
+
+def _transactions(institution_id):
+    return [
+        {
+            "timestamp": f"2021-09-{day:02d}T15:00:00+00:00",
+            "amount": 50.0,
+            "impact": "DEBIT",
+            "account_id": f"{institution_id}-account",
+            "account_type": "depository",
+        }
+        for day in (5, 12, 19)
+    ]
+
+
+class FakeResource:
+    def __init__(self, records, slow_institution_id, delay):
+        self.records = records
+        self.slow_institution_id = slow_institution_id
+        self.delay = delay
+
+    async def get(self, institution_id=None, **params):
+        if institution_id == self.slow_institution_id:
+            await asyncio.sleep(self.delay)
+        else:
+            await asyncio.sleep(0.01)
+        if institution_id is None:
+            return [dict(record) for record in INSTITUTIONS]
+        return [dict(record) for record in self.records(institution_id)]
+
+
+class FakeClient:
+    """Client whose calls for one institution's balances take ``delay`` seconds."""
+
+    def __init__(self, slow_institution_id=None, delay=0.0, missing=()):
+        def records(make):
+            return lambda institution_id: (
+                [] if institution_id in missing else make(institution_id)
+            )
+
+        self.institutions = FakeResource(None, None, 0.0)
+        self.balances = FakeResource(records(_balances), slow_institution_id, delay)
+        self.transactions = FakeResource(records(_transactions), None, 0.0)
+
+
+def test_calls_after_the_deadline_complete_features_fetching_in_rounds():
+    # The feature fetches balances, then transactions: the second round starts after
+    # the deadline, once bank1's balances are cut off
+    client = DeadlineClient(FakeClient(slow_institution_id="bank1", delay=2.0))
+
+    results = asyncio.run(
+        compute_within_budget(
+            client, "user", UTC_STARTTIME, UTC_ENDTIME, [FEATURE], budget=0.2
+        )
+    )
+
+    expected = asyncio.run(
+        load_feature(FEATURE)(
+            FakeClient(missing=("bank1",)), "user", UTC_STARTTIME, UTC_ENDTIME
+        )
+    )
+    result = results[FEATURE]
+    assert not result.missing
+    assert result.value == expected
+    assert result.completeness == "2 of 3 institutions"
+
+
+def test_calls_in_time_are_complete():
+    client = DeadlineClient(FakeClient())
+
+    results = asyncio.run(
+        compute_within_budget(
+            client, "user", UTC_STARTTIME, UTC_ENDTIME, [FEATURE], budget=1.0
+        )
+    )
+
+    expected = asyncio.run(
+        load_feature(FEATURE)(FakeClient(), "user", UTC_STARTTIME, UTC_ENDTIME)
+    )
+    assert results[FEATURE].complete
+    assert results[FEATURE].value == expected
+
+
+def test_concurrent_calls_share_computations_in_flight():
+    client = DeadlineClient(FakeClient())
+    in_flight = SingleFlight("features")
+    loaded = []
+
+    def feature(name):
+        loaded.append(name)
+        return load_feature(name)
+
+    async def compute_twice():
+        return await asyncio.gather(
+            *[
+                compute_within_budget(
+                    client,
+                    "user",
+                    UTC_STARTTIME,
+                    UTC_ENDTIME,
+                    [FEATURE],
+                    budget=1.0,
+                    feature=feature,
+                    in_flight=in_flight,
+                )
+                for _ in range(2)
+            ]
+        )
+
+    first, second = asyncio.run(compute_twice())
+    assert loaded == [FEATURE]
+    assert first[FEATURE] == second[FEATURE]
+    assert second[FEATURE].complete
@@ -0,0 +1,111 @@
+import math
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from pngme_feature_library import end_of_day
+
+pd = pytest.importorskip("pandas")
+_end_of_day_pandas = pytest.importorskip("pngme_feature_library._end_of_day_pandas")
+
+SEEDS = range(40)
+BALANCE_VALID_FOR_DAYS = 10
+
+
+@pytest.fixture(autouse=True)
+def python_backend(monkeypatch):
+    monkeypatch.setattr("pngme_feature_library.backend._backend", "python")
+
+
+def _timestamp(time):
+    return time.replace(tzinfo=timezone.utc).isoformat()
+
+
+def _history(rng, utc_starttime, utc_endtime):
+    history_start = utc_starttime - timedelta(days=BALANCE_VALID_FOR_DAYS)
+    seconds = int((utc_endtime - history_start).total_seconds())
+    accounts = [
+        (institution_id, account_id)
+        for institution_id in ("bank1", "bank2", "lender1")
+        for account_id in ("a1", "a2")
+        if rng.random() < 0.7
+    ]
+    # Features only compute end-of-day balances of users with balances
+    accounts = accounts or [("bank1", "a1")]
+    balances = [
+        {
+            "timestamp": _timestamp(
+                history_start + timedelta(seconds=rng.randrange(seconds))
+            ),
+            "balance": round(rng.uniform(-500, 10_000), rng.choice((0, 2))),
+            "institution_id": institution_id,
+            "account_id": account_id,
+        }
+        for institution_id, account_id in accounts
+        for _ in range(rng.randrange(1, 40))
+    ]
+    transactions = [
+        {
+            "timestamp": _timestamp(
+                history_start + timedelta(seconds=rng.randrange(seconds))
+            )
+        }
+        for _ in range(rng.randrange(60))
+    ]
+    return balances, transactions
+
+
+def _windows(rng):
+    utc_endtime = datetime(2021, 10, 1) + timedelta(minutes=rng.randrange(60 * 24 * 30))
+    midnight = utc_endtime.replace(hour=0, minute=0)
+    for days in (7, 30, 90):
+        yield utc_endtime - timedelta(days=days), utc_endtime
+        # Only windows starting at midnight have end-of-day balances
+        yield midnight - timedelta(days=days), utc_endtime
+
+
+def _same(a, b):
+    if a is None or b is None:
+        return a is b
+    return len(a) == len(b) and all(
+        x == y or (math.isnan(x) and math.isnan(y)) for x, y in zip(a, b)
+    )
+
+
+def _same_value(a, b):
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_daily_total_balances_match_pandas(seed):
+    rng = random.Random(seed)
+    for utc_starttime, utc_endtime in _windows(rng):
+        balances, transactions = _history(rng, utc_starttime, utc_endtime)
+        args = (utc_starttime, utc_endtime, BALANCE_VALID_FOR_DAYS)
+
+        expected = _end_of_day_pandas.daily_total_balances(
+            [dict(balance) for balance in balances], transactions, *args
+        )
+        totals = end_of_day.daily_total_balances(balances, transactions, *args)
+
+        assert _same(totals, expected)
+        if totals is not None:
+            series = pd.Series(expected, dtype=float)
+            assert _same_value(end_of_day.mean(totals), series.mean())
+            assert _same_value(end_of_day.median(totals), series.median())
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_mean_and_median_match_pandas(seed):
+    rng = random.Random(seed)
+    # Lengths on both sides of NumPy's pairwise summation blocks
+    for length in (0, 1, 7, 8, 9, 127, 128, 129, 300, 1000):
+        values = [
+            math.nan if rng.random() < 0.1 else rng.uniform(-1e6, 1e6)
+            for _ in range(length)
+        ]
+        series = pd.Series(values, dtype=float)
+
+        assert _same_value(end_of_day.mean(values), series.mean())
+        assert _same_value(end_of_day.median(values), series.median())
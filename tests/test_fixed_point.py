@@ -0,0 +1,81 @@
+import math
+import random
+
+from pngme_feature_library.fixed_point import MinorUnits
+from pngme_feature_library.records import (
+    fixed_point_amounts,
+    net_amounts,
+    sum_amounts,
+    sum_balances,
+    to_transactions,
+)
+
+INT64_MAX = 2**63 - 1
+
+
+def _transactions(amounts, impacts=None):
+    records = [
+        {
+            "timestamp": "2021-09-01T00:00:00+00:00",
+            "amount": amount,
+            "impact": "CREDIT" if impacts is None else impacts[index],
+        }
+        for index, amount in enumerate(amounts)
+    ]
+    return to_transactions([records], ["bank1"])
+
+
+def test_tenths_sum_exactly():
+    units = MinorUnits()
+    assert sum([0.1] * 10) != 1.0
+    assert units.decode(units.sum([0.1] * 10)) == 1.0
+
+    with fixed_point_amounts():
+        assert sum_amounts(_transactions([0.1] * 10)) == (1.0, 10)
+        assert sum_balances([0.1] * 10) == 1.0
+
+
+def test_totals_are_the_same_in_any_order():
+    rng = random.Random(0)
+    amounts = [round(rng.uniform(0.01, 10_000), 2) for _ in range(1000)] + [0.1] * 50
+    impacts = [rng.choice(("CREDIT", "DEBIT")) for _ in amounts]
+
+    sums = set()
+    nets = set()
+    float_sums = set()
+    for _ in range(20):
+        order = list(range(len(amounts)))
+        rng.shuffle(order)
+        shuffled = [amounts[index] for index in order]
+        transactions = _transactions(shuffled, [impacts[index] for index in order])
+        with fixed_point_amounts():
+            sums.add(sum_amounts(transactions))
+            nets.add(net_amounts(transactions))
+        float_sums.add(sum(shuffled))
+
+    # Floats depend on the order; fixed-point totals don't, and match them closely
+    assert len(float_sums) > 1
+    assert len(sums) == len(nets) == 1
+    ((total, count),) = sums
+    assert count == len(amounts)
+    assert math.isclose(total, math.fsum(amounts), rel_tol=1e-12)
+
+
+def test_large_totals_are_exact():
+    units = MinorUnits()
+    amount = 95_000_000_000_000_000.0
+    total = units.sum([amount] * 1000)
+    assert total == 1000 * 9_500_000_000_000_000_000
+    assert total > INT64_MAX
+
+    with fixed_point_amounts():
+        credits, count = sum_amounts(_transactions([amount] * 1000))
+    assert credits == units.decode(total) == 9.5e19
+    assert count == 1000
+
+
+def test_amounts_are_rounded_to_minor_units_half_to_even():
+    units = MinorUnits(decimals=2)
+    assert units.encode(12.345678) == 1235
+    assert units.encode(0.125) == 12
+    assert MinorUnits(decimals=0).encode(2.5) == 2
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+from pngme_feature_library.hedging import HedgePolicy, LatencyTracker
+from pngme_feature_library.pagination import PaginatedClient
+
+NUM_PAGES = 10
+
+
+class FakeTransactions:
+    """Pages answered in 10ms, but for the first request of ``slow_page``."""
+
+    def __init__(self):
+        self.slow_page = None
+        self.requests = []
+
+    async def _get_page(self, page=1, **params):
+        slow = page == self.slow_page and page not in self.requests
+        self.requests.append(page)
+        await asyncio.sleep(5.0 if slow else 0.01)
+        return {
+            "page": page,
+            "num_pages": NUM_PAGES,
+            "transactions": [{"page": page}],
+        }
+
+
+class FakeClient:
+    def __init__(self, transactions):
+        self.transactions = transactions
+
+
+def test_slow_pages_are_hedged():
+    transactions = FakeTransactions()
+    client = PaginatedClient(
+        FakeClient(transactions), hedge=HedgePolicy(max_hedge_rate=1.0, min_samples=5)
+    )
+
+    async def get_twice():
+        await client.transactions.get(user_uuid="user")
+        transactions.slow_page = 4
+        transactions.requests.clear()
+        started = time.perf_counter()
+        records = await client.transactions.get(user_uuid="user")
+        return records, time.perf_counter() - started
+
+    records, elapsed = asyncio.run(get_twice())
+    assert [record["page"] for record in records] == list(range(1, NUM_PAGES + 1))
+    assert elapsed < 1.0
+    # Only the slow page was requested twice
+    assert sorted(transactions.requests) == sorted([*range(1, NUM_PAGES + 1), 4])
+
+
+def test_requests_cancelled_for_their_hedge_count_in_the_percentile():
+    policy = HedgePolicy(max_hedge_rate=1.0)
+    # Small enough to sort its latencies on every observation
+    policy.trackers["transactions"] = LatencyTracker(size=50, min_samples=3)
+    attempts = []
+
+    async def request():
+        attempts.append(None)
+        # The first attempt of the 4th request hangs
+        await asyncio.sleep(5.0 if len(attempts) == 4 else 0.05)
+        return len(attempts)
+
+    async def requests():
+        results = [await policy.call("transactions", request) for _ in range(4)]
+        # Let the cancelled attempt unwind
+        await asyncio.sleep(0)
+        return results
+
+    assert asyncio.run(requests())[-1] == 5
+    # The hung attempt ran for the delay and the hedge's latency before it was
+    # cancelled, longer than any request that completed
+    assert policy.trackers["transactions"].percentile(100) > 0.09
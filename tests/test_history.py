@@ -0,0 +1,146 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from fake_api import FakeClient, make_users, same, transaction
+
+pyarrow = pytest.importorskip("pyarrow")
+
+from pngme_feature_library import history  # noqa: E402
+from pngme_feature_library.history import HistoryClient, HistoryStore  # noqa: E402
+from pngme_feature_library.registry import feature_names, load_feature  # noqa: E402
+
+INSTITUTIONS = [{"institution_id": "bank1", "account_types": ["depository"]}]
+
+NUM_USERS = 10
+# Every feature but those reading resources the store doesn't hold
+FEATURES = [name for name in feature_names() if name != "count_user_shared_device_ids"]
+WINDOWS = [
+    (datetime(2021, 8, 1), datetime(2021, 9, 1)),
+    (datetime(2021, 9, 3, 7, 30), datetime(2021, 9, 10, 7, 30)),
+    (datetime(2021, 7, 15, 12), datetime(2021, 10, 20)),
+]
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _records():
+    return {"transactions": [], "balances": [], "alerts": []}
+
+
+def _add_transaction(records, time):
+    records["transactions"].append(transaction(time, random.Random(0)))
+
+
+def test_ranges_fetched_before_they_settle_are_fetched_again(monkeypatch, tmp_path):
+    clock = Clock(datetime(2021, 9, 30, 12))
+    monkeypatch.setattr(history, "_now", clock)
+    records = _records()
+    api = FakeClient({"user0": (INSTITUTIONS, {"bank1": records})})
+    store = HistoryStore(
+        tmp_path, settling_period=timedelta(days=3), recheck=timedelta(minutes=10)
+    )
+    client = HistoryClient(api, store)
+
+    def get(utc_starttime, utc_endtime):
+        return asyncio.run(
+            client.transactions.get(
+                user_uuid="user0",
+                institution_id="bank1",
+                utc_starttime=utc_starttime,
+                utc_endtime=utc_endtime,
+            )
+        )
+
+    _add_transaction(records, datetime(2021, 9, 20, 9))
+    _add_transaction(records, datetime(2021, 9, 29, 9))
+    window = (datetime(2021, 9, 1), clock.now.replace(tzinfo=None))
+    assert len(get(*window)) == 2
+
+    # Synced late, and not seen until the window is rechecked
+    _add_transaction(records, datetime(2021, 9, 29, 10))
+    assert len(get(*window)) == 2
+    clock.now += timedelta(minutes=11)
+    assert len(get(*window)) == 3
+    # Records of the range fetched again are replaced, not duplicated
+    clock.now += timedelta(minutes=11)
+    assert len(get(*window)) == 3
+
+    # Settled ranges aren't fetched again
+    _add_transaction(records, datetime(2021, 9, 20, 10))
+    clock.now += timedelta(minutes=11)
+    assert len(get(*window)) == 3
+
+    # Without a client, ranges that haven't settled are read as stored
+    offline = HistoryClient(None, HistoryStore(tmp_path))
+    records_read = asyncio.run(
+        offline.transactions.get(
+            user_uuid="user0",
+            institution_id="bank1",
+            utc_starttime=window[0],
+            utc_endtime=window[1],
+        )
+    )
+    assert len(records_read) == 3
+
+
+async def _offline_parity(root, seed):
+    users = make_users(NUM_USERS, seed)
+    api = FakeClient(users)
+    online = HistoryClient(api, HistoryStore(root))
+    offline = HistoryClient(None, HistoryStore(root))
+
+    mismatches = []
+    for utc_starttime, utc_endtime in WINDOWS:
+        for user_uuid in users:
+            for name in FEATURES:
+                expected = await load_feature(name)(
+                    api, user_uuid, utc_starttime, utc_endtime
+                )
+                # Fetch and store, then compute from the store alone
+                value = await load_feature(name)(
+                    online, user_uuid, utc_starttime, utc_endtime
+                )
+                offline_value = await load_feature(name)(
+                    offline, user_uuid, utc_starttime, utc_endtime
+                )
+                if not (same(value, expected) and same(offline_value, expected)):
+                    mismatches.append((user_uuid, name, expected, value, offline_value))
+    return mismatches
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_features_computed_from_the_store_match_the_api(tmp_path, seed):
+    assert asyncio.run(_offline_parity(tmp_path, seed)) == []
+
+
+def test_read_table_is_columnar(tmp_path):
+    users = make_users(3, seed=0)
+    store = HistoryStore(tmp_path)
+    client = HistoryClient(FakeClient(users), store)
+    user_uuid, (institutions, _) = next(
+        (user_uuid, user) for user_uuid, user in users.items() if user[0]
+    )
+    window = (datetime(2021, 7, 1), datetime(2021, 11, 1))
+    records = asyncio.run(
+        client.transactions.get(
+            user_uuid=user_uuid,
+            institution_id=institutions[0]["institution_id"],
+            utc_starttime=window[0],
+            utc_endtime=window[1],
+        )
+    )
+
+    table = store.read_table(
+        "transactions", user_uuid, institutions[0]["institution_id"], *window
+    )
+    assert table is not None and isinstance(table, pyarrow.Table)
+    assert table.num_rows == len(records)
+    assert table.column("amount").to_pylist() == [r["amount"] for r in records]
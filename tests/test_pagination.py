@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from pngme_feature_library.pagination import PaginatedClient
+
+NUM_PAGES = 20
+
+
+class FakeTransactions:
+    def __init__(self, failing_page=None):
+        self.failing_page = failing_page
+        self.pages_fetched = []
+
+    async def _get_page(self, page=1, **params):
+        await asyncio.sleep(0.01 * page)
+        if page == self.failing_page:
+            raise RuntimeError(f"page {page} failed")
+        self.pages_fetched.append(page)
+        return {
+            "page": page,
+            "num_pages": NUM_PAGES,
+            "transactions": [{"page": page, "index": index} for index in range(3)],
+        }
+
+
+class FakeClient:
+    def __init__(self, transactions):
+        self.transactions = transactions
+
+
+def test_pages_are_returned_in_order():
+    transactions = FakeTransactions()
+    client = PaginatedClient(FakeClient(transactions))
+
+    records = asyncio.run(client.transactions.get(user_uuid="user"))
+
+    assert [record["page"] for record in records[::3]] == list(range(1, NUM_PAGES + 1))
+
+
+def test_a_failing_page_cancels_the_other_pages():
+    transactions = FakeTransactions(failing_page=3)
+    client = PaginatedClient(FakeClient(transactions))
+
+    async def get_then_wait():
+        with pytest.raises(RuntimeError):
+            await client.transactions.get(user_uuid="user")
+        fetched = len(transactions.pages_fetched)
+        # Workers still running would keep fetching pages
+        await asyncio.sleep(0.5)
+        return fetched
+
+    fetched = asyncio.run(get_then_wait())
+    assert len(transactions.pages_fetched) == fetched < NUM_PAGES
@@ -0,0 +1,33 @@
+import asyncio
+
+import httpx
+
+from pngme_feature_library._http import Response, start_http_server
+from pngme_feature_library.pool import ConnectionPool
+
+
+async def _ok(request):
+    return Response(200, b"{}")
+
+
+def test_connections_are_counted_per_host():
+    async def get_and_count():
+        server = await start_http_server(_ok, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        pool = ConnectionPool()
+        try:
+            async with httpx.AsyncClient(transport=pool.transport) as client:
+                for _ in range(3):
+                    response = await client.get(f"http://127.0.0.1:{port}/")
+                    assert response.status_code == 200
+            return pool.stats()
+        finally:
+            await pool.aclose()
+            server.close()
+            await server.wait_closed()
+
+    stats = asyncio.run(get_and_count())
+    # Requests sent one after the other reuse the same kept-alive connection
+    assert stats["127.0.0.1"]["idle"] == 1
+    assert stats["127.0.0.1"]["active"] == 0
+    assert stats["127.0.0.1"]["requests"] == 3
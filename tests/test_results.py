@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from pngme_feature_library import results
+from pngme_feature_library.results import MISSING, FeatureResultCache
+
+UTC_ENDTIME = datetime(2021, 10, 1)
+UTC_STARTTIME = UTC_ENDTIME - timedelta(days=30)
+VERSION = (("bank1", "transactions", 1632960000.0, 25),)
+KEY = ("sum_of_credits", "user", UTC_STARTTIME, UTC_ENDTIME, VERSION)
+
+
+def test_values_expire_after_the_ttl(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(results, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    cache = FeatureResultCache(ttl=60)
+
+    cache.set(*KEY, 12.5)
+    clock.now += 59
+    assert cache.get(*KEY) == 12.5
+
+    clock.now += 1
+    assert not cache.contains(*KEY)
+    assert cache.get(*KEY) is MISSING
+    assert len(cache) == 0
+
+
+def test_values_without_a_ttl_are_kept(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(results, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    cache = FeatureResultCache(ttl=None)
+
+    cache.set(*KEY, None)
+    clock.now += 10**6
+    assert cache.get(*KEY) is None
@@ -0,0 +1,92 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from fake_api import FakeClient, make_users, same, transaction
+
+from pngme_feature_library import rollups
+from pngme_feature_library.registry import load_feature
+from pngme_feature_library.rollups import ROLLUP_FEATURES, RollupStore
+
+NUM_USERS = 20
+ROLLED_UP = (datetime(2021, 6, 1), datetime(2021, 11, 1))
+
+
+def _windows(rng):
+    for _ in range(6):
+        utc_endtime = datetime(2021, 8, 1) + timedelta(days=rng.randrange(90))
+        yield utc_endtime - timedelta(days=rng.choice((1, 7, 30, 45))), utc_endtime
+
+
+async def _parity(seed):
+    users = make_users(NUM_USERS, seed)
+    client = FakeClient(users)
+    store = RollupStore()
+    for user_uuid in users:
+        await store.update(client, user_uuid, *ROLLED_UP)
+
+    mismatches = []
+    for utc_starttime, utc_endtime in _windows(random.Random(seed)):
+        # Rollups leave out records at exactly utc_endtime, which the API includes
+        api_endtime = utc_endtime - timedelta(microseconds=1)
+        for user_uuid in users:
+            for name in ROLLUP_FEATURES:
+                expected = await load_feature(name)(
+                    client, user_uuid, utc_starttime, api_endtime
+                )
+                value = store.compute(name, user_uuid, utc_starttime, utc_endtime)
+                if not same(value, expected):
+                    mismatches.append((user_uuid, name, expected, value))
+    return mismatches
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_features_match_lib(seed):
+    assert asyncio.run(_parity(seed)) == []
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_days_are_rolled_up_again_until_they_settle(monkeypatch):
+    clock = Clock(datetime(2021, 9, 30, 12))
+    monkeypatch.setattr(rollups, "_now", clock)
+    records = {"transactions": [], "balances": [], "alerts": []}
+    client = FakeClient(
+        {
+            "user0": (
+                [{"institution_id": "bank1", "account_types": ["depository"]}],
+                {"bank1": records},
+            )
+        }
+    )
+    store = RollupStore(settling_period=timedelta(days=3))
+    window = (datetime(2021, 9, 20), datetime(2021, 9, 30))
+
+    def add_transaction(time):
+        record = transaction(time, random.Random(0))
+        record.update(impact="CREDIT", account_type="depository")
+        records["transactions"].append(record)
+
+    add_transaction(datetime(2021, 9, 27, 9))
+    assert asyncio.run(store.update(client, "user0", datetime(2021, 9, 1))) == 29
+    assert store.count_transactions_depository("user0", *window) == 1
+
+    # Synced late, for a day rolled up before it settled
+    add_transaction(datetime(2021, 9, 28, 9))
+    clock.now += timedelta(days=1)
+    # The 3 unsettled days, and the new one
+    assert asyncio.run(store.update(client, "user0")) == 4
+    assert store.count_transactions_depository("user0", *window) == 2
+
+    # Synced late, for a day that had settled when it was rolled up
+    add_transaction(datetime(2021, 9, 26, 9))
+    clock.now += timedelta(days=1)
+    assert asyncio.run(store.update(client, "user0")) == 4
+    assert store.count_transactions_depository("user0", *window) == 2
@@ -0,0 +1,54 @@
+import asyncio
+import json
+
+from fake_api import FakeClient, make_users
+
+from pngme_feature_library._http import Request
+from pngme_feature_library.prefetch import PrefetchingClient
+from pngme_feature_library.server import FeatureServer
+from pngme_feature_library.singleflight import SingleFlightClient
+
+USER_UUID = "user0"
+QUERY = {"names": ["sum_of_credits,net_cash_flow"], "start": ["2021-09-01T00:00:00"]}
+
+
+def _server():
+    api = FakeClient(make_users(1, seed=0))
+    return api, FeatureServer(PrefetchingClient(SingleFlightClient(api)))
+
+
+def test_prefetch_requires_an_end():
+    _, server = _server()
+
+    response = asyncio.run(
+        server.handle(Request("POST", f"/users/{USER_UUID}/prefetch", QUERY, {}))
+    )
+
+    assert response.status == 400
+    assert json.loads(response.body) == {"error": "end is required to prefetch"}
+
+
+def test_feature_requests_use_the_prefetched_calls():
+    api, server = _server()
+    query = {**QUERY, "end": ["2021-10-01T00:00:00"]}
+
+    async def prefetch_then_get():
+        prefetched = await server.handle(
+            Request("POST", f"/users/{USER_UUID}/prefetch", query, {})
+        )
+        assert prefetched.status == 202
+        await asyncio.sleep(0.1)
+        calls = len(api.calls)
+        response = await server.handle(
+            Request("GET", f"/users/{USER_UUID}/features", query, {})
+        )
+        return calls, response
+
+    calls, response = asyncio.run(prefetch_then_get())
+    assert response.status == 200
+    assert set(json.loads(response.body)["features"]) == {
+        "sum_of_credits",
+        "net_cash_flow",
+    }
+    assert calls > 0
+    assert len(api.calls) == calls
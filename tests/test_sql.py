@@ -0,0 +1,68 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from fake_api import RESOURCES, FakeClient, make_users, same
+
+pytest.importorskip("duckdb")
+pytest.importorskip("pyarrow")
+
+from pngme_feature_library.history import HistoryClient, HistoryStore  # noqa: E402
+from pngme_feature_library.registry import load_feature  # noqa: E402
+from pngme_feature_library.sql import FEATURE_SQL, SQLBackend  # noqa: E402
+
+NUM_USERS = 20
+STORED = (datetime(2021, 6, 1), datetime(2021, 11, 1))
+
+
+def _windows(rng):
+    for _ in range(6):
+        utc_endtime = datetime(2021, 8, 1) + timedelta(days=rng.randrange(90))
+        # Half of the windows don't start at midnight
+        if rng.random() < 0.5:
+            utc_endtime += timedelta(seconds=rng.randrange(24 * 60 * 60))
+        yield utc_endtime - timedelta(days=rng.choice((1, 7, 30, 45))), utc_endtime
+
+
+async def _store(client, store, users):
+    history = HistoryClient(client, store)
+    for user_uuid, (institutions, _) in users.items():
+        await history.institutions.get(user_uuid=user_uuid)
+        for institution in institutions:
+            for resource in RESOURCES:
+                await getattr(history, resource).get(
+                    user_uuid=user_uuid,
+                    institution_id=institution["institution_id"],
+                    utc_starttime=STORED[0],
+                    utc_endtime=STORED[1],
+                )
+
+
+async def _parity(root, seed):
+    users = make_users(NUM_USERS, seed)
+    client = FakeClient(users)
+    store = HistoryStore(root)
+    await _store(client, store, users)
+    backend = SQLBackend(store)
+
+    mismatches = []
+    for utc_starttime, utc_endtime in _windows(random.Random(seed)):
+        values = backend.compute(utc_starttime, utc_endtime)
+        for user_uuid in users:
+            for name in FEATURE_SQL:
+                expected = await load_feature(name)(
+                    client, user_uuid, utc_starttime, utc_endtime
+                )
+                value = values[user_uuid][name]
+                if not same(value, expected):
+                    mismatches.append(
+                        (user_uuid, name, utc_starttime, utc_endtime, expected, value)
+                    )
+    backend.close()
+    return mismatches
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_features_match_lib(tmp_path, seed):
+    assert asyncio.run(_parity(tmp_path, seed)) == []